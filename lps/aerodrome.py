@@ -1,5 +1,6 @@
 import logging
 from functools import lru_cache
+from typing import Iterable
 
 import attrs
 from eth_defi.token import TokenDetails
@@ -7,8 +8,11 @@ from web3 import Web3
 from web3.contract import Contract
 from web3.types import BlockIdentifier
 
+from lps import multicall, metadata_cache
 from lps.contracts import create_contract_cached
 from lps.erc20 import fetch_erc20_details_cached, guess_is_stable_coin
+from lps.metadata_cache import PoolMeta
+from lps.position_index import PositionIndex
 from lps.utils import v3_math
 from lps.utils.config import resources_path, get_config
 
@@ -34,6 +38,10 @@ class CLPoolInfo:
         observationCardinalityNext: int
         unlocked: bool
 
+    @property
+    def address(self) -> str:
+        return self.contract.address
+
     def get_slot0(self, _: Web3, block: BlockIdentifier = 'latest') -> Slot0:
         return self.Slot0(
             *self.contract.functions.slot0().call(block_identifier=block))
@@ -68,6 +76,24 @@ class CLPoolInfo:
             return 1 / p
         return p
 
+def get_slot0_batched(
+        w3: Web3,
+        pools: Iterable[CLPoolInfo],
+        block: BlockIdentifier = 'latest') -> dict[str, CLPoolInfo.Slot0]:
+    """
+    Reads slot0 of all given pools in a single multicall.
+    Returns pool address -> slot0, every unique pool is queried once.
+    """
+    unique_pools = {pool.address: pool for pool in pools}
+    results = multicall.aggregate3(
+        w3,
+        [pool.contract.functions.slot0() for pool in unique_pools.values()],
+        block=block)
+    return {
+        addr: CLPoolInfo.Slot0(*slot0)
+        for addr, slot0 in zip(unique_pools.keys(), results, strict=True)
+    }
+
 @attrs.frozen
 class PositionInfo:
     """Internal representation of the position, collected from multiple contracts"""
@@ -114,6 +140,75 @@ class _RawNftPositionInfo:
     tokensOwed0: int
     tokensOwed1: int
 
+@attrs.frozen
+class UncollectedFees:
+    """Raw token amounts, same as `collect` would return at the block"""
+    nft_id: int
+    amount0: int
+    amount1: int
+
+def get_uncollected_fees_batched(
+        w3: Web3,
+        positions: Iterable[PositionInfo],
+        block: BlockIdentifier = 'latest') -> dict[int, UncollectedFees]:
+    """
+    Reads the positions from nft position manager, fee growth of their pools
+    and range ticks in a single multicall, so fees of any number of positions
+    cost one eth_call. Returns nft id -> uncollected fees.
+    """
+    positions = list(positions)
+    aero_nft_manager = create_contract_cached(
+        w3,
+        address=get_config().aerodrome.nft_position_manager,
+        abi_fname="aerodrome_nft_manager.json",
+    )
+    unique_pools = {pos.pool.address: pos.pool for pos in positions}
+    unique_ticks = list(dict.fromkeys(
+        (pos.pool.address, tick) for pos in positions for tick in (pos.tick_lower, pos.tick_upper)))
+
+    results = multicall.aggregate3(
+        w3,
+        [aero_nft_manager.functions.positions(pos.nft_id) for pos in positions] +
+        [func
+         for pool in unique_pools.values()
+         for func in (pool.contract.functions.slot0(),
+                      pool.contract.functions.feeGrowthGlobal0X128(),
+                      pool.contract.functions.feeGrowthGlobal1X128())] +
+        [unique_pools[addr].contract.functions.ticks(tick) for (addr, tick) in unique_ticks],
+        block=block)
+
+    raw_positions = [_RawNftPositionInfo(*result) for result in results[:len(positions)]]
+    pool_results = results[len(positions):len(positions) + 3 * len(unique_pools)]
+    # slot0 tick, feeGrowthGlobal0X128, feeGrowthGlobal1X128
+    pool_states = {
+        addr: (pool_results[3 * i][1], pool_results[3 * i + 1][0], pool_results[3 * i + 2][0])
+        for i, addr in enumerate(unique_pools)
+    }
+    # feeGrowthOutside0X128, feeGrowthOutside1X128
+    fee_growth_outside = {
+        key: (result[3], result[4])
+        for key, result in zip(unique_ticks, results[len(positions) + 3 * len(unique_pools):], strict=True)
+    }
+
+    ret = {}
+    for pos, raw in zip(positions, raw_positions, strict=True):
+        (tick, *fee_growth_global) = pool_states[pos.pool.address]
+        lower = fee_growth_outside[(pos.pool.address, pos.tick_lower)]
+        upper = fee_growth_outside[(pos.pool.address, pos.tick_upper)]
+        amounts = [
+            v3_math.get_fees_owed(
+                raw.liquidity,
+                v3_math.get_fee_growth_inside(
+                    pos.tick_lower, pos.tick_upper, tick, fee_growth_global[i], lower[i], upper[i]),
+                fee_growth_inside_last,
+                tokens_owed)
+            for i, (fee_growth_inside_last, tokens_owed) in enumerate((
+                (raw.feeGrowthInside0LastX128, raw.tokensOwed0),
+                (raw.feeGrowthInside1LastX128, raw.tokensOwed1)))
+        ]
+        ret[pos.nft_id] = UncollectedFees(pos.nft_id, *amounts)
+    return ret
+
 @lru_cache(maxsize=256)
 def _get_pool_info_cached(
         w3: Web3,
@@ -121,27 +216,40 @@ def _get_pool_info_cached(
         token1: TokenDetails,
         tickSpacing: int) -> CLPoolInfo:
 
-    cl_factory = create_contract_cached(
-        w3,
-        address=get_config().aerodrome.cl_factory,
-        abi_fname="aerodrome_cl_factory.json"
-    )
-    pool_addr = cl_factory.functions.getPool(
-        token0.contract.address, token1.contract.address, tickSpacing).call()
-    pool_contract = create_contract_cached(
-        w3,
-        address=pool_addr,
-        abi_fname="aerodrome_cl_pool.json"
-    )
-
-    pool_fee = pool_contract.functions.fee().call()
+    chain_id = metadata_cache.chain_id_cached(w3)
+    cache = metadata_cache.get_default()
+    meta = cache.get_pool(chain_id, token0.address, token1.address, tickSpacing)
+    if meta is None:
+        cl_factory = create_contract_cached(
+            w3,
+            address=get_config().aerodrome.cl_factory,
+            abi_fname="aerodrome_cl_factory.json"
+        )
+        pool_addr = cl_factory.functions.getPool(
+            token0.contract.address, token1.contract.address, tickSpacing).call()
+        pool_contract = create_contract_cached(
+            w3,
+            address=pool_addr,
+            abi_fname="aerodrome_cl_pool.json"
+        )
+        meta = PoolMeta(
+            address=pool_addr,
+            token0=token0.address,
+            token1=token1.address,
+            tick_spacing=tickSpacing,
+            fee_pips=pool_contract.functions.fee().call())
+        cache.put_pool(chain_id, meta)
 
     return CLPoolInfo(
         token0=token0,
         token1=token1,
         tick_spacing=tickSpacing,
-        fee_pips=pool_fee,
-        contract=pool_contract
+        fee_pips=meta.fee_pips,
+        contract=create_contract_cached(
+            w3,
+            address=meta.address,
+            abi_fname="aerodrome_cl_pool.json"
+        )
     )
 
 @lru_cache(maxsize=256)
@@ -156,7 +264,9 @@ def get_position_info_cached(
 
     position_info = _RawNftPositionInfo(
         *aero_nft_manager.functions.positions(nft_id).call(block_identifier=block))
+    return _position_info(w3, nft_id, position_info)
 
+def _position_info(w3: Web3, nft_id: int, position_info: _RawNftPositionInfo) -> PositionInfo:
     token0_details = fetch_erc20_details_cached(w3, position_info.token0)
     token1_details = fetch_erc20_details_cached(w3, position_info.token1)
 
@@ -174,12 +284,31 @@ def get_position_info_cached(
         pool=pool,
     )
 
-def all_user_positions(addr: str) -> list[PositionInfo]:
-    """ Note: only accounts for the staked positions """
-    # Needs indexing or can use alchemy_getAssetTransfers to see al nft transfers
-    # Or query all gauges on-by-one. Easier to write nft id's by hand for now.
-    raise Exception("Not implemented")
+def all_user_positions(w3: Web3, index: PositionIndex, addr: str) -> list[PositionInfo]:
+    """
+    Returns not burned positions of the address, staked or not.
+    Ownership is as of the last `index.update()`, address should be watched.
+    Positions are read in a single multicall and never cached, as liquidity
+    of a position changes with increases and decreases.
+    """
+    aero_nft_manager = create_contract_cached(
+        w3,
+        address=get_config().aerodrome.nft_position_manager,
+        abi_fname="aerodrome_nft_manager.json",
+    )
+    nft_ids = sorted(index.token_ids(addr))
+    results = multicall.aggregate3(
+        w3, [aero_nft_manager.functions.positions(nft_id) for nft_id in nft_ids])
+    return [
+        _position_info(w3, nft_id, _RawNftPositionInfo(*result))
+        for nft_id, result in zip(nft_ids, results, strict=True)
+    ]
 
 def clear_caches():
     get_position_info_cached.cache_clear()
     _get_pool_info_cached.cache_clear()
+
+def invalidate_pool(w3: Web3, pool_address: str):
+    """Pool fee is read again, e.g. after the fee was changed"""
+    metadata_cache.get_default().invalidate_pool(metadata_cache.chain_id_cached(w3), pool_address)
+    clear_caches()
@@ -0,0 +1,218 @@
+import logging
+from decimal import Decimal
+from typing import Callable, Iterable, Tuple
+
+import attrs
+import numpy as np
+
+from lps import hedger, erc20
+from lps.aerodrome import PositionInfo
+from lps.utils import v3_math
+from lps.utils.config import get_config
+
+logger = logging.getLogger('backtest')
+
+HedgeComputer = Callable[[Iterable[Tuple[PositionInfo, int]]], dict[str, Decimal]]
+
+# MockCEX rounds every order to 4 decimals, keep hedge sizes in these lots
+# so that position sizes are exact and don't accumulate float errors.
+LOTS_PER_UNIT = 10**4
+
+@attrs.frozen
+class BacktestResult:
+    """
+    Results of the batch backtest. Per path arrays have shape (num_sims,).
+    Per step arrays have shape (n_steps, num_sims) and are only filled
+    when requested with `keep_paths`.
+    """
+    starting_pos_value: np.ndarray
+    final_pos_value: np.ndarray
+    hedge_pnl: np.ndarray
+    trade_count: np.ndarray
+
+    ticks: np.ndarray | None = None
+    pos_value: np.ndarray | None = None
+    hedge_value: np.ndarray | None = None
+    hedge_size: np.ndarray | None = None
+
+    @property
+    def pnl_no_hedge(self) -> np.ndarray:
+        return self.final_pos_value - self.starting_pos_value
+
+    @property
+    def pnl(self) -> np.ndarray:
+        return self.pnl_no_hedge + self.hedge_pnl
+
+def gbm_price_paths(
+        starting_price: float,
+        sigma_per_day: float,
+        num_sims: int,
+        num_days: int,
+        step_len_sec: int,
+        seed: int) -> np.ndarray:
+    """
+    Generates (n_steps, num_sims) matrix of geometric brownian motion prices
+    """
+    np.random.seed(seed) # make it repeatable
+    mu = 0.0   # assume delta neutral behavior
+    T = num_days
+    n = T * (24 * 60 * 60 // step_len_sec)
+    # calc each time step
+    dt = T/n
+    # simulation using numpy arrays
+    St = np.exp(
+        (mu - sigma_per_day ** 2 / 2) * dt
+        + sigma_per_day * np.random.normal(0, np.sqrt(dt), size=(num_sims, n-1)).T
+    )
+    # include array of 1's
+    St = np.vstack([np.ones(num_sims), St])
+    # multiply through by S0 and return the cumulative product of elements along a given simulation path (axis=0).
+    St = float(starting_price) * St.cumprod(axis=0)
+    return St
+
+def _get_hedge_symbol(pos: PositionInfo) -> str:
+    # Prices are given as token0 in units of token1, so only volatile/stable
+    # pools can be valued without a second price path.
+    assert not erc20.guess_is_stable_coin(pos.token0), "token0 must be volatile"
+    assert erc20.guess_is_stable_coin(pos.token1), "token1 must be a stable coin"
+    return erc20.canonical_symbol(pos.token0.symbol)
+
+def prices_to_ticks(pos: PositionInfo, prices: np.ndarray) -> np.ndarray:
+    """Converts human prices (token0 in token1) into the pool ticks"""
+    raw_prices = prices / 10**(pos.token0.decimals - pos.token1.decimals)
+    return np.floor(
+        np.log(raw_prices) / np.log(float(v3_math.TICK_BASE))).astype(np.int64)
+
+def _tabulate_hedges(
+        hedge_computer: HedgeComputer,
+        pos: PositionInfo,
+        symbol: str,
+        tick_min: int,
+        tick_max: int) -> (np.ndarray, np.ndarray):
+    """
+    Runs the hedge computer once for every tick in [tick_min, tick_max].
+    Returns (hedge size, is hedge emitted) tables indexed by `tick - tick_min`.
+    Hedge computers are stateless functions of the tick, so this gives exactly
+    the same hedges as calling them on every step.
+    """
+    num_ticks = tick_max - tick_min + 1
+    sizes = np.zeros(num_ticks)
+    emitted = np.zeros(num_ticks, dtype=bool)
+    for i, tick in enumerate(range(tick_min, tick_max + 1)):
+        hedges = hedge_computer([(pos, tick)])
+        if symbol in hedges:
+            sizes[i] = float(hedges[symbol])
+            emitted[i] = True
+    return sizes, emitted
+
+def _tabulate_amounts(
+        pos: PositionInfo, tick_min: int, tick_max: int) -> (np.ndarray, np.ndarray):
+    """
+    Returns human (amount0, amount1) tables indexed by `tick - tick_min`.
+    """
+    table = v3_math.make_sqrt_price_table(
+        min(tick_min, pos.tick_lower), max(tick_max, pos.tick_upper))
+    (amount0, amount1) = v3_math.get_amounts_at_ticks(
+        pos.tick_lower, pos.tick_upper, pos.liquidity,
+        np.arange(tick_min, tick_max + 1), sqrt_price=table)
+    return (amount0 / 10**pos.token0.decimals,
+            amount1 / 10**pos.token1.decimals)
+
+def run(
+        pos: PositionInfo,
+        prices: np.ndarray,
+        hedge_computer: HedgeComputer,
+        rehedge_every_n: int = 0,
+        initial_usd: int = 2000,
+        keep_paths: bool = False,
+        max_unhedged_value: Decimal | None = None) -> BacktestResult:
+    """
+    Backtests hedging of a single position over all price paths at once.
+    `prices` is (n_steps, num_sims) matrix of token0 prices in usd, as
+    returned by `simulate.get_price_path`.
+
+    Replicates `simulate.scenario2`: on every rehedge step hedges are computed
+    with `hedge_computer`, filtered the same way as in
+    `hedger.compute_hedge_adjustments` and executed as MockCEX market orders.
+    `max_unhedged_value` defaults to the hl_hedger config.
+    Note: doesn't model MockCEX insufficient balance errors.
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    if prices.ndim == 1:
+        prices = prices[:, np.newaxis]
+    n_steps, num_sims = prices.shape
+
+    symbol = _get_hedge_symbol(pos)
+    ticks = prices_to_ticks(pos, prices)
+    tick_min, tick_max = int(ticks.min()), int(ticks.max())
+    tick_idx = ticks - tick_min
+
+    hedge_table, emitted_table = _tabulate_hedges(
+        hedge_computer, pos, symbol, tick_min, tick_max)
+    hedge_table_lots = hedge_table * LOTS_PER_UNIT
+    amount0_table, amount1_table = _tabulate_amounts(pos, tick_min, tick_max)
+
+    def pos_value_at(step_idx):
+        return (amount0_table[tick_idx[step_idx]] * prices[step_idx]
+                + amount1_table[tick_idx[step_idx]])
+
+    min_order_usd = float(hedger.MIN_ORDER_USD)
+    eps = float(hedger.EPS)
+    if max_unhedged_value is None:
+        max_unhedged_value = get_config().hl_hedger.max_unhedged_value
+    max_unhedged_value = float(max_unhedged_value)
+
+    rehedge_steps = np.arange(0, n_steps, max(rehedge_every_n, 1))
+
+    usd_balance = np.full(num_sims, float(initial_usd))
+    szi_lots = np.zeros(num_sims, dtype=np.int64)
+    trade_count = np.zeros(num_sims, dtype=np.int64)
+
+    if keep_paths:
+        balance_at_rehedge = np.empty((len(rehedge_steps), num_sims))
+        szi_at_rehedge = np.empty((len(rehedge_steps), num_sims))
+
+    # Hedge state depends on the previous step, so this has to be sequential
+    # over time, but every path is processed at once.
+    for j, i in enumerate(rehedge_steps):
+        price = prices[i]
+        optimal_lots = hedge_table_lots[tick_idx[i]]
+
+        diff = np.abs(optimal_lots - np.abs(szi_lots)) * price / LOTS_PER_UNIT
+        optimal_value = optimal_lots * price / LOTS_PER_UNIT
+        should_update = (
+            emitted_table[tick_idx[i]]
+            & (diff >= min_order_usd)
+            & ((optimal_value < eps) | (diff > max_unhedged_value)))
+
+        order_lots = np.where(
+            should_update, np.rint(-optimal_lots - szi_lots), 0).astype(np.int64)
+        usd_balance -= order_lots * price / LOTS_PER_UNIT
+        szi_lots += order_lots
+        trade_count += should_update
+
+        if keep_paths:
+            balance_at_rehedge[j] = usd_balance
+            szi_at_rehedge[j] = szi_lots / LOTS_PER_UNIT
+
+    final_hedge_value = usd_balance + szi_lots * prices[-1] / LOTS_PER_UNIT
+
+    result = dict(
+        starting_pos_value=pos_value_at(0),
+        final_pos_value=pos_value_at(-1),
+        hedge_pnl=final_hedge_value - initial_usd,
+        trade_count=trade_count,
+    )
+
+    if keep_paths:
+        last_rehedge = np.arange(n_steps) // max(rehedge_every_n, 1)
+        hedge_size = szi_at_rehedge[last_rehedge]
+        result.update(
+            ticks=ticks,
+            pos_value=pos_value_at(slice(None)),
+            hedge_value=balance_at_rehedge[last_rehedge] + hedge_size * prices,
+            hedge_size=hedge_size,
+        )
+
+    logger.debug(f'Backtested {num_sims} paths of {n_steps} steps')
+    return BacktestResult(**result)
@@ -0,0 +1,320 @@
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import logging
+import platform
+import sys
+import tempfile
+import time
+import timeit
+from decimal import Decimal
+from pathlib import Path
+from typing import Callable
+
+import attrs
+import ccxt
+from web3 import Web3
+from eth_defi.event_reader.fast_json_rpc import patch_web3
+
+from lps import hedger, sweep, rpc_cassette, log_indexer, rpc_batch, replay, metrics
+from lps.aerodrome import PositionInfo
+from lps.connectors import mock_cex, binance, candle_store
+from lps.utils import v3_math
+from lps.utils.config import data_path
+
+logger = logging.getLogger('bench')
+
+# Benchmark setup returns the function which is timed
+Benchmark = Callable[[], Callable[[], object]]
+
+MIN_TIME_SEC = 0.2 # per repeat
+REPEAT = 5
+DEFAULT_THRESHOLD = 0.2
+
+def bench_path() -> Path:
+    return data_path() / 'bench'
+
+def _make_positions(count: int) -> list[tuple[PositionInfo, int]]:
+    """WETH/USDC positions of different widths, all in range"""
+    params = sweep.SweepParams()
+    templates = [sweep.make_position(width, params) for width in (400, 800, 1600, 3200, 6400)]
+    return [
+        (attrs.evolve(templates[i % len(templates)], nft_id=i), params.center_tick + i % 100)
+        for i in range(count)
+    ]
+
+def _mock_cex_at_tick(tick: int) -> mock_cex.MockCEX:
+    cex = mock_cex.start(2000)
+    cex.set_mid_prices({'ETH': v3_math.tick_to_price(tick) * 10**12})
+    return cex
+
+def _bench_get_amounts_at_tick():
+    pos, tick = _make_positions(1)[0]
+    return lambda: v3_math.get_amounts_at_tick(
+        pos.tick_lower, pos.tick_upper, pos.liquidity, tick)
+
+def _bench_compute_hedges(hedge_computer, num_positions: int) -> Benchmark:
+    def setup():
+        positions = _make_positions(num_positions)
+        return lambda: hedge_computer(positions)
+    return setup
+
+def _bench_compute_hedge_adjustments():
+    pos, tick = _make_positions(1)[0]
+    cex = _mock_cex_at_tick(tick)
+    cex.position_sizes['ETH'] = Decimal('-0.1')
+    hedges = hedger.compute_hedges([(pos, tick)])
+    return lambda: hedger.compute_hedge_adjustments(cex, hedges)
+
+def _bench_simulate_step():
+    """Price moves by 10 ticks on every call, so some steps trade"""
+    from lps import simulate
+
+    pos, _ = _make_positions(1)[0]
+    ticks = itertools.cycle(itertools.chain(
+        range(pos.tick_lower - 100, pos.tick_upper + 100, 10),
+        range(pos.tick_upper + 100, pos.tick_lower - 100, -10)))
+    cex = _mock_cex_at_tick(pos.tick_lower)
+    cex.usd_balance = Decimal(10**9)
+
+    def step():
+        tick = next(ticks)
+        cex.set_mid_prices({'ETH': v3_math.tick_to_price(tick) * 10**12})
+        return simulate.step(pos, tick, hedger.compute_hedges_fixed_step, conn=cex)
+    return step
+
+def _bench_metrics_span():
+    def empty_span():
+        with metrics.span('bench'):
+            pass
+    return empty_span
+
+def _bench_replay(num_blocks: int) -> Benchmark:
+    """Tick moves by a tick every 2 blocks on average, mid changes every 30 blocks"""
+    def setup():
+        pos, _ = _make_positions(1)[0]
+        pool_addr = Web3.to_checksum_address(f'0x{1:040x}')
+        pos = attrs.evolve(
+            pos, pool=attrs.evolve(pos.pool, contract=Web3().eth.contract(address=pool_addr)))
+        ticks = [pos.tick_lower + (i // 2) % (pos.tick_upper - pos.tick_lower) for i in range(num_blocks)]
+        history = [
+            replay.BlockRecord(
+                number=i, timestamp=2 * i, ticks={pool_addr: tick},
+                mids={'ETH': float(v3_math.tick_to_price(ticks[i // 30 * 30]) * 10**12)})
+            for (i, tick) in enumerate(ticks)]
+        return lambda: replay.replay([pos], history, hedger.compute_hedges_fixed_step)
+    return setup
+
+def stats_cassette_path() -> Path:
+    return bench_path() / 'stats_cassette.json'
+
+def _candles_path(cassette_path: Path) -> Path:
+    return cassette_path.parent / f'{cassette_path.stem}_candles.json'
+
+def _ohlcv_key(symbol: str, timeframe: str, since: int, limit: int) -> str:
+    return json.dumps([symbol, timeframe, since, limit])
+
+@attrs.define
+class _CandleRecorder:
+    """Exchange which records candles fetched during the stats recording"""
+    exchange: ccxt.Exchange
+    responses: dict[str, list] = attrs.field(factory=dict)
+
+    def fetch_ohlcv(self, symbol: str, timeframe: str, since: int, limit: int) -> list:
+        candles = self.exchange.fetch_ohlcv(symbol, timeframe, since, limit)
+        self.responses[_ohlcv_key(symbol, timeframe, since, limit)] = candles
+        return candles
+
+    def __getattr__(self, name: str):
+        return getattr(self.exchange, name)
+
+@attrs.frozen
+class _CandleCassette:
+    """Exchange which replays recorded candles, anything else fails instead of going online"""
+    responses: dict[str, list]
+    markets: dict = attrs.field(factory=dict)
+
+    def fetch_ohlcv(self, symbol: str, timeframe: str, since: int, limit: int) -> list:
+        key = _ohlcv_key(symbol, timeframe, since, limit)
+        if key not in self.responses:
+            raise RuntimeError(f'Candles {key} are not recorded')
+        return self.responses[key]
+
+    def __getattr__(self, name: str):
+        raise RuntimeError(f'{name} is not recorded')
+
+def _run_stats(node_url: str, a_binance: binance.Binance, user_addr: str):
+    """Full stats run on a fresh node connection and log index"""
+    from lps import stats
+
+    w3 = Web3(Web3.HTTPProvider(node_url))
+    patch_web3(w3)
+    w3.middleware_onion.clear()
+
+    with tempfile.TemporaryDirectory() as tmp_dir, \
+            contextlib.redirect_stdout(io.StringIO()):
+        indexer = log_indexer.start(w3, Path(tmp_dir) / 'logs.sqlite')
+        rpc = rpc_batch.start(w3)
+        stats.print_user_positions(w3, indexer, rpc, a_binance, user_addr)
+
+def record_stats(node_url: str, user_addr: str, path: Path | None = None):
+    """Records node responses of the stats run for the `stats` benchmark"""
+    path = path or stats_cassette_path()
+    server = rpc_cassette.start(path, upstream_url=node_url)
+    a_binance = binance.start()
+    exchange = _CandleRecorder(a_binance.exchange)
+    try:
+        # Empty candle store, so every page is fetched and recorded
+        with tempfile.TemporaryDirectory() as candles_dir:
+            _run_stats(server.url, attrs.evolve(
+                a_binance, candles=candle_store.start(exchange, Path(candles_dir))), user_addr)
+    finally:
+        server.stop()
+    _candles_path(path).write_text(json.dumps(exchange.responses))
+    (path.parent / f'{path.stem}_user.txt').write_text(user_addr)
+
+def _bench_stats():
+    path = stats_cassette_path()
+    user_addr = (path.parent / f'{path.stem}_user.txt').read_text().strip()
+    exchange = _CandleCassette(json.loads(_candles_path(path).read_text()))
+    server = rpc_cassette.start(path)
+
+    # Finished pages of the recorded candles are the same on every run
+    a_binance = binance.Binance(
+        exchange=exchange,
+        candles=candle_store.start(exchange, path.parent / f'{path.stem}_candles'),
+        tickers=binance.TickerSnapshot(exchange=exchange, ttl_sec=1))
+    return lambda: _run_stats(server.url, a_binance, user_addr)
+
+BENCHMARKS: dict[str, Benchmark] = {
+    'v3_math.get_amounts_at_tick': _bench_get_amounts_at_tick,
+    **{
+        f'hedger.{name}[{n}]': _bench_compute_hedges(func, n)
+        for name, func in sweep.STRATEGIES.items()
+        for n in (1, 100, 10_000)
+    },
+    'hedger.compute_hedge_adjustments': _bench_compute_hedge_adjustments,
+    'simulate.step': _bench_simulate_step,
+    'metrics.span': _bench_metrics_span,
+    'replay[10000]': _bench_replay(10_000),
+    'stats': _bench_stats,
+}
+
+@attrs.frozen
+class BenchResult:
+    median_sec: float # per call
+    min_sec: float
+    number: int # calls per repeat
+    repeat: int
+
+def time_benchmark(func: Callable[[], object], repeat: int = REPEAT) -> BenchResult:
+    timer = timeit.Timer(func)
+    # Same as timer.autorange, but with configurable min time
+    number = 1
+    while (elapsed := timer.timeit(number)) < MIN_TIME_SEC:
+        number = max(number * 2, int(number * MIN_TIME_SEC / max(elapsed, 1e-9)))
+    times = sorted(t / number for t in timer.repeat(repeat=repeat, number=number))
+    return BenchResult(
+        median_sec=times[len(times) // 2],
+        min_sec=times[0],
+        number=number,
+        repeat=repeat)
+
+def run_benchmarks(names: list[str], repeat: int = REPEAT) -> dict[str, BenchResult]:
+    ret = {}
+    for name in names:
+        try:
+            func = BENCHMARKS[name]()
+        except FileNotFoundError as e:
+            logger.warning(f'Skipping {name}, no recording: {e}')
+            continue
+        ret[name] = time_benchmark(func, repeat)
+        logger.info(f'{name}: {ret[name].median_sec * 1e6:.1f}us')
+    return ret
+
+def to_json(results: dict[str, BenchResult]) -> dict:
+    return {
+        'created_at': int(time.time()),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': {name: attrs.asdict(res) for name, res in results.items()},
+    }
+
+def from_json(data: dict) -> dict[str, BenchResult]:
+    return {name: BenchResult(**res) for name, res in data['results'].items()}
+
+@attrs.frozen
+class Regression:
+    name: str
+    baseline_sec: float
+    current_sec: float
+
+    @property
+    def ratio(self) -> float:
+        return self.current_sec / self.baseline_sec
+
+def compare(
+        current: dict[str, BenchResult],
+        baseline: dict[str, BenchResult],
+        threshold: float = DEFAULT_THRESHOLD) -> list[Regression]:
+    """
+    Returns benchmarks which are more than `threshold` (0.2 is 20%)
+    slower than the baseline. Benchmarks missing in either are ignored.
+    """
+    return [
+        Regression(name, baseline[name].median_sec, res.median_sec)
+        for name, res in current.items()
+        if name in baseline
+            and res.median_sec > baseline[name].median_sec * (1 + threshold)
+    ]
+
+def main() -> int:
+    import logging.config
+    from lps.utils.config import load_configuration, logging_config, get_config
+
+    parser = argparse.ArgumentParser(description='Offline benchmarks')
+    parser.add_argument('--config', default='dev')
+    parser.add_argument('-k', '--filter', default='', help='run benchmarks containing this')
+    parser.add_argument('--baseline', type=Path, default=bench_path() / 'baseline.json')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--record-stats', metavar='USER_ADDR',
+                        help='record node responses for the stats benchmark, needs the node')
+    args = parser.parse_args()
+
+    load_configuration(args.config)
+    logging.config.dictConfig(logging_config())
+
+    if args.record_stats:
+        record_stats(get_config().base_node_url, args.record_stats)
+        return 0
+
+    names = [name for name in BENCHMARKS if args.filter in name]
+    results = run_benchmarks(names, args.repeat)
+
+    out_path = bench_path() / f'bench_{int(time.time())}.json'
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    out_path.write_text(json.dumps(to_json(results), indent=2))
+
+    baseline = from_json(json.loads(args.baseline.read_text())) \
+        if args.baseline.is_file() else {}
+    for name, res in results.items():
+        base = f'{baseline[name].median_sec * 1e6:12.1f}us' if name in baseline else ' ' * 14
+        print(f'{name:45} {res.median_sec * 1e6:12.1f}us {base}')
+    print(f'Written to {out_path}')
+
+    if args.save_baseline:
+        args.baseline.write_text(out_path.read_text())
+        print(f'Saved baseline to {args.baseline}')
+        return 0
+
+    regressions = compare(results, baseline, args.threshold)
+    for r in regressions:
+        print(f'REGRESSION {r.name}: {r.baseline_sec * 1e6:.1f}us -> {r.current_sec * 1e6:.1f}us ({r.ratio:.2f}x)')
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,13 @@
+import logging
 from abc import ABC
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
-from typing import Protocol
+from typing import Protocol, runtime_checkable
 
 import attrs
 
+logger = logging.getLogger('connectors')
+
 class ConnectorException(Exception):
     pass
 
@@ -16,6 +20,15 @@ class CanDoOrders(Protocol):
     def market_order(self, name: str, size: Decimal):
         ...
 
+@runtime_checkable
+class CanDoBulkOrders(Protocol):
+    def market_orders(self, orders: dict[str, Decimal]) -> dict[str, Decimal]:
+        """
+        Executes all (name -> size) orders together.
+        Returns (name -> size which was not executed), zero for complete orders.
+        """
+        ...
+
 class HasAssetPositions(Protocol):
     def get_mid_prices(self, *names: str) -> dict[str, Decimal]:
         ...
@@ -33,3 +46,36 @@ def adjust_position(
     if diff == 0:
         return
     orderer.market_order(name, diff) # exception on failure
+
+def adjust_positions(
+        orderer: CanDoOrders,
+        adjustments: dict[str, tuple[Decimal, Decimal]]) -> dict[str, bool]:
+    """
+    Same as `adjust_position` for every (name -> (from_size, to_size)), but
+    all orders are submitted at once: with a single bulk order if connector
+    supports it, otherwise concurrently.
+    Returns (name -> True if position was adjusted).
+    """
+    diffs = {name: to_size - from_size for name, (from_size, to_size) in adjustments.items()}
+    ret = {name: True for name, diff in diffs.items() if diff == 0}
+    orders = {name: diff for name, diff in diffs.items() if diff != 0}
+    if len(orders) == 0:
+        return ret
+
+    if isinstance(orderer, CanDoBulkOrders):
+        not_executed = orderer.market_orders(orders)
+        return ret | {name: not_executed[name] == 0 for name in orders}
+
+    def order(name: str) -> bool:
+        try:
+            orderer.market_order(name, orders[name])
+            return True
+        except ConnectorException:
+            logger.exception(f'Failed to execute order {name} {orders[name]}')
+            return False
+
+    if len(orders) == 1:
+        return ret | {name: order(name) for name in orders}
+
+    with ThreadPoolExecutor(max_workers=len(orders)) as pool:
+        return ret | dict(zip(orders, pool.map(order, orders)))
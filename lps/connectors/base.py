@@ -1,23 +1,180 @@
+import json
 import logging
+import time
+from typing import Protocol
 
+import attrs
 import requests
+from hexbytes import HexBytes
 from eth_defi.chain import install_retry_middleware
+from eth_defi.event_reader.block_time import measure_block_time
 from eth_defi.event_reader.fast_json_rpc import patch_web3
 from web3 import Web3
+from websockets.sync.client import connect, ClientConnection
 
+from lps import metrics, metadata_cache
+from lps.connectors import rpc_pool
+from lps.connectors.abs import ConnectorException
 from lps.utils.config import get_config
 
 logger = logging.getLogger('base_w3')
 
+class BlockFeedException(ConnectorException):
+    pass
+
 def create_base_web3() -> Web3:
     logger.info('Starting')
 
-    session = requests.Session()
-    w3 = Web3(Web3.HTTPProvider(get_config().base_node_url, session=session))
+    urls = get_config().get('base_node_urls')
+    if urls:
+        # Reads are routed to the freshest and fastest of the nodes
+        w3 = Web3(rpc_pool.start(urls))
+    else:
+        session = requests.Session()
+        w3 = Web3(Web3.HTTPProvider(get_config().base_node_url, session=session))
     patch_web3(w3)
 
     w3.middleware_onion.clear()
     install_retry_middleware(w3)
+    w3.middleware_onion.add(metrics.rpc_counter_middleware, 'rpc_counter')
 
     logger.info('Started')
     return w3
+
+def close_base_web3(w3: Web3):
+    if isinstance(w3.provider, rpc_pool.RpcPoolProvider):
+        w3.provider.stop()
+
+@attrs.frozen
+class BlockHeader:
+    number: int
+    timestamp: int
+    # Optional, allow to skip reading logs of the blocks that can't have them
+    hash: HexBytes | None = None
+    parent_hash: HexBytes | None = None
+    logs_bloom: HexBytes | None = None
+
+class BlockFeed(Protocol):
+    def next_block(self, timeout_sec: float) -> BlockHeader | None:
+        """
+        Blocks until the next block arrives. Returns None if nothing arrived
+        within timeout, so that caller can check if it should stop.
+        """
+        ...
+
+    def close(self):
+        ...
+
+@attrs.define
+class PollingBlockFeed:
+    """
+    Polls for the latest block once per block time.
+    Processing time between the calls is subtracted from the sleep.
+    """
+    w3: Web3
+    block_time_sec: float
+
+    last_number: int = -1
+    next_poll_time: float = 0
+
+    def next_block(self, timeout_sec: float) -> BlockHeader | None:
+        deadline = time.time() + timeout_sec
+        while True:
+            time.sleep(max(0.0, min(self.next_poll_time, deadline) - time.time()))
+            if time.time() < self.next_poll_time:
+                return None # timed out
+
+            poll_time = time.time()
+            with metrics.span('get_block'):
+                block = self.w3.eth.get_block('latest')
+            if block['number'] != self.last_number:
+                self.last_number = block['number']
+                self.next_poll_time = poll_time + self.block_time_sec
+                return BlockHeader(
+                    number=block['number'],
+                    timestamp=block['timestamp'],
+                    hash=HexBytes(block['hash']),
+                    parent_hash=HexBytes(block['parentHash']),
+                    logs_bloom=HexBytes(block['logsBloom']))
+
+            # Block was late, check again a bit later
+            self.next_poll_time = poll_time + self.block_time_sec / 10
+            if time.time() >= deadline:
+                return None
+
+    def close(self):
+        pass
+
+@attrs.define
+class NewHeadsBlockFeed:
+    """
+    Wakes up as soon as the node pushes a new header (eth_subscribe newHeads).
+    If more than one header has arrived, only the latest is returned.
+    """
+    ws: ClientConnection
+
+    def _parse_header(self, message: str | bytes) -> BlockHeader:
+        msg = json.loads(message)
+        if msg.get('method') != 'eth_subscription':
+            raise BlockFeedException(f'Unexpected message {msg}')
+        header = msg['params']['result']
+        return BlockHeader(
+            number=int(header['number'], 16),
+            timestamp=int(header['timestamp'], 16),
+            hash=HexBytes(header['hash']) if 'hash' in header else None,
+            parent_hash=HexBytes(header['parentHash']) if 'parentHash' in header else None,
+            logs_bloom=HexBytes(header['logsBloom']) if 'logsBloom' in header else None)
+
+    def next_block(self, timeout_sec: float) -> BlockHeader | None:
+        try:
+            header = self._parse_header(self.ws.recv(timeout=timeout_sec))
+        except TimeoutError:
+            return None
+
+        # Skip headers that arrived while we were busy
+        while True:
+            try:
+                header = self._parse_header(self.ws.recv(timeout=0))
+            except TimeoutError:
+                return header
+
+    def close(self):
+        self.ws.close()
+
+def subscribe_new_heads(ws_url: str) -> NewHeadsBlockFeed:
+    logger.info('Subscribing to new heads')
+    ws = connect(ws_url)
+    ws.send(json.dumps({
+        'jsonrpc': '2.0',
+        'id': 1,
+        'method': 'eth_subscribe',
+        'params': ['newHeads']}))
+
+    response = json.loads(ws.recv(timeout=10))
+    if 'result' not in response:
+        ws.close()
+        raise BlockFeedException(f'Failed to subscribe: {response}')
+
+    logger.info(f'Subscribed {response["result"]}')
+    return NewHeadsBlockFeed(ws=ws)
+
+def start_block_feed(w3: Web3) -> BlockFeed:
+    """
+    Uses newHeads subscription if `base_node_ws_url` is configured.
+    Otherwise falls back to polling.
+    """
+    ws_url = get_config().get('base_node_ws_url')
+    if ws_url:
+        try:
+            return subscribe_new_heads(ws_url)
+        except Exception:
+            logger.exception('Failed to subscribe, falling back to polling')
+
+    # Sampling blocks takes a few requests, block time doesn't change
+    chain_id = metadata_cache.chain_id_cached(w3)
+    block_time_sec = metadata_cache.get_default().get_block_time(chain_id)
+    if block_time_sec is None:
+        block_time_sec = measure_block_time(w3)
+        logger.info(f'Measured block time {block_time_sec}s')
+        metadata_cache.get_default().put_block_time(chain_id, block_time_sec)
+    return PollingBlockFeed(w3=w3, block_time_sec=block_time_sec)
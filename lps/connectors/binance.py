@@ -1,4 +1,6 @@
 import logging
+import math
+import time
 
 import attrs
 import ccxt.binance
@@ -7,16 +9,74 @@ from decimal import Decimal
 from eth_defi.token import TokenDetails
 
 from lps import erc20
-from lps.utils.config import get_config
+from lps.connectors import candle_store
+from lps.connectors.candle_store import CandleStore
+from lps.utils.config import get_config, data_path
 
 logger = logging.getLogger('binance')
 
 class BinanceException(Exception):
     pass
 
+@attrs.define
+class TickerSnapshot:
+    """
+    Best bid/ask of all requested symbols, fetched with a single bookTicker
+    call and reused for `ttl_sec`. Same `get_mid_prices` as `HasAssetPositions`,
+    names are base symbols priced in `quote`.
+    """
+    exchange: ccxt.binance
+    ttl_sec: float
+    quote: str = 'USDT'
+
+    _symbols: set[str] = attrs.field(factory=set)
+    _mids: dict[str, Decimal] = attrs.field(factory=dict)
+    _fetched_at: float = -math.inf
+
+    def _refresh(self, symbols: set[str]):
+        tickers = self.exchange.fetch_bids_asks(sorted(symbols))
+        mids = {}
+        for symbol, ticker in tickers.items():
+            (bid, ask) = (ticker.get('bid'), ticker.get('ask'))
+            if bid is None and ask is None:
+                continue
+            if bid is None:
+                mids[symbol] = Decimal(str(ask))
+            elif ask is None:
+                mids[symbol] = Decimal(str(bid))
+            else:
+                mids[symbol] = (Decimal(str(bid)) + Decimal(str(ask))) / 2
+        # Symbols are only kept once fetched, one bad symbol would fail every refresh
+        (self._symbols, self._mids) = (symbols, mids)
+        self._fetched_at = time.monotonic()
+
+    def get_mid_prices(self, *names: str) -> dict[str, Decimal]:
+        # Stable coins are priced at 1, same as `token_value_in_usd_at_time`
+        symbols = {
+            name: f'{erc20.canonical_symbol(name)}/{self.quote}'
+            for name in names if name not in erc20.STABLE_COINS}
+        unknown = [symbol for symbol in symbols.values() if symbol not in self.exchange.markets]
+        if len(unknown) > 0:
+            raise BinanceException(f"No market for {', '.join(unknown)}")
+
+        # New symbols are added to the snapshot right away
+        # Without symbols bookTicker returns every market
+        if len(symbols) > 0 and (time.monotonic() - self._fetched_at > self.ttl_sec or
+                                 not self._symbols.issuperset(symbols.values())):
+            self._refresh(self._symbols | set(symbols.values()))
+
+        missing = [symbol for symbol in symbols.values() if symbol not in self._mids]
+        if len(missing) > 0:
+            raise BinanceException(f"Unable to get mid price for {', '.join(missing)}")
+        return {
+            name: self._mids[symbols[name]] if name in symbols else Decimal(1)
+            for name in names}
+
 @attrs.frozen
 class Binance:
     exchange: ccxt.binance
+    candles: CandleStore
+    tickers: TickerSnapshot
 
 def start() -> Binance:
     logger.info('Starting')
@@ -27,7 +87,10 @@ def start() -> Binance:
     e.load_markets()
     logger.info('Started')
     return Binance(
-        exchange=e
+        exchange=e,
+        candles=candle_store.start(e, data_path() / 'candles' / 'binance'),
+        tickers=TickerSnapshot(
+            exchange=e, ttl_sec=get_config().binance.get('ticker_ttl_sec', 1))
     )
 
 def mid_price(client: Binance, base: str, quote: str) -> Decimal:
@@ -35,7 +98,7 @@ def mid_price(client: Binance, base: str, quote: str) -> Decimal:
     bid = orderbook['bids'][0][0] if len (orderbook['bids']) > 0 else None
     ask = orderbook['asks'][0][0] if len (orderbook['asks']) > 0 else None
     if bid is None and ask is None:
-        raise BinanceException(f"Unable to get mid price for {name}")
+        raise BinanceException(f"Unable to get mid price for {base}/{quote}")
     if bid is None:
         return Decimal(ask)
     if ask is None:
@@ -48,12 +111,12 @@ def usd_price_at_time(client: Binance, base: str, timestamp_sec: int) -> Decimal
     """
     base = erc20.canonical_symbol(base) # TODO: doesn't belong here
     timestamp_ms = timestamp_sec * 1000
-    response = client.exchange.fetch_ohlcv(f'{base}/USDT', '1m', timestamp_ms, 1)
+    candle = client.candles.get_candle(f'{base}/USDT', timestamp_ms)
 
-    if len(response) < 1:
+    if candle is None:
         return Decimal(0) # TODO: I don't know why this can happen
 
-    return Decimal(response[0][3]) # lowest value in one minute
+    return Decimal(candle.low) # lowest value in one minute
 
 def token_value_in_usd_at_time(
         client: Binance,
@@ -0,0 +1,117 @@
+import logging
+import os
+import time
+from pathlib import Path
+
+import attrs
+import ccxt
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+logger = logging.getLogger('candle_store')
+
+CANDLE_MS = 60 * 1000
+PAGE_SIZE = 1000 # max candles in one fetch_ohlcv request on binance
+PAGE_MS = PAGE_SIZE * CANDLE_MS
+
+@attrs.frozen
+class Candle:
+    timestamp_ms: int
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: float
+
+@attrs.define
+class CandleStore:
+    """
+    On-disk store of 1m candles, one parquet file per page of PAGE_SIZE candles.
+    Pages are aligned to PAGE_MS, so a page is either fully stored or missing.
+    Missing pages are fetched with a single fetch_ohlcv request.
+    Page which is not finished yet is never stored, it is kept in memory
+    for `unfinished_ttl_sec` and fetched again after that.
+    """
+    exchange: ccxt.Exchange
+    path: Path
+    unfinished_ttl_sec: float = 30
+
+    # Loaded pages, (symbol, page index) -> memory mapped table
+    _pages: dict[tuple[str, int], pa.Table] = attrs.field(factory=dict)
+    # Not finished pages, (symbol, page index) -> (fetched at, table)
+    _unfinished: dict[tuple[str, int], tuple[float, pa.Table]] = attrs.field(factory=dict)
+    fetch_count: int = 0
+
+    def _page_path(self, symbol: str, page_idx: int) -> Path:
+        return self.path / symbol.replace('/', '_') / f'{page_idx}.parquet'
+
+    def _fetch_page(self, symbol: str, page_idx: int) -> pa.Table:
+        page_start = page_idx * PAGE_MS
+        logger.debug(f'Fetching {symbol} candles from {page_start}')
+        self.fetch_count += 1
+        candles = self.exchange.fetch_ohlcv(symbol, '1m', page_start, PAGE_SIZE)
+        candles = [c for c in candles if c[0] < page_start + PAGE_MS]
+
+        names = ['timestamp_ms', 'open', 'high', 'low', 'close', 'volume']
+        columns = list(zip(*candles)) if candles else [[]] * len(names)
+        return pa.table({
+            name: pa.array(col, type=pa.int64() if name == 'timestamp_ms' else pa.float64())
+            for name, col in zip(names, columns)
+        })
+
+    def _load_page(self, symbol: str, page_idx: int) -> pa.Table:
+        key = (symbol, page_idx)
+        if key in self._pages:
+            return self._pages[key]
+
+        page_path = self._page_path(symbol, page_idx)
+        if page_path.is_file():
+            table = pq.read_table(page_path, memory_map=True)
+            self._pages[key] = table
+            return table
+
+        # Fetched while not finished, might have finished since
+        is_finished = (page_idx + 1) * PAGE_MS <= time.time() * 1000
+        if key in self._unfinished:
+            (fetched_at, table) = self._unfinished[key]
+            if time.monotonic() - fetched_at <= self.unfinished_ttl_sec and not is_finished:
+                return table
+            del self._unfinished[key]
+
+        table = self._fetch_page(symbol, page_idx)
+        if is_finished:
+            page_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = page_path.with_suffix('.tmp')
+            pq.write_table(table, tmp_path)
+            os.replace(tmp_path, page_path)
+            self._pages[key] = table
+        else:
+            self._unfinished[key] = (time.monotonic(), table)
+        return table
+
+    def get_candle(self, symbol: str, timestamp_ms: int) -> Candle | None:
+        """
+        Returns first candle at or after the timestamp, same as
+        `fetch_ohlcv(symbol, '1m', timestamp_ms, 1)`. Gap at the end of a
+        finished page continues into the next pages.
+        None if there is no such candle yet, or the page has no candles at all.
+        """
+        # Round up to the candle start
+        timestamp_ms = -(-timestamp_ms // CANDLE_MS) * CANDLE_MS
+        page_idx = timestamp_ms // PAGE_MS
+        while True:
+            table = self._load_page(symbol, page_idx)
+            timestamps = table.column('timestamp_ms').to_numpy()
+            row = int(np.searchsorted(timestamps, timestamp_ms))
+            if row < len(timestamps):
+                return Candle(**{name: table.column(name)[row].as_py() for name in table.column_names})
+
+            # Empty page means there is no trading, not finished page has no later candles
+            is_finished = (page_idx + 1) * PAGE_MS <= time.time() * 1000
+            if len(timestamps) == 0 or not is_finished:
+                return None
+            page_idx += 1
+
+def start(exchange: ccxt.Exchange, path: Path) -> CandleStore:
+    return CandleStore(exchange=exchange, path=path)
@@ -1,21 +1,26 @@
+import json
 import logging
 import time
 from operator import itemgetter
-from typing import TypedDict, Iterator
+from pathlib import Path
+from typing import TypedDict, Iterator, Iterable
 from decimal import Decimal
 
 import attrs
 import eth_account
 from eth_account.signers.local import LocalAccount
+from hyperliquid.api import API
 from hyperliquid.info import Info
 from hyperliquid.exchange import Exchange
 from hyperliquid.utils import constants
-from hyperliquid.utils.types import Meta
+from hyperliquid.utils.types import Meta, SpotMeta
+from hyperliquid.websocket_manager import WebsocketManager
 from overrides import overrides
 
+from lps import metrics
 from lps.connectors.abs import CanDoOrders, HasAssetPositions, AssetPosition, \
     ConnectorException
-from lps.utils.config import get_config
+from lps.utils.config import get_config, data_path
 
 logger = logging.getLogger('hl_connector')
 
@@ -23,6 +28,38 @@ logger = logging.getLogger('hl_connector')
 class HLException(ConnectorException):
     pass
 
+@attrs.define
+class HLState:
+    """
+    Local copy of the exchange state, kept up to date from the websocket.
+    Mids come directly from the allMids channel. User positions are read over
+    REST once and kept until a fill on the userFills channel invalidates them.
+    Note: SDK doesn't route webData2 messages, otherwise we could use it.
+    """
+    mids: dict[str, str] = attrs.field(factory=dict)
+    mids_updated_at: float = 0 # time of the last allMids message
+
+    positions: dict[str, AssetPosition] | None = None # None when invalidated
+    positions_version: int = 0 # bumped on every invalidation
+
+    def on_all_mids(self, msg: dict):
+        self.mids = msg['data']['mids']
+        self.mids_updated_at = time.time()
+
+    def on_user_fills(self, msg: dict):
+        if msg['data'].get('isSnapshot', False):
+            return # historical fills
+        logger.info(f'Received fills: {msg["data"]["fills"]}')
+        self.invalidate_positions()
+
+    def invalidate_positions(self):
+        self.positions_version += 1
+        self.positions = None
+
+    def is_stale(self) -> bool:
+        staleness_sec = time.time() - self.mids_updated_at
+        return staleness_sec > get_config().hyperliquid.get('ws_max_staleness_sec', 5)
+
 @attrs.frozen
 class HL:
     info: Info
@@ -31,21 +68,31 @@ class HL:
 
     sz_decimals: dict[str, int] # cached szDecimals for perps only so far
 
+    state: HLState | None = None # only when websocket is enabled
+
     def get_mid_prices(self, *names: str) -> dict[str, Decimal]:
-        mids = self.info.all_mids()
+        if self.state is not None and not self.state.is_stale():
+            mids = self.state.mids
+        else:
+            mids = self.info.all_mids()
         return {name: Decimal(mids[name]) for name in names}
 
     def get_user_positions(self) -> dict[str, AssetPosition]:
-        positions = self.info.user_state(self.public_addr)['assetPositions']
+        if self.state is None:
+            return self._fetch_user_positions()
 
-        ret: dict[str, AssetPosition] = {}
-        for pos in map(itemgetter('position'), positions):
-            assert pos['coin'] not in ret, "duplicate positions on hl"
-            ret[pos['coin']] = AssetPosition(
-                positionValue=Decimal(pos['positionValue']),
-                szi=Decimal(pos['szi']))
+        if not self.state.is_stale() and self.state.positions is not None:
+            return dict(self.state.positions)
 
-        return ret
+        version = self.state.positions_version
+        ret = self._fetch_user_positions()
+        # Don't cache if positions were changed while we were reading them
+        if version == self.state.positions_version:
+            self.state.positions = ret
+        return dict(ret)
+
+    def _fetch_user_positions(self) -> dict[str, AssetPosition]:
+        return _parse_user_positions(self.info.user_state(self.public_addr))
 
     def _attempt_market_order(self, name: str, size: Decimal) -> Decimal:
         """
@@ -54,12 +101,14 @@ class HL:
         """
         logger.info(f'Posting order {name} {size}')
 
-        order = self.exchange.market_open(
-            name=name,
-            is_buy=size > 0,
-            sz=float(abs(size)),
-            slippage=get_config().hyperliquid.market_order_slippage,
-        )
+        metrics.inc('orders')
+        with metrics.span('hl_order'):
+            order = self.exchange.market_open(
+                name=name,
+                is_buy=size > 0,
+                sz=float(abs(size)),
+                slippage=get_config().hyperliquid.market_order_slippage,
+            )
         logger.info(f'Executed order: {order}')
         executed_size = Decimal(order['response']['data']['statuses'][0]['filled']['totalSz'])
         if executed_size != size:
@@ -83,6 +132,8 @@ class HL:
 
         retry_cnt = 0
         while abs(size) > 0 and retry_cnt < get_config().hyperliquid.max_retries:
+            if retry_cnt > 0:
+                metrics.inc('order_retries')
             try:
                 executed_size = self._attempt_market_order(name, size)
                 if size < 0:
@@ -90,10 +141,157 @@ class HL:
                 size -= executed_size
             except Exception as e:
                 logger.exception(f'Failed to execute order: {e} {retry_cnt}')
+            finally:
+                # Don't wait for the fills to arrive over websocket
+                if self.state is not None:
+                    self.state.invalidate_positions()
             retry_cnt += 1
         if size != 0:
             raise HLException("Failed to execute the order")
 
+    def _attempt_bulk_market_order(self, orders: dict[str, Decimal]) -> dict[str, Decimal]:
+        """
+        Executes all IoC orders with a single bulk order action.
+        Returns actual executed signed size per order, zero for failed orders.
+        Exception only when something malfunctions in the connection itself.
+        """
+        logger.info(f'Posting bulk order {orders}')
+
+        mids = self.get_mid_prices(*orders.keys())
+        slippage = get_config().hyperliquid.market_order_slippage
+        order_requests = [
+            {
+                'coin': name,
+                'is_buy': size > 0,
+                'sz': float(abs(size)),
+                # Same price as market_open would use
+                'limit_px': self.exchange._slippage_price(
+                    name, size > 0, slippage, float(mids[name])),
+                'order_type': {'limit': {'tif': 'Ioc'}},
+                'reduce_only': False,
+            } for name, size in orders.items()
+        ]
+        metrics.inc('orders', len(orders))
+        with metrics.span('hl_bulk_order'):
+            response = self.exchange.bulk_orders(order_requests)
+        logger.info(f'Executed bulk order: {response}')
+        if response['status'] != 'ok':
+            raise HLException(f'Bulk order failed {response}')
+
+        statuses = response['response']['data']['statuses']
+        ret = {}
+        for (name, size), status in zip(orders.items(), statuses, strict=True):
+            executed_size = Decimal(status['filled']['totalSz']) if 'filled' in status else Decimal(0)
+            if executed_size != abs(size):
+                logger.warning(f'Failed to execute full order {name} {size} {status}')
+            ret[name] = executed_size if size > 0 else -executed_size
+        return ret
+
+    def market_orders(self, orders: dict[str, Decimal]) -> dict[str, Decimal]:
+        """
+        Same as `market_order` for all orders at once. Every attempt is one bulk
+        order with the remaining sizes of all orders, so partial fills are
+        retried per coin. Returns sizes which were not executed.
+        """
+        sizes = {name: self._round_sz(size, name) for name, size in orders.items()}
+
+        retry_cnt = 0
+        while any(sizes.values()) and retry_cnt < get_config().hyperliquid.max_retries:
+            if retry_cnt > 0:
+                metrics.inc('order_retries')
+            remaining = {name: size for name, size in sizes.items() if size != 0}
+            try:
+                executed = self._attempt_bulk_market_order(remaining)
+                for name, executed_size in executed.items():
+                    sizes[name] -= executed_size
+            except Exception as e:
+                logger.exception(f'Failed to execute bulk order: {e} {retry_cnt}')
+            finally:
+                # Don't wait for the fills to arrive over websocket
+                if self.state is not None:
+                    self.state.invalidate_positions()
+            retry_cnt += 1
+        return sizes
+
+    def stop(self):
+        ws_manager = getattr(self.info, 'ws_manager', None) # not set with skip_ws
+        if ws_manager is not None:
+            ws_manager.ws.close()
+
+def _parse_user_positions(user_state: dict) -> dict[str, AssetPosition]:
+    ret: dict[str, AssetPosition] = {}
+    for pos in map(itemgetter('position'), user_state['assetPositions']):
+        assert pos['coin'] not in ret, "duplicate positions on hl"
+        ret[pos['coin']] = AssetPosition(
+            positionValue=Decimal(pos['positionValue']),
+            szi=Decimal(pos['szi']))
+    return ret
+
+def _cache_path(api_url: str, name: str) -> Path:
+    network = 'testnet' if api_url == constants.TESTNET_API_URL else 'main'
+    return data_path() / 'hl' / f'{name}_{network}.json'
+
+def _read_json(path: Path) -> dict | None:
+    try:
+        return json.loads(path.read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+
+def _write_json(path: Path, value: dict):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(value))
+
+def _load_meta(api_url: str, coins: Iterable[str]) -> tuple[Meta, SpotMeta]:
+    """
+    Meta only changes when assets are listed, so it's cached on disk.
+    Read again when it's old or any of the coins is missing.
+    """
+    path = _cache_path(api_url, 'meta')
+    cached = _read_json(path)
+    if cached is not None \
+            and time.time() - cached['fetched_at'] < get_config().hyperliquid.get('meta_max_age_sec', 86400) \
+            and set(coins) <= {m['name'] for m in cached['meta']['universe']}:
+        return cached['meta'], cached['spot_meta']
+
+    logger.info('Loading meta')
+    api = API(api_url)
+    meta = api.post('/info', {'type': 'meta'})
+    spot_meta = api.post('/info', {'type': 'spotMeta'})
+    _write_json(path, {'fetched_at': time.time(), 'meta': meta, 'spot_meta': spot_meta})
+    return meta, spot_meta
+
+def _update_leverages(exchange: Exchange, user_state: dict):
+    """
+    Sets configured leverages, skipping the coins where it's already set.
+    Leverage is only reported for open positions, for the rest it's always
+    set, as it might have been changed elsewhere while flat.
+    """
+    current = {
+        pos['coin']: pos['leverage']
+        for pos in map(itemgetter('position'), user_state['assetPositions'])
+    }
+    for coin, leverage in get_config().hyperliquid.leverages.items():
+        if coin in current and current[coin]['type'] == 'cross' and current[coin]['value'] == leverage:
+            continue
+        logger.info(f'Updating {coin} leverage to {leverage}')
+        ret = exchange.update_leverage(leverage, coin)
+        if ret['status'] != 'ok':
+            raise HLException(f'Failed to update {coin} leverage: {ret}')
+
+def _subscribe_state(info: Info, public_addr: str) -> HLState:
+    # Same as Info(skip_ws=False) but with daemon threads, so that connector
+    # can be re-created without leaking non-daemon threads
+    ws_manager = WebsocketManager(info.base_url)
+    ws_manager.daemon = True
+    ws_manager.ping_sender.daemon = True
+    ws_manager.start()
+    info.ws_manager = ws_manager
+
+    state = HLState()
+    info.subscribe({'type': 'allMids'}, state.on_all_mids)
+    info.subscribe({'type': 'userFills', 'user': public_addr}, state.on_user_fills)
+    return state
+
 def start() -> HL:
     logger.info('Starting')
 
@@ -106,26 +304,36 @@ def start() -> HL:
         public_addr = get_config().hyperliquid.main.wallet_address
         private_key = get_config().hyperliquid.main.private_key
 
-    logger.info('Loading meta')
-    info = Info(api_url, skip_ws=True)
+    meta, spot_meta = _load_meta(api_url, get_config().hyperliquid.leverages.keys())
+    info = Info(api_url, skip_ws=True, meta=meta, spot_meta=spot_meta)
+
+    state = None
+    if get_config().hyperliquid.get('use_ws', False):
+        logger.info('Subscribing to the websocket')
+        state = _subscribe_state(info, public_addr)
 
     account: LocalAccount = eth_account.Account.from_key(private_key)
     exchange = Exchange(account,
                         api_url,
-                        account_address=public_addr)
+                        meta=meta,
+                        account_address=public_addr,
+                        spot_meta=spot_meta)
 
-    logger.info('Loading sz decimals')
-    sz_decimals = {m['name']: m['szDecimals'] for m in info.meta()['universe']}
+    sz_decimals = {m['name']: m['szDecimals'] for m in meta['universe']}
 
     hl_connection = HL(
         info=info,
         sz_decimals=sz_decimals,
         exchange=exchange,
-        public_addr=public_addr)
+        public_addr=public_addr,
+        state=state)
 
-    logger.info('Updating leverages')
-    for coin, leverage in get_config().hyperliquid.leverages.items():
-        exchange.update_leverage(leverage, coin)
+    positions_version = state.positions_version if state is not None else 0
+    user_state = info.user_state(public_addr)
+    _update_leverages(exchange, user_state)
+    # Saves the positions request on the first block
+    if state is not None and positions_version == state.positions_version:
+        state.positions = _parse_user_positions(user_state)
 
     logger.info('Started')
 
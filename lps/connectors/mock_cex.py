@@ -1,3 +1,4 @@
+import logging
 from collections import defaultdict
 
 import attrs
@@ -5,6 +6,8 @@ import attrs
 from lps.connectors.abs import AssetPosition, ConnectorException
 from decimal import Decimal
 
+logger = logging.getLogger('mock_cex')
+
 class MockConnectorError(ConnectorException):
     pass
 
@@ -53,6 +56,18 @@ class MockCEX:
             self.usd_balance += order_value
             self.position_sizes[name] -= rounded_size
 
+    def market_orders(self, orders: dict[str, Decimal]) -> dict[str, Decimal]:
+        """Executes orders one by one, failed orders are not executed at all"""
+        ret = {}
+        for name, size in orders.items():
+            try:
+                self.market_order(name, size)
+                ret[name] = Decimal(0)
+            except MockConnectorError as e:
+                logger.warning(f'Failed to execute order: {e}')
+                ret[name] = size
+        return ret
+
     def close_all_positions(self):
         for name, size in self.position_sizes.items():
             self.market_order(name, 0 - size)
@@ -0,0 +1,266 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Any, Iterable
+
+import attrs
+import requests
+from web3.providers.base import JSONBaseProvider
+from web3.types import RPCEndpoint, RPCResponse
+
+from lps import metrics
+from lps.utils.config import get_config
+
+logger = logging.getLogger('rpc_pool')
+
+# Latencies of this many last requests are kept per endpoint
+LATENCY_WINDOW = 100
+# Requests are only hedged once the percentile is meaningful
+MIN_HEDGE_SAMPLES = 10
+# Position of the block parameter of the reads at a block
+_BLOCK_PARAM = {
+    'eth_call': 1,
+    'eth_getBalance': 1,
+    'eth_getCode': 1,
+    'eth_getTransactionCount': 1,
+    'eth_getStorageAt': 2,
+    'eth_getBlockByNumber': 0,
+}
+# Errors of the nodes which don't have the block yet
+_UNKNOWN_BLOCK_ERRORS = ('header not found', 'unknown block', 'block not found')
+
+def _requested_block(method: RPCEndpoint, params: Any) -> int | None:
+    """Block number the read is pinned to, None for tags like 'latest'"""
+    if method == 'eth_getLogs':
+        block = params[0].get('toBlock') if len(params) > 0 else None
+    elif method in _BLOCK_PARAM and len(params) > _BLOCK_PARAM[method]:
+        block = params[_BLOCK_PARAM[method]]
+    else:
+        return None
+    if isinstance(block, int):
+        return block
+    if isinstance(block, str) and block.startswith('0x'):
+        return int(block, 16)
+    return None
+
+def _is_unknown_block(response: RPCResponse) -> bool:
+    message = str(response.get('error', {}).get('message', '')).lower()
+    return any(error in message for error in _UNKNOWN_BLOCK_ERRORS)
+
+@attrs.define
+class Endpoint:
+    url: str
+    head: int = -1 # last seen block number, -1 until known
+    failures: int = 0 # consecutive transport failures
+    latencies: deque[float] = attrs.field(factory=lambda: deque(maxlen=LATENCY_WINDOW))
+
+    def latency_percentile(self, percentile: float) -> float | None:
+        if len(self.latencies) == 0:
+            return None
+        samples = sorted(self.latencies)
+        return samples[min(len(samples) - 1, int(len(samples) * percentile / 100))]
+
+class RpcPoolProvider(JSONBaseProvider):
+    """
+    JSON-RPC provider over several nodes of the same chain. Head block of
+    every node is polled, nodes more than `max_lag_blocks` behind the best
+    head or failing `max_failures` times in a row are not used. Requests go
+    to the node with the lowest median latency, the next nodes are tried
+    when it fails. Reads at a block only go to the nodes which have seen
+    it, and fail over when the node answers that it doesn't know the block.
+
+    With `hedge_percentile` set, a read which takes longer than that
+    percentile of the node latencies is also sent to the second node and
+    whichever answers first wins. At most `max_hedged_reads` reads are
+    hedged at once, the rest are sent without hedging rather than queued.
+    """
+
+    def __init__(
+            self,
+            urls: Iterable[str],
+            max_lag_blocks: int = 2,
+            max_failures: int = 3,
+            hedge_percentile: float | None = None,
+            max_hedged_reads: int = 32,
+            request_timeout_sec: float = 10):
+        super().__init__()
+        self.endpoints = [Endpoint(url=url) for url in urls]
+        if len(self.endpoints) == 0:
+            raise ValueError('No endpoints')
+        self.max_lag_blocks = max_lag_blocks
+        self.max_failures = max_failures
+        self.hedge_percentile = hedge_percentile
+        self.request_timeout_sec = request_timeout_sec
+
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+        # Primary and hedge request of every hedged read
+        self._hedge_executor = ThreadPoolExecutor(
+            max_workers=2 * max_hedged_reads, thread_name_prefix='rpc_pool_hedge')
+        self._hedge_slots = threading.BoundedSemaphore(max_hedged_reads)
+        # Head polls never wait behind the reads
+        self._poll_executor = ThreadPoolExecutor(
+            max_workers=len(self.endpoints), thread_name_prefix='rpc_pool_poll')
+        self._stop = threading.Event()
+
+    def __str__(self) -> str:
+        return f"RPC pool {', '.join(e.url for e in self.endpoints)}"
+
+    def get_request_kwargs(self) -> dict[str, Any]:
+        return {
+            'headers': {'Content-Type': 'application/json'},
+            'timeout': self.request_timeout_sec,
+        }
+
+    def _post(self, endpoint: Endpoint, data: bytes) -> bytes:
+        started = time.perf_counter()
+        try:
+            response = self._session.post(endpoint.url, data=data, **self.get_request_kwargs())
+            response.raise_for_status()
+        except requests.RequestException:
+            with self._lock:
+                endpoint.failures += 1
+            raise
+        with self._lock:
+            endpoint.latencies.append(time.perf_counter() - started)
+            endpoint.failures = 0
+        return response.content
+
+    def ranked(self, block: int | None = None) -> list[Endpoint]:
+        """
+        Endpoints to use, best first. Falls back to all of them if none is healthy.
+        With `block`, only endpoints which have seen it, if any.
+        """
+        with self._lock:
+            healthy = [e for e in self.endpoints if e.failures < self.max_failures]
+            if len(healthy) == 0:
+                return sorted(self.endpoints, key=lambda e: e.failures)
+
+            best_head = max(e.head for e in healthy)
+            fresh = [e for e in healthy if best_head - e.head <= self.max_lag_blocks]
+            if block is not None:
+                # Heads are polled, the block might be newer than all of them
+                fresh = [e for e in fresh if e.head >= block] or fresh
+            # Not measured yet endpoints go first to get measured
+            return sorted(fresh, key=lambda e: e.latency_percentile(50) or 0)
+
+    @property
+    def endpoint_uri(self) -> str:
+        """Best endpoint, for the JSON-RPC batches which bypass the provider"""
+        return self.ranked()[0].url
+
+    def _hedged_post(self, endpoints: list[Endpoint], data: bytes) -> bytes:
+        hedge_after_sec = None
+        if self.hedge_percentile is not None and len(endpoints) > 1 and \
+                len(endpoints[0].latencies) >= MIN_HEDGE_SAMPLES:
+            hedge_after_sec = endpoints[0].latency_percentile(self.hedge_percentile)
+        if hedge_after_sec is None or not self._hedge_slots.acquire(blocking=False):
+            return self._post(endpoints[0], data)
+
+        # Slot is released once the caller and both requests are done,
+        # so the executor never has more requests than workers
+        remaining = [1]
+        remaining_lock = threading.Lock()
+        def release(_=None):
+            with remaining_lock:
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    self._hedge_slots.release()
+
+        def submit(endpoint: Endpoint) -> Future:
+            with remaining_lock:
+                remaining[0] += 1
+            future = self._hedge_executor.submit(self._post, endpoint, data)
+            future.add_done_callback(release)
+            return future
+
+        try:
+            pending: set[Future] = {submit(endpoints[0])}
+            (done, pending) = wait(pending, timeout=hedge_after_sec)
+            if len(pending) > 0:
+                metrics.inc('rpc_hedged_requests')
+                pending.add(submit(endpoints[1]))
+
+            error = None
+            while True:
+                for future in done:
+                    if future.exception() is None:
+                        return future.result()
+                    error = future.exception()
+                if len(pending) == 0:
+                    raise error
+                (done, pending) = wait(pending, return_when=FIRST_COMPLETED)
+        finally:
+            release()
+
+    def make_request(self, method: RPCEndpoint, params: Any) -> RPCResponse:
+        data = self.encode_rpc_request(method, params)
+        endpoints = self.ranked(_requested_block(method, params))
+        # Transactions are never sent twice
+        is_read = not method.startswith('eth_send')
+
+        for i, endpoint in enumerate(endpoints):
+            is_last = i == len(endpoints) - 1
+            try:
+                if is_read:
+                    raw_response = self._hedged_post(endpoints[i:], data)
+                else:
+                    raw_response = self._post(endpoint, data)
+            except requests.RequestException:
+                if is_last:
+                    raise
+                metrics.inc('rpc_failovers')
+                logger.warning(f'Request to {endpoint.url} failed, trying the next node', exc_info=True)
+                continue
+
+            response = self.decode_rpc_response(raw_response)
+            if is_last or not _is_unknown_block(response):
+                return response
+            metrics.inc('rpc_failovers')
+            logger.warning(f'{endpoint.url} is behind the block of {method}, trying the next node')
+
+    def poll_heads(self):
+        """Reads the head block of every endpoint concurrently"""
+        data = self.encode_rpc_request(RPCEndpoint('eth_blockNumber'), [])
+
+        def poll(endpoint: Endpoint):
+            try:
+                head = int(json.loads(self._post(endpoint, data))['result'], 16)
+            except Exception:
+                logger.warning(f'Failed to read head of {endpoint.url}', exc_info=True)
+                return
+            with self._lock:
+                endpoint.head = head
+
+        list(self._poll_executor.map(poll, self.endpoints))
+
+    def start_polling(self, interval_sec: float):
+        def run():
+            while not self._stop.wait(interval_sec):
+                self.poll_heads()
+
+        self.poll_heads()
+        threading.Thread(target=run, name='rpc_pool_heads', daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        self._hedge_executor.shutdown(wait=False)
+        self._poll_executor.shutdown(wait=False)
+
+    def is_connected(self, show_traceback: bool = False) -> bool:
+        return any(e.failures < self.max_failures for e in self.endpoints)
+
+def start(urls: Iterable[str]) -> RpcPoolProvider:
+    conf = get_config().get('rpc_pool', {})
+    provider = RpcPoolProvider(
+        urls,
+        max_lag_blocks=conf.get('max_lag_blocks', 2),
+        max_failures=conf.get('max_failures', 3),
+        hedge_percentile=conf.get('hedge_percentile'),
+        max_hedged_reads=conf.get('max_hedged_reads', 32),
+        request_timeout_sec=conf.get('request_timeout_sec', 10))
+    provider.start_polling(conf.get('head_poll_sec', 1))
+    return provider
@@ -1,22 +1,25 @@
+import json
 from functools import lru_cache
 from typing import Type
 
-from eth_defi.abi import get_deployed_contract, get_contract
-from eth_defi.token import TokenDetails, fetch_erc20_details
 from web3 import Web3
 from web3.contract import Contract
 
 from lps.utils.config import resources_path, get_config
 
+@lru_cache(maxsize=None)
+def load_abi(abi_fname: str) -> list[dict]:
+    """ABI is parsed once per process, contracts of new connections reuse it"""
+    with open(resources_path() / "abis" / abi_fname, 'rt') as f:
+        return json.load(f)["abi"]
+
+def preload_abis():
+    for path in sorted((resources_path() / "abis").glob("*.json")):
+        load_abi(path.name)
+
 @lru_cache(maxsize=256)
 def create_contract_cached(web3: Web3, abi_fname: str, address: str | None = None) -> Contract | Type[Contract]:
     if address is not None:
-        return get_deployed_contract(
-            web3,
-            resources_path() / "abis" / abi_fname,
-            address,
-            register_for_tracing = False
-        )
-    return get_contract(
-        web3,
-        resources_path() / "abis" / abi_fname)
+        return web3.eth.contract(
+            address=Web3.to_checksum_address(address), abi=load_abi(abi_fname))
+    return web3.eth.contract(abi=load_abi(abi_fname))
@@ -1,16 +1,50 @@
 from functools import lru_cache
 
+from eth_defi.abi import get_deployed_contract
 from eth_defi.token import TokenDetails, fetch_erc20_details
 from web3 import Web3
 
+from lps import metadata_cache
+from lps.metadata_cache import TokenMeta
+
 @lru_cache(maxsize=256)
 def fetch_erc20_details_cached(web3: Web3, pair_address: str) -> TokenDetails:
-    """In-process memory cache for getting pair data in decoded format."""
-    return fetch_erc20_details(web3, pair_address)
+    """
+    In-process memory cache for getting pair data in decoded format.
+    Name, symbol and decimals are read from the chain only once, then
+    from the on-disk metadata cache. Total supply is not cached.
+    """
+    chain_id = metadata_cache.chain_id_cached(web3)
+    cache = metadata_cache.get_default()
+    meta = cache.get_token(chain_id, pair_address)
+    if meta is None:
+        details = fetch_erc20_details(web3, pair_address, chain_id=chain_id)
+        meta = TokenMeta(
+            address=details.address,
+            name=details.name,
+            symbol=details.symbol,
+            decimals=details.decimals)
+        cache.put_token(chain_id, meta)
+
+    details = TokenDetails(
+        get_deployed_contract(web3, "ERC20MockDecimals.json", meta.address),
+        name=meta.name,
+        symbol=meta.symbol,
+        decimals=meta.decimals)
+    # Pre-fill cached property, otherwise hashing the token is an RPC call
+    details.__dict__['chain_id'] = chain_id
+    return details
+
+def invalidate_token(web3: Web3, token_address: str):
+    metadata_cache.get_default().invalidate_token(
+        metadata_cache.chain_id_cached(web3), token_address)
+    fetch_erc20_details_cached.cache_clear()
+
+STABLE_COINS = ('USDC', 'USDT', 'DAI', 'USDe', 'USDS', 'PYUSD')
 
 def guess_is_stable_coin(token: TokenDetails) -> bool:
     """Best guess if this is a stable coin"""
-    return token.symbol in ('USDC', 'USDT', 'DAI', 'USDe', 'USDS', 'PYUSD')
+    return token.symbol in STABLE_COINS
 
 _SYNONYMS = {
     'WETH': 'ETH',
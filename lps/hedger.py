@@ -1,9 +1,11 @@
+import functools
 import itertools
 import logging
+import time
 from collections import defaultdict
 from itertools import groupby, chain
 from operator import itemgetter
-from typing import Sequence, Iterable, Tuple
+from typing import Sequence, Iterable, Tuple, Callable
 
 import attrs
 from decimal import Decimal
@@ -12,7 +14,7 @@ from eth_defi.token import TokenDetails
 
 from lps import connectors
 from lps.connectors.abs import HasAssetPositions, CanDoOrders
-from lps import erc20
+from lps import erc20, metrics
 from lps.aerodrome import PositionInfo
 from lps.connectors import hl
 from lps.connectors.hl import HL
@@ -29,123 +31,166 @@ def _get_hedge_symbol_for_token(token: TokenDetails) -> str:
     # exact coin traded on the given perps exchange.
     return erc20.canonical_symbol(token.symbol)
 
-def compute_hedges(positions: Iterable[Tuple[PositionInfo, int]]) -> dict[str, Decimal]:
+# Raw (amount0, amount1) of the position which should be hedged at the tick,
+# None when position shouldn't be hedged at all. Built-in functions return
+# the same integer amounts as the position manager would at the tick.
+AmountsToHedge = Callable[[PositionInfo, int], Tuple[Decimal | int, Decimal | int] | None]
+
+def amounts_to_hedge(pos: PositionInfo, tick: int) -> Tuple[int, int]:
+    return v3_math.get_amounts_at_tick_exact(
+        pos.tick_lower, pos.tick_upper, pos.liquidity, tick)
+
+def amounts_to_hedge_50_50(pos: PositionInfo, tick: int) -> Tuple[int, int]:
+    middle_tick = (pos.tick_upper + pos.tick_lower) // 2
+    return v3_math.get_amounts_at_tick_exact(
+        pos.tick_lower, pos.tick_upper, pos.liquidity, middle_tick)
+
+def amounts_to_hedge_fixed_step(
+        pos: PositionInfo, tick: int, threshold: int = 0) -> Tuple[int, int] | None:
+    width = pos.tick_upper - pos.tick_lower
+
+    hedge_lines = [
+        pos.tick_lower,
+        pos.tick_lower + int(width / 2),
+        pos.tick_upper
+    ]
+
+    boundaries = [
+        pos.tick_lower,
+        pos.tick_upper,
+        ]
+
+    i = 0
+    while i < len(boundaries) and boundaries[i] < tick:
+        i += 1
+
+    # If we are on the edge, just do nothing
+    # Not emiting anything for the hedge means that we will not check it at all
+    if i >= 1 and abs(boundaries[i - 1] - tick) < threshold:
+        return None
+    if i < len(boundaries) and abs(boundaries[i] - tick) < threshold:
+        return None
+
+    cur_line = hedge_lines[i]
+
+    return v3_math.get_amounts_at_tick_exact(
+        pos.tick_lower, pos.tick_upper, pos.liquidity, cur_line)
+
+def amounts_to_hedge_4_step(pos: PositionInfo, tick: int) -> Tuple[int, int]:
+    width = pos.tick_upper - pos.tick_lower
+
+    hedge_lines = [
+        pos.tick_lower,
+        pos.tick_lower + 1 * int(width / 4),
+        pos.tick_lower + 2 * int(width / 4),
+        pos.tick_lower + 3 * int(width / 4),
+        pos.tick_upper
+    ]
+
+    boundaries = [
+        pos.tick_lower,
+        pos.tick_lower + int(width / 3),
+        pos.tick_lower + 2 * int(width / 3),
+        pos.tick_upper,
+        ]
+
+    i = 0
+    while i < len(boundaries) and boundaries[i] < tick:
+        i += 1
+    cur_line = hedge_lines[i]
+
+    return v3_math.get_amounts_at_tick_exact(
+        pos.tick_lower, pos.tick_upper, pos.liquidity, cur_line)
+
+def hedged_tokens(pos: PositionInfo) -> list[Tuple[int, str]]:
     """
-    Given list of positions and their corresponding ticks (pos, tick)
-    compute optimal set of perp shorts for hedging.
-    Returns symbol->size mapping.
+    Returns (token index, hedge symbol) of the position tokens which need hedging
     """
+    return [
+        (i, _get_hedge_symbol_for_token(token))
+        for i, token in enumerate((pos.token0, pos.token1))
+        if not erc20.guess_is_stable_coin(token)
+    ]
+
+def _sum_hedges(
+        positions: Iterable[Tuple[PositionInfo, int]],
+        amounts_fn: AmountsToHedge) -> dict[str, Decimal]:
     ret: dict[str, Decimal] = defaultdict(Decimal)
     for pos, tick in positions:
-        (amount0, amount1) = v3_math.get_amounts_at_tick(
-            pos.tick_lower, pos.tick_upper, pos.liquidity, tick)
-        if not erc20.guess_is_stable_coin(pos.token0):
-            ret[_get_hedge_symbol_for_token(pos.token0)] += \
-                pos.token0.convert_to_decimals(amount0)
-        if not erc20.guess_is_stable_coin(pos.token1):
-            ret[_get_hedge_symbol_for_token(pos.token1)] += \
-                pos.token1.convert_to_decimals(amount1)
+        amounts = amounts_fn(pos, tick)
+        if amounts is None:
+            continue
+        for i, symbol in hedged_tokens(pos):
+            ret[symbol] += (pos.token0, pos.token1)[i].convert_to_decimals(amounts[i])
 
     logger.debug(f'Optimal hedge sizes: {ret}')
     return ret
 
+def compute_hedges(positions: Iterable[Tuple[PositionInfo, int]]) -> dict[str, Decimal]:
+    """
+    Given list of positions and their corresponding ticks (pos, tick)
+    compute optimal set of perp shorts for hedging.
+    Returns symbol->size mapping.
+    """
+    return _sum_hedges(positions, amounts_to_hedge)
+
 def compute_hedges_50_50(positions: Iterable[Tuple[PositionInfo, int]]) -> dict[str, Decimal]:
     """
     Always hedges 50/50
     """
-    ret: dict[str, Decimal] = defaultdict(Decimal)
-    for pos, tick in positions:
-        middle_tick = (pos.tick_upper + pos.tick_lower) // 2
-        (amount0, amount1) = v3_math.get_amounts_at_tick(
-            pos.tick_lower, pos.tick_upper, pos.liquidity, middle_tick)
-        if not erc20.guess_is_stable_coin(pos.token0):
-            ret[_get_hedge_symbol_for_token(pos.token0)] += \
-                pos.token0.convert_to_decimals(amount0)
-        if not erc20.guess_is_stable_coin(pos.token1):
-            ret[_get_hedge_symbol_for_token(pos.token1)] += \
-                pos.token1.convert_to_decimals(amount1)
-
-    logger.debug(f'Optimal hedge sizes: {ret}')
-    return ret
+    return _sum_hedges(positions, amounts_to_hedge_50_50)
 
 def compute_hedges_fixed_step(positions: Iterable[Tuple[PositionInfo, int]], threshold: int = 0) -> dict[str, Decimal]:
-    ret: dict[str, Decimal] = defaultdict(Decimal)
-    for pos, tick in positions:
-        width = pos.tick_upper - pos.tick_lower
+    return _sum_hedges(
+        positions, functools.partial(amounts_to_hedge_fixed_step, threshold=threshold))
 
-        hedge_lines = [
-            pos.tick_lower,
-            pos.tick_lower + int(width / 2),
-            pos.tick_upper
-        ]
-
-        boundaries = [
-            pos.tick_lower,
-            pos.tick_upper,
-            ]
-
-        i = 0
-        while i < len(boundaries) and boundaries[i] < tick:
-            i += 1
-
-        # If we are on the edge, just do nothing
-        # Not emiting anything for the hedge means that we will not check it at all
-        if i >= 1 and abs(boundaries[i - 1] - tick) < threshold:
-            continue
-        if i < len(boundaries) and abs(boundaries[i] - tick) < threshold:
-            continue
-
-        cur_line = hedge_lines[i]
-
-        (amount0, amount1) = v3_math.get_amounts_at_tick(
-            pos.tick_lower, pos.tick_upper, pos.liquidity, cur_line)
-        if not erc20.guess_is_stable_coin(pos.token0):
-            ret[_get_hedge_symbol_for_token(pos.token0)] += \
-                pos.token0.convert_to_decimals(amount0)
-        if not erc20.guess_is_stable_coin(pos.token1):
-            ret[_get_hedge_symbol_for_token(pos.token1)] += \
-                pos.token1.convert_to_decimals(amount1)
+def compute_hedges_4_step(positions: Iterable[Tuple[PositionInfo, int]]) -> dict[str, Decimal]:
+    return _sum_hedges(positions, amounts_to_hedge_4_step)
 
-    logger.debug(f'Optimal hedge sizes: {ret}')
-    return ret
+def no_trade_band_fixed_step(pos: PositionInfo, tick: int, threshold: int = 0) -> Tuple[int, int]:
+    """
+    Returns [lo, hi] tick interval around the `tick` where
+    `compute_hedges_fixed_step` gives the same hedge for the position.
+    Hedge only changes when tick crosses one of the boundaries or
+    enters/leaves the `threshold` zone around it.
+    """
+    changes_at = []
+    for boundary in (pos.tick_lower, pos.tick_upper):
+        changes_at.append(boundary + 1)
+        if threshold > 0:
+            changes_at += [boundary - threshold + 1, boundary + threshold]
+
+    lo = max((t for t in changes_at if t <= tick), default=v3_math.MIN_TICK)
+    hi = min((t for t in changes_at if t > tick), default=v3_math.MAX_TICK + 1) - 1
+    return lo, hi
+
+@attrs.define
+class NoTradeBands:
+    """
+    No-trade tick bands of the positions, set after the hedge was adjusted.
+    While every tick is inside its band hedges stay the same, so there is
+    nothing to check on the exchange. Bands expire after `max_age_sec` to
+    still catch hedge value drifting with price or positions changed
+    outside of the hedger.
+    """
+    max_age_sec: float
+    bands: list[Tuple[int, int]] | None = None
+    updated_at: float = 0
 
-def compute_hedges_4_step(positions: Iterable[Tuple[PositionInfo, int]]) -> dict[str, Decimal]:
-    ret: dict[str, Decimal] = defaultdict(Decimal)
-    for pos, tick in positions:
-        width = pos.tick_upper - pos.tick_lower
-
-        hedge_lines = [
-            pos.tick_lower,
-            pos.tick_lower + 1 * int(width / 4),
-            pos.tick_lower + 2 * int(width / 4),
-            pos.tick_lower + 3 * int(width / 4),
-            pos.tick_upper
-        ]
+    def set(self, bands: list[Tuple[int, int]]):
+        self.bands = bands
+        self.updated_at = time.time()
 
-        boundaries = [
-            pos.tick_lower,
-            pos.tick_lower + int(width / 3),
-            pos.tick_lower + 2 * int(width / 3),
-            pos.tick_upper,
-            ]
-
-        i = 0
-        while i < len(boundaries) and boundaries[i] < tick:
-            i += 1
-        cur_line = hedge_lines[i]
-
-        (amount0, amount1) = v3_math.get_amounts_at_tick(
-            pos.tick_lower, pos.tick_upper, pos.liquidity, cur_line)
-        if not erc20.guess_is_stable_coin(pos.token0):
-            ret[_get_hedge_symbol_for_token(pos.token0)] += \
-                pos.token0.convert_to_decimals(amount0)
-        if not erc20.guess_is_stable_coin(pos.token1):
-            ret[_get_hedge_symbol_for_token(pos.token1)] += \
-                pos.token1.convert_to_decimals(amount1)
+    def clear(self):
+        self.bands = None
 
-    logger.debug(f'Optimal hedge sizes: {ret}')
-    return ret
+    def is_active(self) -> bool:
+        return self.bands is not None and time.time() - self.updated_at <= self.max_age_sec
 
+    def contains(self, ticks: Sequence[int]) -> bool:
+        if not self.is_active():
+            return False
+        return all(lo <= tick <= hi for (lo, hi), tick in zip(self.bands, ticks, strict=True))
 
 def compute_hedge_adjustments(
         conn: HasAssetPositions,
@@ -155,8 +200,10 @@ def compute_hedge_adjustments(
         symbol -> (old position size, new position size)
     Remove positions that don't need to be updated.
     """
-    positions = conn.get_user_positions()
-    mids = conn.get_mid_prices(*optimal_hedges.keys())
+    with metrics.span('get_user_positions'):
+        positions = conn.get_user_positions()
+    with metrics.span('get_mid_prices'):
+        mids = conn.get_mid_prices(*optimal_hedges.keys())
 
     ret: dict[str, (Decimal, Decimal)] = {}
     for symbol, optimal_hedge_size in optimal_hedges.items():
@@ -201,18 +248,16 @@ def execute_hedge_adjustements(
     if len(hedge_adjustements) > 0:
         logger.info(f'Adjusting hedge positions: {hedge_adjustements}')
 
-    updated_count = 0
-    for symbol, sz in hedge_adjustements.items():
-        (old_position_size, new_position_size) = sz
+    for symbol, (old_position_size, new_position_size) in hedge_adjustements.items():
         assert old_position_size <= 0, 'always shorting'
         assert new_position_size <= 0, 'always shorting'
-        try:
-            connectors.abs.adjust_position(
-                conn, symbol, old_position_size, new_position_size)
-            updated_count += 1
-        except hl.HLException:
-            logger.warning(f'Failed to update hedge position {symbol, old_position_size, new_position_size}')
-            continue
+
+    # All symbols are submitted together, partial fills are retried per symbol
+    is_updated = connectors.abs.adjust_positions(conn, hedge_adjustements)
+    for symbol, sz in hedge_adjustements.items():
+        if not is_updated[symbol]:
+            logger.warning(f'Failed to update hedge position {symbol, *sz}')
+    updated_count = sum(is_updated.values())
 
     if len(hedge_adjustements) > 0:
         logger.info(f'Updated {updated_count} hedges')
@@ -0,0 +1,163 @@
+import json
+import logging
+import sqlite3
+from pathlib import Path
+
+import attrs
+from hexbytes import HexBytes
+from web3 import Web3
+from web3.contract.contract import ContractEvent
+from web3.datastructures import AttributeDict
+from web3.types import EventData
+
+from lps.utils.config import data_path
+
+logger = logging.getLogger('log_indexer')
+
+INITIAL_CHUNK_BLOCKS = 10_000
+MAX_CHUNK_BLOCKS = 1_000_000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    query_key TEXT PRIMARY KEY,
+    last_block INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS logs (
+    query_key TEXT NOT NULL,
+    block_number INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    tx_hash TEXT NOT NULL,
+    address TEXT NOT NULL,
+    event TEXT NOT NULL,
+    args TEXT NOT NULL,
+    PRIMARY KEY (query_key, block_number, log_index)
+);
+"""
+
+def _query_key(event: ContractEvent, argument_filters: dict, from_block: int) -> str:
+    filters = json.dumps(argument_filters, sort_keys=True)
+    return f'{event.address}:{event.event_name}:{filters}:{from_block}'
+
+def _to_json(value):
+    if isinstance(value, bytes):
+        return HexBytes(value).hex()
+    if isinstance(value, (list, tuple)):
+        return [_to_json(v) for v in value]
+    return value
+
+def scan_logs(
+        event: ContractEvent,
+        argument_filters: dict,
+        from_block: int,
+        to_block: int,
+        on_chunk) -> None:
+    """
+    Fetches logs in [from_block, to_block] and passes every chunk to the
+    `on_chunk(logs, chunk_last_block)`. Chunk size is halved when node
+    rejects the request and doubled after every success, but never grows
+    back to the size that was rejected.
+    """
+    chunk_size = INITIAL_CHUNK_BLOCKS
+    max_chunk_size = MAX_CHUNK_BLOCKS
+    start = from_block
+    while start <= to_block:
+        end = min(start + chunk_size - 1, to_block)
+        try:
+            logs = event.get_logs(
+                argument_filters=argument_filters, fromBlock=start, toBlock=end)
+        except Exception as e:
+            if chunk_size == 1:
+                raise
+            chunk_size = max(1, chunk_size // 2)
+            max_chunk_size = chunk_size
+            logger.debug(f'Failed to get logs {start}-{end}, retrying with {chunk_size} blocks: {e}')
+            continue
+
+        on_chunk(list(logs), end)
+        logger.debug(f'Scanned {event.event_name} {start}-{end} ({len(logs)} logs)')
+        start = end + 1
+        chunk_size = min(chunk_size * 2, max_chunk_size)
+
+@attrs.define
+class LogIndexer:
+    """
+    Local store of decoded event logs, scanned in adaptive block range chunks.
+    Every query (event, contract address, argument filters) has its own
+    checkpoint, so repeated queries only fetch the new blocks.
+    Only finalized blocks are stored, the rest is fetched on every query.
+    """
+    db: sqlite3.Connection
+
+    def _get_checkpoint(self, key: str) -> int | None:
+        row = self.db.execute(
+            'SELECT last_block FROM checkpoints WHERE query_key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def _store_chunk(self, key: str, logs: list[EventData], last_block: int):
+        with self.db:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO logs VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(key, log['blockNumber'], log['logIndex'],
+                  log['transactionHash'].hex(), log['address'], log['event'],
+                  json.dumps({k: _to_json(v) for k, v in log['args'].items()}))
+                 for log in logs])
+            self.db.execute(
+                'INSERT OR REPLACE INTO checkpoints VALUES (?, ?)', (key, last_block))
+
+    def _load_logs(self, key: str) -> list[EventData]:
+        rows = self.db.execute(
+            'SELECT block_number, log_index, tx_hash, address, event, args FROM logs '
+            'WHERE query_key = ? ORDER BY block_number, log_index', (key,))
+        return [
+            AttributeDict({
+                'blockNumber': block_number,
+                'logIndex': log_index,
+                'transactionHash': HexBytes(tx_hash),
+                'address': address,
+                'event': event,
+                'args': AttributeDict(json.loads(args)),
+            }) for (block_number, log_index, tx_hash, address, event, args) in rows
+        ]
+
+    def get_logs(
+            self,
+            w3: Web3,
+            event: ContractEvent,
+            argument_filters: dict | None = None,
+            from_block: int = 0) -> list[EventData]:
+        """
+        Returns all logs of the event, same as `event.get_logs(fromBlock=from_block)`.
+        Event should be bound to the contract address unless logs from all
+        contracts are needed.
+        """
+        argument_filters = argument_filters or {}
+        key = _query_key(event, argument_filters, from_block)
+
+        finalized_block = w3.eth.get_block('finalized')['number']
+        checkpoint = self._get_checkpoint(key)
+        scan_from = from_block if checkpoint is None else checkpoint + 1
+
+        if scan_from <= finalized_block:
+            logger.info(f'Indexing {event.event_name} logs {scan_from}-{finalized_block}')
+            scan_logs(
+                event, argument_filters, scan_from, finalized_block,
+                lambda logs, last_block: self._store_chunk(key, logs, last_block))
+
+        ret = self._load_logs(key)
+
+        # Not finalized blocks can be re-orged, don't store them
+        latest_block = w3.eth.get_block_number()
+        scan_logs(
+            event, argument_filters, max(from_block, finalized_block + 1), latest_block,
+            lambda logs, _: ret.extend(logs))
+
+        return ret
+
+def start(w3: Web3, path: Path | None = None) -> LogIndexer:
+    if path is None:
+        path = data_path() / f'logs_{w3.eth.chain_id}.sqlite'
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    db = sqlite3.connect(path)
+    db.executescript(_SCHEMA)
+    return LogIndexer(db=db)
@@ -1,6 +1,6 @@
-import rich
+import time
+process_start = time.perf_counter()
 
-from connectors.base import create_base_web3
 from lps.utils.config import load_configuration, logging_config, get_config
 import sys
 import logging.config
@@ -8,26 +8,43 @@ import logging.config
 load_configuration(sys.argv[1])
 logging.config.dictConfig(logging_config())
 
+import asyncio
+import functools
 import signal
-import time
+from concurrent.futures import ThreadPoolExecutor
 
-from lps.aerodrome import get_position_info_cached, clear_caches
-from lps.connectors import hl
-from lps import hedger, erc20
+import rich
 
-from eth_defi.event_reader.block_time import measure_block_time
+from lps.connectors.base import create_base_web3, close_base_web3, start_block_feed, BlockHeader
+from lps.aerodrome import all_user_positions, clear_caches, \
+    get_slot0_batched
+from lps.connectors import hl
+from lps import hedger, erc20, metrics, tick_tracker, portfolio, position_index, contracts, \
+    pipeline
 
-from lps.connectors import binance
+# Binance connector is not imported, ccxt alone takes over half a second
 
 logger = logging.getLogger('main')
 
-def main():
-    w3 = create_base_web3()
-    a_hl = hl.start()
-    #a_binance = binance.start()
+metrics.observe('startup_imports', time.perf_counter() - process_start)
 
-    block_time_sec = measure_block_time(w3)
-    logger.info(f'Measured block time {block_time_sec}s')
+def start_hl() -> hl.HL:
+    with metrics.span('startup_hl'):
+        return hl.start()
+
+def main():
+    # Exchange and chain connections don't depend on each other
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        hl_future = executor.submit(start_hl)
+        with metrics.span('startup_chain'):
+            contracts.preload_abis()
+            w3 = create_base_web3()
+            block_feed = start_block_feed(w3)
+        a_hl = hl_future.result()
+
+    metrics_port = get_config().get('metrics_port')
+    if metrics_port is not None:
+        metrics.start_server(metrics_port)
 
     # Graceful shutdown
     is_running = True
@@ -38,69 +55,144 @@ def main():
     signal.signal(signal.SIGINT, stop)
     signal.signal(signal.SIGTERM, stop)
 
-    # Load position info
-    tracked_position_ids = (4823882,)
-    tracked_positions = []
-    for pos in tracked_position_ids:
-        pos = get_position_info_cached(w3, pos)
-        tracked_positions.append(pos)
-        rich.print(pos)
-
-    while is_running:
-        block = w3.eth.get_block('latest')
-        logger.info(f'Current block: {block["number"]} '
-                    f'delay {time.time() - block["timestamp"]:.2f}s')
-        block_number = block['number']
-        #block_number = w3.eth.get_block_number()
-
-        try:
-            ticks = list(
-                map(lambda pos: pos.pool.get_slot0(w3, block=block_number).tick,
-                    tracked_positions))
-
-            hedges = hedger.compute_hedges_fixed_step(
-                zip(tracked_positions, ticks, strict=True),
-                threshold=300)
-            adjustments = hedger.compute_hedge_adjustments(a_hl, hedges)
-            updated_cnt = hedger.execute_hedge_adjustements(a_hl, adjustments)
-
-            if len(adjustments) > 0:
-                logger.info(f"{block_number} {ticks} {dict(hedges)} {dict(adjustments)} {updated_cnt}")
-        except Exception:
-            logger.exception('Failed somewhere')
-            logger.warning('Re-creating all connections in 10 seconds')
-
-            # Assume that one of the connections is malfunctioning
-            # It will probably take some time until it recovers
-            while is_running:
-                try:
-                    time.sleep(10)
-                    w3 = create_base_web3()
-                    a_hl = hl.start()
-                    break
-                except Exception:
-                    logger.exception("Failed while re-creating connections")
-                    logger.warning("Retrying in 10 seconds")
+    threshold = 300
+    hedged_portfolio = portfolio.start(
+        functools.partial(hedger.amounts_to_hedge_fixed_step, threshold=threshold))
+    no_trade_bands = hedger.NoTradeBands(
+        max_age_sec=get_config().hl_hedger.get('no_trade_band_max_age_sec', 60))
+
+    # Positions of these addresses are hedged, including the staked ones
+    position_owners = get_config().hl_hedger.position_owners
+    positions_refresh_sec = get_config().hl_hedger.get('positions_refresh_sec', 30)
+    positions_index = position_index.start(w3, position_owners)
+
+    def start_tick_tracker():
+        if not get_config().hl_hedger.get('use_swap_logs', False):
+            return None
+        return tick_tracker.start(w3, map(lambda pos: pos.pool, hedged_portfolio.positions))
+    ticks_tracker = None
+
+    def refresh_positions():
+        """Picks up opened and closed positions"""
+        nonlocal ticks_tracker, positions_refreshed_at
+        positions_index.update()
+        positions_refreshed_at = time.time()
+        positions = {
+            pos.nft_id: pos
+            for owner in position_owners
+            for pos in all_user_positions(w3, positions_index, owner)
+        }
+        tracked = {pos.nft_id: pos for pos in hedged_portfolio.positions}
+        # Liquidity of the position changes with increases and decreases
+        changed_ids = {
+            nft_id for nft_id in positions.keys() & tracked.keys()
+            if positions[nft_id].liquidity != tracked[nft_id].liquidity}
+        if positions.keys() == tracked.keys() and len(changed_ids) == 0:
+            return
+
+        for nft_id in tracked.keys() - positions.keys():
+            logger.info(f'Position {nft_id} is closed')
+            hedged_portfolio.remove_position(nft_id)
+        for nft_id in changed_ids:
+            logger.info(f'Position {nft_id} liquidity changed '
+                        f'{tracked[nft_id].liquidity} -> {positions[nft_id].liquidity}')
+            hedged_portfolio.add_position(positions[nft_id])
+        for nft_id in positions.keys() - tracked.keys():
+            rich.print(positions[nft_id])
+            hedged_portfolio.add_position(positions[nft_id])
+        # Pools and bands are per position
+        ticks_tracker = start_tick_tracker()
+        no_trade_bands.clear()
+
+    positions_refreshed_at = 0
+    with metrics.span('startup_positions'):
+        refresh_positions()
+
+    logger.info(f'Started in {time.perf_counter() - process_start:.2f}s: ' + ', '.join(
+        f'{stage} {metrics.get_histogram(stage).sum:.2f}s'
+        for stage in ('startup_imports', 'startup_chain', 'startup_hl', 'startup_positions')))
+
+    async def read_ticks(block: BlockHeader) -> dict[str, int]:
+        if ticks_tracker is not None:
+            with metrics.span('swap_logs'):
+                return await asyncio.to_thread(ticks_tracker.update, block)
+        with metrics.span('slot0'):
+            slot0s = await asyncio.to_thread(
+                get_slot0_batched,
+                w3, [pos.pool for pos in hedged_portfolio.positions],
+                block=block.number)
+        return {addr: slot0.tick for addr, slot0 in slot0s.items()}
+
+    hedge_pipeline = pipeline.HedgePipeline(
+        exchange=pipeline.AsyncExchange(a_hl),
+        portfolio=hedged_portfolio,
+        bands=no_trade_bands,
+        read_ticks=read_ticks,
+        threshold=threshold)
+
+    async def run():
+        nonlocal w3, a_hl, block_feed, ticks_tracker
+        while is_running:
+            try:
+                block = await pipeline.next_block(block_feed, timeout_sec=1)
+                if block is None:
                     continue
-        time.sleep(block_time_sec)
-
-        # CEX->DEX price diff
-        # ticks = []
-        # for pos in tracked_positions:
-        #     slot0 = pos.pool.get_slot0(w3, block=block['number'])
-        #     ticks.append(slot0.tick)
-        #
-        #     pool_price = pos.pool.human_price(slot0.sqrtPriceX96)
-        #     logger.info(f'Pool price is {pool_price:.2f}')
-        #     binance_price = binance.mid_price(
-        #         a_binance,
-        #         erc20.canonic_symbol(pos.base.symbol),
-        #         erc20.canonic_symbol(pos.quote.symbol))
-        #     diff = abs(pool_price - binance_price) / pool_price * 100
-        #     logger.info(f'Binance mid price: {binance_price:.2f} diff vs dex {diff:.4f}%')
-        #     if diff > pos.pool.fee_pips / 10000:
-        #         logger.warning('CEX<->DEX price arbitrage possibility')
-
+                block_delay = time.time() - block.timestamp
+                logger.info(f'Current block: {block.number} '
+                            f'delay {block_delay:.2f}s')
+                metrics.observe('block_delay', block_delay)
+
+                if time.time() - positions_refreshed_at > positions_refresh_sec:
+                    # Bands of the orders in flight are for the current positions
+                    await hedge_pipeline.drain()
+                    with metrics.span('refresh_positions'):
+                        await asyncio.to_thread(refresh_positions)
+
+                # Orders of the block are sent in the background
+                await hedge_pipeline.process_block(block)
+
+                # CEX->DEX price diff
+                # ticks = []
+                # for pos in tracked_positions:
+                #     slot0 = pos.pool.get_slot0(w3, block=block['number'])
+                #     ticks.append(slot0.tick)
+                #
+                #     pool_price = pos.pool.human_price(slot0.sqrtPriceX96)
+                #     logger.info(f'Pool price is {pool_price:.2f}')
+                #     # Snapshot of all symbols is fetched at most once per ticker_ttl_sec
+                #     binance_price = a_binance.tickers.get_mid_prices(pos.base.symbol)[pos.base.symbol]
+                #     diff = abs(pool_price - binance_price) / pool_price * 100
+                #     logger.info(f'Binance mid price: {binance_price:.2f} diff vs dex {diff:.4f}%')
+                #     if diff > pos.pool.fee_pips / 10000:
+                #         logger.warning('CEX<->DEX price arbitrage possibility')
+            except Exception:
+                logger.exception('Failed somewhere')
+                await hedge_pipeline.reset()
+                logger.warning('Re-creating all connections in 10 seconds')
+
+                # Assume that one of the connections is malfunctioning
+                # It will probably take some time until it recovers
+                while is_running:
+                    try:
+                        await asyncio.sleep(10)
+                        block_feed.close()
+                        a_hl.stop()
+                        close_base_web3(w3)
+                        w3 = create_base_web3()
+                        a_hl = await asyncio.to_thread(hl.start)
+                        block_feed = start_block_feed(w3)
+                        positions_index.w3 = w3
+                        ticks_tracker = start_tick_tracker()
+                        hedge_pipeline.exchange = pipeline.AsyncExchange(a_hl)
+                        break
+                    except Exception:
+                        logger.exception("Failed while re-creating connections")
+                        logger.warning("Retrying in 10 seconds")
+                        continue
+
+        await hedge_pipeline.drain()
+
+    asyncio.run(run())
 
     # aero_nft_manager = get_deployed_contract(
     #     w3,
@@ -0,0 +1,145 @@
+import logging
+import sqlite3
+import threading
+from functools import lru_cache
+from pathlib import Path
+
+import attrs
+from web3 import Web3
+
+from lps.utils.config import data_path
+
+logger = logging.getLogger('metadata_cache')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tokens (
+    chain_id INTEGER NOT NULL,
+    address TEXT NOT NULL,
+    name TEXT,
+    symbol TEXT,
+    decimals INTEGER,
+    PRIMARY KEY (chain_id, address)
+);
+CREATE TABLE IF NOT EXISTS pools (
+    chain_id INTEGER NOT NULL,
+    token0 TEXT NOT NULL,
+    token1 TEXT NOT NULL,
+    tick_spacing INTEGER NOT NULL,
+    address TEXT NOT NULL,
+    fee_pips INTEGER NOT NULL,
+    PRIMARY KEY (chain_id, token0, token1, tick_spacing)
+);
+CREATE TABLE IF NOT EXISTS chains (
+    chain_id INTEGER PRIMARY KEY,
+    block_time_sec REAL NOT NULL
+);
+"""
+
+@attrs.frozen
+class TokenMeta:
+    address: str
+    name: str | None
+    symbol: str | None
+    decimals: int | None
+
+@attrs.frozen
+class PoolMeta:
+    address: str
+    token0: str
+    token1: str
+    tick_spacing: int
+    fee_pips: int
+
+@lru_cache(maxsize=256)
+def chain_id_cached(w3: Web3) -> int:
+    return w3.eth.chain_id
+
+@attrs.define
+class MetadataCache:
+    """
+    On-disk cache of the contract metadata which doesn't change or changes
+    rarely, keyed by chain id and address so it survives new connections
+    and restarts. Fees can be changed by the pool factory, entries should be
+    invalidated explicitly when that happens. Can be used from multiple threads.
+    """
+    db: sqlite3.Connection
+    _lock: threading.Lock = attrs.field(factory=threading.Lock)
+
+    def get_token(self, chain_id: int, address: str) -> TokenMeta | None:
+        with self._lock:
+            row = self.db.execute(
+                'SELECT address, name, symbol, decimals FROM tokens WHERE chain_id = ? AND address = ?',
+                (chain_id, Web3.to_checksum_address(address))).fetchone()
+            return TokenMeta(*row) if row else None
+
+    def put_token(self, chain_id: int, token: TokenMeta):
+        with self._lock, self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO tokens VALUES (?, ?, ?, ?, ?)',
+                (chain_id, Web3.to_checksum_address(token.address),
+                 token.name, token.symbol, token.decimals))
+
+    def get_pool(self, chain_id: int, token0: str, token1: str, tick_spacing: int) -> PoolMeta | None:
+        with self._lock:
+            row = self.db.execute(
+                'SELECT address, token0, token1, tick_spacing, fee_pips FROM pools '
+                'WHERE chain_id = ? AND token0 = ? AND token1 = ? AND tick_spacing = ?',
+                (chain_id, Web3.to_checksum_address(token0), Web3.to_checksum_address(token1),
+                 tick_spacing)).fetchone()
+            return PoolMeta(*row) if row else None
+
+    def put_pool(self, chain_id: int, pool: PoolMeta):
+        with self._lock, self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO pools VALUES (?, ?, ?, ?, ?, ?)',
+                (chain_id, Web3.to_checksum_address(pool.token0),
+                 Web3.to_checksum_address(pool.token1), pool.tick_spacing,
+                 Web3.to_checksum_address(pool.address), pool.fee_pips))
+
+    def get_block_time(self, chain_id: int) -> float | None:
+        with self._lock:
+            row = self.db.execute(
+                'SELECT block_time_sec FROM chains WHERE chain_id = ?', (chain_id,)).fetchone()
+            return row[0] if row else None
+
+    def put_block_time(self, chain_id: int, block_time_sec: float):
+        with self._lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO chains VALUES (?, ?)', (chain_id, block_time_sec))
+
+    def invalidate_token(self, chain_id: int, address: str):
+        with self._lock, self.db:
+            self.db.execute(
+                'DELETE FROM tokens WHERE chain_id = ? AND address = ?',
+                (chain_id, Web3.to_checksum_address(address)))
+
+    def invalidate_pool(self, chain_id: int, address: str):
+        with self._lock, self.db:
+            self.db.execute(
+                'DELETE FROM pools WHERE chain_id = ? AND address = ?',
+                (chain_id, Web3.to_checksum_address(address)))
+
+    def clear(self):
+        with self._lock, self.db:
+            self.db.execute('DELETE FROM tokens')
+            self.db.execute('DELETE FROM pools')
+            self.db.execute('DELETE FROM chains')
+
+def start(path: Path | None = None) -> MetadataCache:
+    if path is None:
+        path = data_path() / 'metadata.sqlite'
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    db = sqlite3.connect(path, check_same_thread=False)
+    db.executescript(_SCHEMA)
+    return MetadataCache(db=db)
+
+# Process wide, opened on first use
+_default: MetadataCache | None = None
+_default_lock = threading.Lock()
+
+def get_default() -> MetadataCache:
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = start()
+    return _default
@@ -0,0 +1,123 @@
+import logging
+import threading
+import time
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import attrs
+
+logger = logging.getLogger('metrics')
+
+# Percentiles are computed over this many latest samples of every stage
+WINDOW_SIZE = 1024
+QUANTILES = (0.5, 0.95, 0.99)
+
+@attrs.define
+class Histogram:
+    """Rolling window of samples plus totals since the start"""
+    samples: deque[float] = attrs.field(factory=lambda: deque(maxlen=WINDOW_SIZE))
+    count: int = 0
+    sum: float = 0
+
+    def observe(self, value: float):
+        self.samples.append(value)
+        self.count += 1
+        self.sum += value
+
+    def quantiles(self) -> dict[float, float]:
+        samples = sorted(self.samples)
+        if len(samples) == 0:
+            return {}
+        return {q: samples[min(int(q * len(samples)), len(samples) - 1)] for q in QUANTILES}
+
+# Process wide, same as loggers. Updated from the worker threads too.
+_histograms: dict[str, Histogram] = {}
+_counters: dict[str, int] = {}
+_lock = threading.Lock()
+
+def observe(stage: str, value_sec: float):
+    with _lock:
+        hist = _histograms.get(stage)
+        if hist is None:
+            hist = _histograms.setdefault(stage, Histogram())
+        hist.observe(value_sec)
+
+def inc(counter: str, value: int = 1):
+    with _lock:
+        _counters[counter] = _counters.get(counter, 0) + value
+
+class span:
+    """
+    Times the block into the stage histogram:
+        with metrics.span('slot0'):
+            ...
+    """
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        observe(self.stage, time.perf_counter() - self.start)
+
+def get_histogram(stage: str) -> Histogram | None:
+    return _histograms.get(stage)
+
+def get_counter(counter: str) -> int:
+    return _counters.get(counter, 0)
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+def render() -> str:
+    """Prometheus text exposition format"""
+    lines = [
+        '# HELP lps_stage_seconds Latency of the hedger stages, quantiles over the recent samples',
+        '# TYPE lps_stage_seconds summary',
+    ]
+    with _lock:
+        for stage, hist in sorted(_histograms.items()):
+            for q, value in hist.quantiles().items():
+                lines.append(f'lps_stage_seconds{{stage="{stage}",quantile="{q}"}} {value:.6f}')
+            lines.append(f'lps_stage_seconds_sum{{stage="{stage}"}} {hist.sum:.6f}')
+            lines.append(f'lps_stage_seconds_count{{stage="{stage}"}} {hist.count}')
+
+        for counter, value in sorted(_counters.items()):
+            lines.append(f'# TYPE lps_{counter}_total counter')
+            lines.append(f'lps_{counter}_total {value}')
+    return '\n'.join(lines) + '\n'
+
+def rpc_counter_middleware(make_request, w3):
+    """Web3 middleware which counts JSON-RPC requests"""
+    def middleware(method, params):
+        inc('rpc_calls')
+        return make_request(method, params)
+    return middleware
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server(port: int, host: str = '0.0.0.0') -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f'Serving metrics on {host}:{server.server_address[1]}/metrics')
+    return server
@@ -0,0 +1,45 @@
+import logging
+from typing import Sequence
+
+from web3 import Web3
+from web3._utils.abi import get_abi_output_types
+from web3.contract.contract import ContractFunction
+from web3.types import BlockIdentifier
+
+from lps.contracts import create_contract_cached
+
+logger = logging.getLogger('multicall')
+
+# Deployed at the same address on all major chains, see multicall3.com
+MULTICALL3_ADDRESS = '0xcA11bde05977b3631167028862bE2a173976CA11'
+
+def aggregate3(
+        w3: Web3,
+        calls: Sequence[ContractFunction],
+        block: BlockIdentifier = 'latest',
+        allow_failure: bool = False) -> list[tuple | None]:
+    """
+    Executes all contract calls in a single eth_call via Multicall3.
+    Returns decoded outputs in the same order as `calls`.
+    Failed calls are returned as None when `allow_failure` is set,
+    otherwise the whole multicall reverts.
+    """
+    if len(calls) == 0:
+        return []
+
+    multicall = create_contract_cached(
+        w3, address=MULTICALL3_ADDRESS, abi_fname="multicall3.json")
+
+    results = multicall.functions.aggregate3([
+        (call.address, allow_failure, call._encode_transaction_data())
+        for call in calls
+    ]).call(block_identifier=block)
+
+    ret: list[tuple | None] = []
+    for call, (success, data) in zip(calls, results, strict=True):
+        if not success:
+            logger.debug(f'Call failed {call.address} {call.fn_name}')
+            ret.append(None)
+            continue
+        ret.append(tuple(w3.codec.decode(get_abi_output_types(call.abi), data)))
+    return ret
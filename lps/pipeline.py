@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import time
+from decimal import Decimal
+from typing import Awaitable, Callable
+
+import attrs
+
+from lps import hedger, metrics
+from lps.connectors.abs import AssetPosition, HasAssetPositions, CanDoOrders
+from lps.connectors.base import BlockFeed, BlockHeader
+from lps.portfolio import Portfolio
+
+logger = logging.getLogger('pipeline')
+
+# Pool address -> tick at the block
+ReadTicks = Callable[[BlockHeader], Awaitable[dict[str, int]]]
+
+@attrs.frozen
+class ExchangeSnapshot:
+    """
+    Positions and mids read ahead of `compute_hedge_adjustments`,
+    with the same interface as the connector
+    """
+    positions: dict[str, AssetPosition]
+    mids: dict[str, Decimal]
+
+    def get_user_positions(self) -> dict[str, AssetPosition]:
+        return self.positions
+
+    def get_mid_prices(self, *names: str) -> dict[str, Decimal]:
+        return {name: self.mids[name] for name in names}
+
+@attrs.define
+class AsyncExchange:
+    """
+    Coroutine interface of a connector. Connectors (and the SDKs below them)
+    are blocking, so every call runs in a worker thread and reads overlap.
+    """
+    conn: HasAssetPositions | CanDoOrders
+
+    async def read_snapshot(self, symbols: list[str]) -> ExchangeSnapshot:
+        with metrics.span('read_exchange'):
+            (positions, mids) = await asyncio.gather(
+                asyncio.to_thread(self.conn.get_user_positions),
+                asyncio.to_thread(self.conn.get_mid_prices, *symbols))
+        return ExchangeSnapshot(positions=positions, mids=mids)
+
+    async def execute_hedge_adjustments(self, adjustments: dict[str, (Decimal, Decimal)]) -> int:
+        with metrics.span('execute_hedge_adjustments'):
+            return await asyncio.to_thread(hedger.execute_hedge_adjustements, self.conn, adjustments)
+
+async def next_block(block_feed: BlockFeed, timeout_sec: float) -> BlockHeader | None:
+    return await asyncio.to_thread(block_feed.next_block, timeout_sec)
+
+@attrs.define
+class HedgePipeline:
+    """
+    Per block: chain and exchange state are read concurrently, hedges are
+    computed and orders are sent in the background. Next block is read
+    while orders are waiting for acks, only the exchange read of the next
+    block waits for them, as positions change with the fills.
+    Hedges and adjustments are the same as in the sequential loop.
+    """
+    exchange: AsyncExchange
+    portfolio: Portfolio
+    bands: hedger.NoTradeBands
+    read_ticks: ReadTicks
+    threshold: int
+
+    _orders: asyncio.Task | None = None
+
+    async def _read_exchange(self, symbols: list[str]) -> ExchangeSnapshot:
+        orders = self._orders
+        if orders is not None:
+            # Raises if orders failed, shielded from the cancellation of this read
+            await asyncio.shield(orders)
+        return await self.exchange.read_snapshot(symbols)
+
+    async def _execute(
+            self,
+            adjustments: dict[str, (Decimal, Decimal)],
+            bands: list[tuple[int, int]],
+            generation: int):
+        try:
+            updated_cnt = await self.exchange.execute_hedge_adjustments(adjustments)
+        except Exception:
+            self.bands.clear()
+            raise
+        # Bands are per position, they don't apply once positions have changed
+        if updated_cnt == len(adjustments) and generation == self.portfolio.generation:
+            self.bands.set(bands)
+        else:
+            self.bands.clear()
+
+    async def process_block(self, block: BlockHeader):
+        processing_start = time.perf_counter()
+        generation = self.portfolio.generation
+        positions = self.portfolio.positions
+        symbols = sorted({
+            symbol for pos in positions for _, symbol in hedger.hedged_tokens(pos)})
+
+        # Exchange is only read when the ticks can be outside of the bands
+        exchange_read = None
+        if not self.bands.is_active():
+            exchange_read = asyncio.create_task(self._read_exchange(symbols))
+
+        try:
+            with metrics.span('read_ticks'):
+                pool_ticks = await self.read_ticks(block)
+            ticks = [pool_ticks[pos.pool.address] for pos in positions]
+
+            if self.bands.contains(ticks):
+                metrics.inc('no_trade_band_skips')
+                return
+
+            if exchange_read is None:
+                exchange_read = asyncio.create_task(self._read_exchange(symbols))
+
+            with metrics.span('compute_hedges_fixed_step'):
+                # Only positions of the pools with changed tick are recomputed
+                self.portfolio.update_ticks(pool_ticks)
+                hedges = self.portfolio.hedges()
+            snapshot = await exchange_read
+            exchange_read = None
+        finally:
+            if exchange_read is not None:
+                exchange_read.cancel()
+
+        with metrics.span('compute_hedge_adjustments'):
+            adjustments = hedger.compute_hedge_adjustments(snapshot, hedges)
+        bands = [
+            hedger.no_trade_band_fixed_step(pos, tick, self.threshold)
+            for pos, tick in zip(positions, ticks, strict=True)]
+        metrics.observe('block', time.perf_counter() - processing_start)
+
+        if len(adjustments) == 0:
+            self.bands.set(bands)
+            return
+
+        logger.info(f"{block.number} {ticks} {dict(hedges)} {dict(adjustments)}")
+        # Previous bands don't hold until the orders are filled,
+        # every block is checked against the exchange meanwhile
+        self.bands.clear()
+        self._orders = asyncio.create_task(self._execute(adjustments, bands, generation))
+
+    async def drain(self):
+        """Waits for the orders in flight, raises if they failed"""
+        if self._orders is not None:
+            (orders, self._orders) = (self._orders, None)
+            await orders
+
+    async def reset(self):
+        """Waits for the orders in flight ignoring the result, e.g. before reconnecting"""
+        if self._orders is not None:
+            (orders, self._orders) = (self._orders, None)
+            await asyncio.gather(orders, return_exceptions=True)
+        self.bands.clear()
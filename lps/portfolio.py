@@ -0,0 +1,127 @@
+import logging
+from collections import defaultdict
+from decimal import Decimal
+from typing import Iterable
+
+import attrs
+
+from lps import hedger
+from lps.aerodrome import PositionInfo
+from lps.hedger import AmountsToHedge
+
+logger = logging.getLogger('portfolio')
+
+@attrs.define
+class _Entry:
+    pos: PositionInfo
+    hedged_tokens: list[tuple[int, str]] # (token index, symbol)
+    # Cached hedge of the position, None if position isn't hedged at current tick
+    contribution: dict[str, Decimal] | None = None
+
+@attrs.define
+class Portfolio:
+    """
+    Hedges of many positions, same as `hedger._sum_hedges` with the same
+    `amounts_fn`, but updated incrementally. Hedge of every position is
+    cached, and on tick update only positions of the pools whose tick has
+    changed are recomputed and applied to the totals as a delta.
+    """
+    amounts_fn: AmountsToHedge
+
+    _entries: dict[int, _Entry] = attrs.field(factory=dict) # nft id -> entry
+    _by_pool: dict[str, set[int]] = attrs.field(factory=lambda: defaultdict(set))
+    _by_symbol: dict[str, set[int]] = attrs.field(factory=lambda: defaultdict(set))
+    _ticks: dict[str, int] = attrs.field(factory=dict) # pool address -> tick
+
+    _totals: dict[str, Decimal] = attrs.field(factory=lambda: defaultdict(Decimal))
+    # Number of positions hedged at current ticks, symbol is only
+    # emitted when at least one position is hedged, same as in hedger
+    _contributors: dict[str, int] = attrs.field(factory=lambda: defaultdict(int))
+    # Incremented whenever a position is added or removed
+    generation: int = 0
+
+    def _set_contribution(self, entry: _Entry, contribution: dict[str, Decimal] | None):
+        if entry.contribution is not None:
+            for symbol, size in entry.contribution.items():
+                self._totals[symbol] -= size
+                self._contributors[symbol] -= 1
+        entry.contribution = contribution
+        if contribution is not None:
+            for symbol, size in contribution.items():
+                self._totals[symbol] += size
+                self._contributors[symbol] += 1
+
+    def _recompute(self, entry: _Entry):
+        tick = self._ticks.get(entry.pos.pool.address)
+        amounts = self.amounts_fn(entry.pos, tick) if tick is not None else None
+        if amounts is None:
+            self._set_contribution(entry, None)
+            return
+
+        tokens = (entry.pos.token0, entry.pos.token1)
+        contribution: dict[str, Decimal] = defaultdict(Decimal)
+        for i, symbol in entry.hedged_tokens:
+            contribution[symbol] += tokens[i].convert_to_decimals(amounts[i])
+        self._set_contribution(entry, contribution)
+
+    def add_position(self, pos: PositionInfo):
+        """Position is hedged as soon as the tick of its pool is known"""
+        if pos.nft_id in self._entries:
+            self.remove_position(pos.nft_id)
+
+        entry = _Entry(pos=pos, hedged_tokens=hedger.hedged_tokens(pos))
+        self._entries[pos.nft_id] = entry
+        self.generation += 1
+        self._by_pool[pos.pool.address].add(pos.nft_id)
+        for _, symbol in entry.hedged_tokens:
+            self._by_symbol[symbol].add(pos.nft_id)
+        self._recompute(entry)
+
+    def remove_position(self, nft_id: int):
+        entry = self._entries.pop(nft_id)
+        self.generation += 1
+        self._set_contribution(entry, None)
+        self._by_pool[entry.pos.pool.address].discard(nft_id)
+        for _, symbol in entry.hedged_tokens:
+            self._by_symbol[symbol].discard(nft_id)
+
+    def update_ticks(self, pool_ticks: dict[str, int]) -> set[str]:
+        """
+        Updates ticks of the pools. Returns symbols whose hedge might have changed.
+        """
+        changed_symbols = set()
+        for pool, tick in pool_ticks.items():
+            if self._ticks.get(pool) == tick:
+                continue
+            self._ticks[pool] = tick
+            for nft_id in self._by_pool.get(pool, ()):
+                entry = self._entries[nft_id]
+                self._recompute(entry)
+                changed_symbols.update(symbol for _, symbol in entry.hedged_tokens)
+        return changed_symbols
+
+    @property
+    def positions(self) -> list[PositionInfo]:
+        return [entry.pos for entry in self._entries.values()]
+
+    def positions_of_pool(self, pool: str) -> list[PositionInfo]:
+        return [self._entries[nft_id].pos for nft_id in self._by_pool.get(pool, ())]
+
+    def positions_of_symbol(self, symbol: str) -> list[PositionInfo]:
+        return [self._entries[nft_id].pos for nft_id in self._by_symbol.get(symbol, ())]
+
+    def tick(self, pool: str) -> int | None:
+        return self._ticks.get(pool)
+
+    def hedges(self) -> dict[str, Decimal]:
+        """Returns symbol -> size mapping, same as `hedger.compute_hedges*`"""
+        return {
+            symbol: size for symbol, size in self._totals.items()
+            if self._contributors[symbol] > 0
+        }
+
+def start(amounts_fn: AmountsToHedge, positions: Iterable[PositionInfo] = ()) -> Portfolio:
+    portfolio = Portfolio(amounts_fn=amounts_fn)
+    for pos in positions:
+        portfolio.add_position(pos)
+    return portfolio
@@ -0,0 +1,204 @@
+import logging
+import sqlite3
+from pathlib import Path
+from typing import Iterable
+
+import attrs
+from web3 import Web3
+from web3._utils.filters import construct_event_filter_params
+from web3.contract.contract import ContractEvent
+from web3.types import EventData
+
+from lps.contracts import create_contract_cached
+from lps.log_indexer import scan_logs
+from lps.utils.config import data_path, get_config
+
+logger = logging.getLogger('position_index')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    owner TEXT PRIMARY KEY,
+    last_block INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS positions (
+    owner TEXT NOT NULL,
+    token_id INTEGER NOT NULL,
+    staked INTEGER NOT NULL,
+    PRIMARY KEY (owner, token_id, staked)
+);
+"""
+
+@attrs.frozen
+class _AnyAddressEvent:
+    """
+    Same as `event.get_logs` but for the logs of all contracts,
+    web3 only allows it for the events bound to an address
+    """
+    w3: Web3
+    event: ContractEvent
+
+    @property
+    def event_name(self) -> str:
+        return self.event.event_name
+
+    def get_logs(self, argument_filters: dict, fromBlock: int, toBlock: int) -> list[EventData]:
+        _, filter_params = construct_event_filter_params(
+            self.event._get_event_abi(), self.w3.codec,
+            argument_filters=argument_filters, fromBlock=fromBlock, toBlock=toBlock)
+        return [self.event.process_log(log) for log in self.w3.eth.get_logs(filter_params)]
+
+@attrs.define
+class Ownership:
+    """Position NFTs of one address"""
+    owner: str
+    held: set[int] = attrs.field(factory=set)
+    # Deposited into gauges, gauge holds the NFT
+    staked: set[int] = attrs.field(factory=set)
+
+    @property
+    def token_ids(self) -> set[int]:
+        return self.held | self.staked
+
+    def copy(self) -> 'Ownership':
+        return Ownership(owner=self.owner, held=set(self.held), staked=set(self.staked))
+
+    def apply(self, logs: Iterable[EventData]):
+        """
+        Logs should be ordered, held and staked sets don't depend on each other.
+        Deposit/Withdraw logs are read from all contracts, so only the ones
+        which moved the NFT between the owner and the emitting contract in
+        the same transaction are gauge logs, others are ignored.
+        """
+        logs = list(logs)
+        # (tx hash, token id, counterparty) of the NFT transfers from and to the owner
+        sent = set()
+        received = set()
+        for log in logs:
+            if log['event'] == 'Transfer':
+                args = log['args']
+                if args['from'] == self.owner:
+                    sent.add((log['transactionHash'], args['tokenId'], args['to']))
+                if args['to'] == self.owner:
+                    received.add((log['transactionHash'], args['tokenId'], args['from']))
+
+        for log in logs:
+            args = log['args']
+            if log['event'] == 'Transfer':
+                # Burn is a transfer to zero address
+                if args['from'] == self.owner:
+                    self.held.discard(args['tokenId'])
+                if args['to'] == self.owner:
+                    self.held.add(args['tokenId'])
+            elif log['event'] == 'Deposit':
+                if (log['transactionHash'], args['tokenId'], log['address']) in sent:
+                    self.staked.add(args['tokenId'])
+            elif log['event'] == 'Withdraw':
+                if (log['transactionHash'], args['tokenId'], log['address']) in received:
+                    self.staked.discard(args['tokenId'])
+            else:
+                assert False, f"unexpected event {log['event']}"
+
+@attrs.define
+class PositionIndex:
+    """
+    Local index of the position NFTs of the watched addresses, held or
+    staked into the gauges. Built from position manager Transfer logs and
+    gauge Deposit/Withdraw logs. vfat positions are staked by the Sickle
+    wallet, so the Sickle address should be watched for them.
+
+    Ownership at the finalized block is stored with a checkpoint and only
+    new blocks are scanned by `update()`. Reads never touch the node.
+    """
+    w3: Web3
+    db: sqlite3.Connection
+    from_block: int = 0
+
+    _finalized: dict[str, Ownership] = attrs.field(factory=dict)
+    _checkpoints: dict[str, int] = attrs.field(factory=dict)
+    # Finalized ownership plus logs of the not finalized blocks
+    _latest: dict[str, Ownership] = attrs.field(factory=dict)
+
+    def _events(self, owner: str) -> list:
+        nft_manager = create_contract_cached(
+            self.w3, "aerodrome_nft_manager.json",
+            address=get_config().aerodrome.nft_position_manager)
+        # Logs of all gauges are needed
+        cl_gauge = create_contract_cached(self.w3, "aerodrome_cl_gauge.json")
+        return [
+            (nft_manager.events.Transfer, {'to': owner}),
+            (nft_manager.events.Transfer, {'from': owner}),
+            (_AnyAddressEvent(self.w3, cl_gauge.events.Deposit()), {'user': owner}),
+            (_AnyAddressEvent(self.w3, cl_gauge.events.Withdraw()), {'user': owner}),
+        ]
+
+    def _fetch(self, owner: str, from_block: int, to_block: int) -> list[EventData]:
+        # Transfer to self is returned by both Transfer queries
+        logs: dict[tuple[int, int], EventData] = {}
+        def on_chunk(chunk: list[EventData], _):
+            logs.update(((log['blockNumber'], log['logIndex']), log) for log in chunk)
+
+        for (event, argument_filters) in self._events(owner):
+            scan_logs(event, argument_filters, from_block, to_block, on_chunk)
+        return [logs[key] for key in sorted(logs)]
+
+    def _store(self, ownership: Ownership, last_block: int):
+        with self.db:
+            self.db.execute('DELETE FROM positions WHERE owner = ?', (ownership.owner,))
+            self.db.executemany(
+                'INSERT INTO positions VALUES (?, ?, ?)',
+                [(ownership.owner, token_id, 0) for token_id in ownership.held] +
+                [(ownership.owner, token_id, 1) for token_id in ownership.staked])
+            self.db.execute(
+                'INSERT OR REPLACE INTO checkpoints VALUES (?, ?)', (ownership.owner, last_block))
+
+    def watch(self, owner: str):
+        """Loads stored ownership of the address, new blocks are read on `update()`"""
+        owner = Web3.to_checksum_address(owner)
+        if owner in self._finalized:
+            return
+
+        row = self.db.execute(
+            'SELECT last_block FROM checkpoints WHERE owner = ?', (owner,)).fetchone()
+        ownership = Ownership(owner=owner)
+        for (token_id, staked) in self.db.execute(
+                'SELECT token_id, staked FROM positions WHERE owner = ?', (owner,)):
+            (ownership.staked if staked else ownership.held).add(token_id)
+
+        self._finalized[owner] = ownership
+        self._checkpoints[owner] = row[0] if row else self.from_block - 1
+        self._latest[owner] = ownership.copy()
+
+    def update(self):
+        """Reads logs of the new blocks of all watched addresses"""
+        finalized_block = self.w3.eth.get_block('finalized')['number']
+        latest_block = self.w3.eth.get_block_number()
+
+        for owner, ownership in self._finalized.items():
+            checkpoint = self._checkpoints[owner]
+            if checkpoint < finalized_block:
+                logger.info(f'Indexing positions of {owner} {checkpoint + 1}-{finalized_block}')
+                ownership.apply(self._fetch(owner, checkpoint + 1, finalized_block))
+                self._store(ownership, finalized_block)
+                checkpoint = self._checkpoints[owner] = finalized_block
+
+            # Not finalized blocks can be re-orged, re-read them every time
+            latest = ownership.copy()
+            latest.apply(self._fetch(owner, checkpoint + 1, latest_block))
+            self._latest[owner] = latest
+
+    def token_ids(self, owner: str) -> set[int]:
+        """Not burned positions of the watched address as of the last `update()`"""
+        return set(self._latest[Web3.to_checksum_address(owner)].token_ids)
+
+def start(w3: Web3, owners: Iterable[str] = (), path: Path | None = None) -> PositionIndex:
+    if path is None:
+        path = data_path() / f'positions_{w3.eth.chain_id}.sqlite'
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    db = sqlite3.connect(path)
+    db.executescript(_SCHEMA)
+    index = PositionIndex(
+        w3=w3, db=db, from_block=get_config().aerodrome.get('position_index_from_block', 0))
+    for owner in owners:
+        index.watch(owner)
+    return index
@@ -0,0 +1,330 @@
+import argparse
+import functools
+import logging
+import time
+from decimal import Decimal
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+
+import attrs
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from web3 import Web3
+
+from lps import hedger, erc20
+from lps.aerodrome import PositionInfo, CLPoolInfo, get_slot0_batched
+from lps.backtest import HedgeComputer
+from lps.connectors import mock_cex
+from lps.log_indexer import scan_logs
+from lps.utils import v3_math
+
+logger = logging.getLogger('replay')
+
+TICK_PREFIX = 'tick_'
+MID_PREFIX = 'mid_'
+# Blocks per parquet row group, history is recorded in chunks of this size
+CHUNK_BLOCKS = 50_000
+# Blocks read from disk at once
+READ_BATCH_BLOCKS = 65_536
+
+MidsAt = Callable[[int], dict[str, float]] # timestamp sec -> symbol -> mid
+
+@attrs.frozen
+class BlockRecord:
+    number: int
+    timestamp: int
+    ticks: dict[str, int] # pool address -> tick at the end of the block
+    mids: dict[str, float] # canonical symbol -> mid price
+
+def _schema(pools: list[str], symbols: list[str]) -> pa.Schema:
+    return pa.schema(
+        [('block_number', pa.int64()), ('timestamp', pa.int64())]
+        + [(TICK_PREFIX + pool, pa.int32()) for pool in pools]
+        + [(MID_PREFIX + symbol, pa.float64()) for symbol in symbols])
+
+@attrs.define
+class HistoryWriter:
+    """Appends blocks to the parquet file, every `write` is a row group"""
+    writer: pq.ParquetWriter
+    pools: list[str]
+    symbols: list[str]
+
+    def write(
+            self,
+            numbers: np.ndarray,
+            timestamps: np.ndarray,
+            ticks: dict[str, np.ndarray],
+            mids: dict[str, np.ndarray]):
+        columns = [numbers, timestamps] \
+            + [ticks[pool] for pool in self.pools] \
+            + [mids[symbol] for symbol in self.symbols]
+        self.writer.write_table(pa.table(columns, schema=self.writer.schema))
+
+    def close(self):
+        self.writer.close()
+
+def open_writer(path: Path, pools: Iterable[str], symbols: Iterable[str]) -> HistoryWriter:
+    pools, symbols = list(pools), list(symbols)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return HistoryWriter(
+        writer=pq.ParquetWriter(path, _schema(pools, symbols)),
+        pools=pools,
+        symbols=symbols)
+
+def read_history(path: Path, batch_blocks: int = READ_BATCH_BLOCKS) -> Iterator[BlockRecord]:
+    """Streams blocks from the file, only one batch is kept in memory"""
+    file = pq.ParquetFile(path)
+    names = file.schema_arrow.names
+    pools = [name[len(TICK_PREFIX):] for name in names if name.startswith(TICK_PREFIX)]
+    symbols = [name[len(MID_PREFIX):] for name in names if name.startswith(MID_PREFIX)]
+
+    for batch in file.iter_batches(batch_size=batch_blocks):
+        numbers = batch.column('block_number').to_pylist()
+        timestamps = batch.column('timestamp').to_pylist()
+        ticks = [batch.column(TICK_PREFIX + pool).to_pylist() for pool in pools]
+        mids = [batch.column(MID_PREFIX + symbol).to_pylist() for symbol in symbols]
+        for i in range(len(numbers)):
+            yield BlockRecord(
+                number=numbers[i],
+                timestamp=timestamps[i],
+                ticks={pool: col[i] for pool, col in zip(pools, ticks)},
+                mids={symbol: col[i] for symbol, col in zip(symbols, mids)})
+
+def _forward_fill_ticks(
+        start_tick: int, num_blocks: int, swap_idx: np.ndarray, swap_ticks: np.ndarray) -> np.ndarray:
+    """
+    Tick of every block given the ordered swaps (block index, tick).
+    Last swap in the block sets its tick, blocks without swaps keep the previous one.
+    """
+    last_swap = np.full(num_blocks, -1)
+    last_swap[swap_idx] = np.arange(len(swap_idx)) # later swaps of the block overwrite
+    last_swap = np.maximum.accumulate(last_swap)
+    return np.where(
+        last_swap >= 0, np.append(swap_ticks, 0)[last_swap], start_tick).astype(np.int32)
+
+def record_history(
+        w3: Web3,
+        pools: Iterable[CLPoolInfo],
+        mids_at: MidsAt,
+        symbols: Iterable[str],
+        from_block: int,
+        to_block: int,
+        path: Path):
+    """
+    Records tick of every pool at the end of every block in [from_block, to_block]
+    together with the mids at the block time. Ticks come from the pool Swap logs,
+    slot0 is only read once. Block timestamps are interpolated between the
+    first and the last block of every chunk, Base has a constant block time.
+    """
+    pools = {pool.address: pool for pool in pools}
+    symbols = list(symbols)
+    slot0s = get_slot0_batched(w3, pools.values(), block=from_block - 1)
+    ticks = {addr: slot0.tick for addr, slot0 in slot0s.items()}
+
+    writer = open_writer(path, pools.keys(), symbols)
+    try:
+        for start in range(from_block, to_block + 1, CHUNK_BLOCKS):
+            end = min(start + CHUNK_BLOCKS - 1, to_block)
+            numbers = np.arange(start, end + 1)
+
+            start_ts = w3.eth.get_block(start)['timestamp']
+            end_ts = w3.eth.get_block(end)['timestamp']
+            block_time = (end_ts - start_ts) / (end - start) if end > start else 0
+            timestamps = (start_ts + (numbers - start) * block_time).astype(np.int64)
+
+            chunk_ticks = {}
+            for addr, pool in pools.items():
+                swaps = []
+                scan_logs(pool.contract.events.Swap, {}, start, end,
+                          lambda logs, _: swaps.extend(logs))
+                swaps.sort(key=lambda l: (l['blockNumber'], l['logIndex']))
+                chunk_ticks[addr] = _forward_fill_ticks(
+                    ticks[addr], len(numbers),
+                    np.array([s['blockNumber'] - start for s in swaps], dtype=np.int64),
+                    np.array([s['args']['tick'] for s in swaps], dtype=np.int64))
+                ticks[addr] = int(chunk_ticks[addr][-1])
+
+            chunk_mids = list(map(mids_at, timestamps.tolist()))
+            writer.write(numbers, timestamps, chunk_ticks, {
+                symbol: np.array([m[symbol] for m in chunk_mids]) for symbol in symbols})
+            logger.info(f'Recorded blocks {start}-{end}')
+    finally:
+        writer.close()
+
+def binance_mids(client, symbols: Iterable[str]) -> MidsAt:
+    """Mids are opens of the 1m USDT candles, candles are stored on disk"""
+    symbols = list(symbols)
+
+    @functools.lru_cache(maxsize=1024)
+    def at_minute(minute: int) -> dict[str, float]:
+        ret = {}
+        for symbol in symbols:
+            candle = client.candles.get_candle(f'{symbol}/USDT', minute * 60 * 1000)
+            assert candle is not None, f'no {symbol} candle at {minute * 60}'
+            ret[symbol] = candle.open
+        return ret
+
+    return lambda timestamp_sec: at_minute(timestamp_sec // 60)
+
+@attrs.frozen
+class ReplayResult:
+    first_block: int
+    last_block: int
+    starting_pos_value: Decimal
+    final_pos_value: Decimal
+    hedge_pnl: Decimal
+    trade_count: int
+    elapsed_sec: float
+
+    @property
+    def blocks(self) -> int:
+        return self.last_block - self.first_block + 1
+
+    @property
+    def blocks_per_sec(self) -> float:
+        return self.blocks / self.elapsed_sec if self.elapsed_sec > 0 else float('inf')
+
+    @property
+    def pnl_no_hedge(self) -> Decimal:
+        return self.final_pos_value - self.starting_pos_value
+
+    @property
+    def pnl(self) -> Decimal:
+        return self.pnl_no_hedge + self.hedge_pnl
+
+def _positions_value(
+        positions: list[PositionInfo], ticks: dict[str, int], mids: dict[str, Decimal]) -> Decimal:
+    def price(token) -> Decimal:
+        if erc20.guess_is_stable_coin(token):
+            return Decimal(1)
+        return mids[erc20.canonical_symbol(token.symbol)]
+
+    value = Decimal(0)
+    for pos in positions:
+        (amount0, amount1) = v3_math.get_amounts_at_tick(
+            pos.tick_lower, pos.tick_upper, pos.liquidity, ticks[pos.pool.address])
+        value += pos.token0.convert_to_decimals(amount0) * price(pos.token0) \
+            + pos.token1.convert_to_decimals(amount1) * price(pos.token1)
+    return value
+
+def replay(
+        positions: Iterable[PositionInfo],
+        history: Iterable[BlockRecord],
+        hedge_computer: HedgeComputer,
+        rehedge_every_n: int = 1,
+        initial_usd: int = 2000) -> ReplayResult:
+    """
+    Runs the hedger over the recorded blocks: every `rehedge_every_n` block
+    hedges are computed with `hedge_computer` and adjusted with
+    `hedger.compute_hedge_adjustments` on the MockCEX at the recorded mids.
+
+    Blocks where ticks and mids are the same as in the previous rehedge
+    block, and nothing was adjusted there, are skipped since they would
+    give the same result. Hedges are only recomputed when ticks change.
+    """
+    positions = list(positions)
+    cex = mock_cex.start(initial_usd)
+    started_at = time.perf_counter()
+
+    first = last = None
+    first_value = None
+    last_ticks = last_mids = None
+    hedges: dict[str, Decimal] = {}
+    is_idle = False
+    trade_count = 0
+    for block in history:
+        if first is None:
+            first = block
+        last = block
+        if (block.number - first.number) % rehedge_every_n != 0:
+            continue
+
+        mids_changed = block.mids != last_mids
+        if mids_changed:
+            last_mids = block.mids
+            cex.set_mid_prices({symbol: Decimal(repr(mid)) for symbol, mid in block.mids.items()})
+            if first_value is None:
+                first_value = _positions_value(positions, block.ticks, cex.mids)
+
+        ticks = tuple(block.ticks[pos.pool.address] for pos in positions)
+        ticks_changed = ticks != last_ticks
+        if ticks_changed:
+            last_ticks = ticks
+            hedges = hedge_computer(zip(positions, ticks))
+
+        if is_idle and not ticks_changed and not mids_changed:
+            continue
+
+        adjustments = hedger.compute_hedge_adjustments(cex, hedges)
+        if len(adjustments) > 0:
+            trade_count += hedger.execute_hedge_adjustements(cex, adjustments)
+        is_idle = len(adjustments) == 0
+
+    assert first is not None, 'empty history'
+    cex.set_mid_prices({symbol: Decimal(repr(mid)) for symbol, mid in last.mids.items()})
+    return ReplayResult(
+        first_block=first.number,
+        last_block=last.number,
+        starting_pos_value=first_value,
+        final_pos_value=_positions_value(positions, last.ticks, cex.mids),
+        hedge_pnl=cex.get_total_balance() - initial_usd,
+        trade_count=trade_count,
+        elapsed_sec=time.perf_counter() - started_at)
+
+def main():
+    import logging.config
+    from lps import aerodrome, sweep
+    from lps.connectors import binance
+    from lps.connectors.base import create_base_web3
+    from lps.utils.config import load_configuration, logging_config
+
+    parser = argparse.ArgumentParser(description='Replay recorded blocks through the hedger')
+    parser.add_argument('--config', default='dev')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    record = subparsers.add_parser('record', help='record ticks and Binance mids, needs the node')
+    record.add_argument('--from-block', type=int, required=True)
+    record.add_argument('--to-block', type=int, required=True)
+    record.add_argument('--nft-id', type=int, nargs='+', required=True)
+    record.add_argument('--out', type=Path, required=True)
+
+    run = subparsers.add_parser('run', help='replay the recorded history')
+    run.add_argument('history', type=Path)
+    run.add_argument('--nft-id', type=int, nargs='+', required=True)
+    run.add_argument('--strategy', choices=sweep.STRATEGIES.keys(), default='compute_hedges_fixed_step')
+    run.add_argument('--threshold', type=int, default=None)
+    run.add_argument('--rehedge-every-n', type=int, default=1)
+    args = parser.parse_args()
+
+    load_configuration(args.config)
+    logging.config.dictConfig(logging_config())
+
+    w3 = create_base_web3()
+    if args.command == 'record':
+        positions = [aerodrome.get_position_info_cached(w3, nft_id, block=args.from_block)
+                     for nft_id in args.nft_id]
+        symbols = sorted({symbol for pos in positions for _, symbol in hedger.hedged_tokens(pos)})
+        record_history(
+            w3, [pos.pool for pos in positions],
+            binance_mids(binance.start(), symbols), symbols,
+            args.from_block, args.to_block, args.out)
+        print(f'Written to {args.out}')
+        return
+
+    first_block = pq.ParquetFile(args.history).read_row_group(0, columns=['block_number'])[0][0].as_py()
+    positions = [aerodrome.get_position_info_cached(w3, nft_id, block=first_block)
+                 for nft_id in args.nft_id]
+    hedge_computer = sweep.STRATEGIES[args.strategy]
+    if args.threshold is not None:
+        hedge_computer = functools.partial(hedge_computer, threshold=args.threshold)
+
+    result = replay(positions, read_history(args.history), hedge_computer, args.rehedge_every_n)
+    print(f'Blocks {result.first_block}-{result.last_block} '
+          f'({result.blocks_per_sec:.0f} blocks/s)')
+    print(f'Position {result.starting_pos_value:.2f}$ -> {result.final_pos_value:.2f}$ '
+          f'pnl {result.pnl_no_hedge:.2f}$')
+    print(f'Hedge pnl {result.hedge_pnl:.2f}$ trades {result.trade_count} total pnl {result.pnl:.2f}$')
+
+if __name__ == "__main__":
+    main()
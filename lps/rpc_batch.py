@@ -0,0 +1,122 @@
+import json
+import logging
+from collections import OrderedDict
+from typing import Iterable, Any, Sequence
+
+import attrs
+from hexbytes import HexBytes
+from more_itertools import chunked
+from web3 import Web3
+from web3._utils.request import get_response_from_post_request
+from web3.datastructures import AttributeDict
+from web3.types import BlockIdentifier
+
+from lps import metrics
+from lps.utils.config import get_config
+
+logger = logging.getLogger('rpc_batch')
+
+class RpcBatchException(Exception):
+    pass
+
+@attrs.define
+class BatchReader:
+    """
+    Reads blocks and transactions with JSON-RPC batch requests.
+    Block timestamps are kept in LRU cache for the whole run.
+    """
+    w3: Web3
+    batch_size: int
+    max_cached_timestamps: int = 100_000
+
+    _timestamps: OrderedDict[int, int] = attrs.field(factory=OrderedDict)
+
+    def call_batch(self, requests: Sequence[tuple[str, list]]) -> list[Any]:
+        """
+        Executes (method, params) requests in batches of `batch_size`.
+        Returns raw results in the same order.
+        """
+        provider = self.w3.provider
+        ret = []
+        for chunk in chunked(requests, self.batch_size):
+            payload = [
+                {'jsonrpc': '2.0', 'id': i, 'method': method, 'params': params}
+                for i, (method, params) in enumerate(chunk)
+            ]
+            metrics.inc('rpc_calls', len(chunk))
+            response = get_response_from_post_request(
+                provider.endpoint_uri,
+                data=json.dumps(payload),
+                **provider.get_request_kwargs())
+            response.raise_for_status()
+
+            results = response.json()
+            if not isinstance(results, list):
+                raise RpcBatchException(f'Batch request failed: {results}')
+
+            by_id = {r['id']: r for r in results}
+            for i in range(len(chunk)):
+                if i not in by_id or 'error' in by_id[i]:
+                    raise RpcBatchException(
+                        f'Failed {chunk[i]}: {by_id.get(i, "no response")}')
+                ret.append(by_id[i]['result'])
+
+            logger.debug(f'Executed batch of {len(chunk)} requests')
+        return ret
+
+    def get_block_timestamps(self, blocks: Iterable[BlockIdentifier]) -> dict[BlockIdentifier, int]:
+        """
+        Returns block -> timestamp. Block tags (like 'finalized') are
+        always re-read, block numbers are cached.
+        """
+        blocks = set(blocks)
+        ret = {}
+        missing = []
+        for block in blocks:
+            if isinstance(block, int) and block in self._timestamps:
+                self._timestamps.move_to_end(block)
+                ret[block] = self._timestamps[block]
+            else:
+                missing.append(block)
+
+        results = self.call_batch([
+            ('eth_getBlockByNumber', [hex(b) if isinstance(b, int) else b, False])
+            for b in missing
+        ])
+        for block, result in zip(missing, results, strict=True):
+            if result is None:
+                raise RpcBatchException(f'Block not found {block}')
+            ret[block] = int(result['timestamp'], 16)
+            if isinstance(block, int):
+                self._timestamps[block] = ret[block]
+
+        while len(self._timestamps) > self.max_cached_timestamps:
+            self._timestamps.popitem(last=False)
+        return ret
+
+    def get_transactions(self, tx_hashes: Iterable[HexBytes]) -> dict[HexBytes, AttributeDict]:
+        """
+        Returns tx hash -> transaction. Only the fields needed by stats are decoded.
+        """
+        tx_hashes = list(set(map(HexBytes, tx_hashes)))
+        results = self.call_batch([
+            ('eth_getTransactionByHash', [tx_hash.hex()]) for tx_hash in tx_hashes
+        ])
+
+        ret = {}
+        for tx_hash, tx in zip(tx_hashes, results, strict=True):
+            if tx is None:
+                raise RpcBatchException(f'Transaction not found {tx_hash.hex()}')
+            ret[tx_hash] = AttributeDict({
+                'hash': HexBytes(tx['hash']),
+                'blockNumber': int(tx['blockNumber'], 16),
+                'from': Web3.to_checksum_address(tx['from']),
+                'to': Web3.to_checksum_address(tx['to']) if tx['to'] else None,
+                'input': HexBytes(tx['input']),
+            })
+        return ret
+
+def start(w3: Web3, batch_size: int | None = None) -> BatchReader:
+    if batch_size is None:
+        batch_size = get_config().get('base_node_batch_size', 100)
+    return BatchReader(w3=w3, batch_size=batch_size)
@@ -0,0 +1,92 @@
+import json
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from typing import Any
+
+import requests
+
+logger = logging.getLogger('rpc_cassette')
+
+def _request_key(request: dict) -> str:
+    return json.dumps([request['method'], request.get('params', [])], sort_keys=True)
+
+class _Handler(BaseHTTPRequestHandler):
+    server: 'CassetteServer'
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if isinstance(body, list):
+            response = [self.server.handle_request(r) for r in body]
+        else:
+            response = self.server.handle_request(body)
+
+        data = json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class CassetteServer(ThreadingHTTPServer):
+    """
+    Local JSON-RPC node which replays recorded responses.
+    When `upstream_url` is given, requests are forwarded there and recorded.
+    Batch requests are recorded as separate requests, so recording made
+    with batches can be replayed without them and vice versa.
+    """
+    daemon_threads = True
+
+    def __init__(self, path: Path, upstream_url: str | None = None):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.path = path
+        self.upstream_url = upstream_url
+        self.responses: dict[str, dict[str, Any]] = {}
+        if path.is_file():
+            self.responses = json.loads(path.read_text())
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def handle_request(self, request: dict) -> dict:
+        key = _request_key(request)
+        with self._lock:
+            response = self.responses.get(key)
+
+        if response is None and self.upstream_url is not None:
+            upstream = self._session.post(self.upstream_url, json={
+                'jsonrpc': '2.0', 'id': 1,
+                'method': request['method'], 'params': request.get('params', [])})
+            upstream.raise_for_status()
+            response = {k: v for k, v in upstream.json().items() if k in ('result', 'error')}
+            with self._lock:
+                self.responses[key] = response
+
+        if response is None:
+            logger.warning(f'Not recorded {key}')
+            response = {'error': {'code': -32000, 'message': f'not recorded {key}'}}
+        return {'jsonrpc': '2.0', 'id': request.get('id')} | response
+
+    def save(self):
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.path.write_text(json.dumps(self.responses))
+        logger.info(f'Saved {len(self.responses)} responses to {self.path}')
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self.upstream_url is not None:
+            self.save()
+
+def start(path: Path, upstream_url: str | None = None) -> CassetteServer:
+    server = CassetteServer(path, upstream_url)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
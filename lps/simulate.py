@@ -14,7 +14,7 @@ from eth_typing import AnyAddress
 from web3.types import LogReceipt, TxData
 import humanize
 
-from lps import hedger
+from lps import hedger, backtest
 from lps.connectors.abs import CanDoOrders, HasAssetPositions
 from lps.connectors.base import create_base_web3
 from lps.contracts import create_contract_cached
@@ -23,9 +23,6 @@ from lps.utils.config import load_configuration, logging_config, get_config, \
 import sys
 import logging.config
 
-load_configuration('dev')
-logging.config.dictConfig(logging_config())
-
 import signal
 import time
 
@@ -48,7 +45,6 @@ from lps.connectors import mock_cex
 
 logger = logging.getLogger('main')
 
-w3 = create_base_web3()
 mock_cex = mock_cex.start(2000)
 
 NUM_DAYS = 30
@@ -58,40 +54,28 @@ SECS_PER_DAY = 24 * SECS_PER_HOUR
 SAMPLES_PER_DAY = SECS_PER_DAY // STEP_LEN_SEC
 SAMPLES_PER_HOUR = SECS_PER_HOUR // STEP_LEN_SEC
 def get_price_path(starting_price, sigma_per_day, num_sims):
-    np.random.seed(123) # make it repeatable
-    mu = 0.0   # assume delta neutral behavior
-    T = NUM_DAYS
-    n = T * SAMPLES_PER_DAY
-    # calc each time step
-    dt = T/n
-    # simulation using numpy arrays
-    St = np.exp(
-        (mu - sigma_per_day ** 2 / 2) * dt
-        + sigma_per_day * np.random.normal(0, np.sqrt(dt), size=(num_sims, n-1)).T
+    return backtest.gbm_price_paths(
+        starting_price, sigma_per_day, num_sims, NUM_DAYS, STEP_LEN_SEC, seed=123)
+
+def make_position(w3: Web3) -> PositionInfo:
+    """Simulated WETH/USDC position, token details are read from the node"""
+    return PositionInfo(
+        tick_lower=-194200,
+        tick_upper=-192600,
+        liquidity=180540158377974,
+        nft_id=3899989,
+        pool=CLPoolInfo(
+            token0=erc20.fetch_erc20_details_cached(w3, '0x4200000000000000000000000000000000000006'),
+            token1=erc20.fetch_erc20_details_cached(w3, '0x833589fCD6eDb6E08f4c7C32D4f71b54bdA02913'),
+            tick_spacing=100,
+            fee_pips=400,
+            contract=create_contract_cached(
+                w3,
+                address=str('0xb2cc224c1c9fee385f8ad6a55b4d94e92359dc59'),
+                abi_fname="aerodrome_cl_pool.json",
+            )
+        ),
     )
-    # include array of 1's
-    St = np.vstack([np.ones(num_sims), St])
-    # multiply through by S0 and return the cumulative product of elements along a given simulation path (axis=0).
-    St = float(starting_price) * St.cumprod(axis=0)
-    return St
-
-pos = PositionInfo(
-    tick_lower=-194200,
-    tick_upper=-192600,
-    liquidity=180540158377974,
-    nft_id=3899989,
-    pool=CLPoolInfo(
-        token0=erc20.fetch_erc20_details_cached(w3, '0x4200000000000000000000000000000000000006'),
-        token1=erc20.fetch_erc20_details_cached(w3, '0x833589fCD6eDb6E08f4c7C32D4f71b54bdA02913'),
-        tick_spacing=100,
-        fee_pips=400,
-        contract=create_contract_cached(
-            w3,
-            address=str('0xb2cc224c1c9fee385f8ad6a55b4d94e92359dc59'),
-            abi_fname="aerodrome_cl_pool.json",
-        )
-    ),
-)
 
 def position_value_usd(conn: HasAssetPositions, pos: PositionInfo, current_tick: int) -> Decimal:
     (amount0, amount1) = v3_math.get_amounts_at_tick(
@@ -114,19 +98,19 @@ def position_value_usd(conn: HasAssetPositions, pos: PositionInfo, current_tick:
     amount1_usd = pos.pool.token1.convert_to_decimals(amount1) * price1
     return amount0_usd + amount1_usd
 
-def step(tick: int, hedge_computer: any):
+def step(pos: PositionInfo, tick: int, hedge_computer: any, conn: CanDoOrders = mock_cex):
     #hedges = hedger.compute_hedges([(pos, tick)])
     #hedges = hedger.compute_hedges_50_50([(pos, tick)])
     #hedges = hedger.compute_hedges_fixed_step([(pos, tick)])
     hedges = hedge_computer([(pos, tick)])
 
-    updates = hedger.compute_hedge_adjustments(mock_cex, hedges)
-    updated_cnt = hedger.execute_hedge_adjustements(mock_cex, updates)
+    updates = hedger.compute_hedge_adjustments(conn, hedges)
+    updated_cnt = hedger.execute_hedge_adjustements(conn, updates)
     # if updated_cnt > 0:
     #     print(f'Updated hedge {tick} {v3_math.tick_to_price(tick) * 10**12:.4f} {updates}')
     return updated_cnt
 
-def scenario1(hedge_computer):
+def scenario1(pos: PositionInfo, hedge_computer):
     # Enter position at 50/50
     # Price goes up, down then back to the middle
     # Total PnL should be zero
@@ -148,15 +132,15 @@ def scenario1(hedge_computer):
     for i in range(10):
         for current_tick in range(middle_tick, pos.tick_upper + out_of_range_by_ticks, 1):
             mock_cex.set_mid_prices({'ETH': v3_math.tick_to_price(current_tick) * 10**12})
-            step(current_tick, hedge_computer)
+            step(pos, current_tick, hedge_computer)
 
         for current_tick in range(pos.tick_upper + out_of_range_by_ticks, pos.tick_lower - out_of_range_by_ticks, -1):
             mock_cex.set_mid_prices({'ETH': v3_math.tick_to_price(current_tick) * 10**12})
-            step(current_tick, hedge_computer)
+            step(pos, current_tick, hedge_computer)
 
         for current_tick in range(pos.tick_lower - out_of_range_by_ticks, middle_tick, 1):
             mock_cex.set_mid_prices({'ETH': v3_math.tick_to_price(current_tick) * 10**12})
-            step(current_tick, hedge_computer)
+            step(pos, current_tick, hedge_computer)
 
     # Exit
     mock_cex.close_all_positions()
@@ -168,7 +152,7 @@ def scenario1(hedge_computer):
     total_change = (final_pos_value + final_hedge_value) - (starting_pos_value + starting_hedge_value)
     print(f'Total PnL: {total_change:.4f}')
 
-def scenario2(hedge_computer, rehedge_time_sec:int=0):
+def scenario2(pos: PositionInfo, hedge_computer, rehedge_time_sec:int=0):
     """
     Generate random prices, enter positions at the start, exit at the end
     Compute the sum total PnL
@@ -213,7 +197,7 @@ def scenario2(hedge_computer, rehedge_time_sec:int=0):
             tick = price_to_tick(Decimal(price))
 
             if rehedge_every_n == 0 or i % rehedge_every_n == 0:
-                step(tick, hedge_computer)
+                step(pos, tick, hedge_computer)
 
             hedge_positions = mock_cex.get_user_positions()
             hedge_size = hedge_positions['ETH'].szi if 'ETH' in hedge_positions else 0
@@ -251,27 +235,54 @@ def scenario2(hedge_computer, rehedge_time_sec:int=0):
 
     return [pd.DataFrame(sim_rows) for sim_rows in sim_results]
 
+def scenario2_batch(pos: PositionInfo, hedge_computer, rehedge_time_sec: int = 0, num_sims: int = 1000):
+    """
+    Same as scenario2, but backtests all paths at once (see backtest.run)
+    """
+    middle_tick = (pos.tick_upper + pos.tick_lower) // 2
+    initial_price = v3_math.tick_to_price(middle_tick) * 10**12
+
+    all_prices = get_price_path(initial_price, 0.05, num_sims)
+
+    rehedge_every_n = rehedge_time_sec // STEP_LEN_SEC
+    print(f'Re-hedge every {rehedge_every_n} steps')
+
+    res = backtest.run(pos, all_prices, hedge_computer, rehedge_every_n)
+
+    print(f'Avg PnL: {res.pnl.mean()}')
+    print(f'Avg PnL no hedge: {res.pnl_no_hedge.mean()}')
+    print(f'Avg trades: {res.trade_count.mean()}')
+
+    return res
+
 
 def main():
+    pos = make_position(create_base_web3())
     t = time.time()
     # print("Dynamic hedger")
-    # scenario1(hedger.compute_hedges)
+    # scenario1(pos, hedger.compute_hedges)
     # print()
     #
     print("50/50 hedger")
-    scenario1(functools.partial(hedger.compute_hedges_fixed_step, threshold=100))
+    scenario1(pos, functools.partial(hedger.compute_hedges_fixed_step, threshold=100))
     print()
 
     # print("Dynamic hedger scenario 2")
-    # scenario2(hedger.compute_hedges)
+    # scenario2(pos, hedger.compute_hedges)
     # print()
 
     # print("50/50 hedger scenario 2")
-    # scenario2(hedger.compute_hedges_fixed_step)
+    # scenario2(pos, hedger.compute_hedges_fixed_step)
+    # print()
+
+    # print("50/50 hedger scenario 2 (batch)")
+    # scenario2_batch(pos, functools.partial(hedger.compute_hedges_fixed_step, threshold=100))
     # print()
 
     print(f'Time: {time.time() - t}s')
 
 if __name__ == "__main__":
+    load_configuration('dev')
+    logging.config.dictConfig(logging_config())
     main()
 
@@ -1,4 +1,5 @@
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, Executor
 from datetime import datetime
 from operator import attrgetter
 from typing import Iterator, Tuple, Iterable
@@ -19,16 +20,13 @@ from lps.utils.config import load_configuration, logging_config, get_config, \
 import sys
 import logging.config
 
-load_configuration('dev')
-logging.config.dictConfig(logging_config())
-
 import signal
 import time
 
 from lps.aerodrome import get_position_info_cached, clear_caches
 from lps.connectors import hl
 from lps.utils import v3_math
-from lps import hedger, erc20
+from lps import hedger, erc20, multicall
 
 import requests
 from decimal import Decimal
@@ -40,28 +38,29 @@ from web3 import Web3
 from eth_defi.event_reader.fast_json_rpc import patch_web3
 
 from lps.connectors import binance
+from lps import log_indexer, rpc_batch
+from lps.log_indexer import LogIndexer
+from lps.rpc_batch import BatchReader
 
 logger = logging.getLogger('main')
 
-w3 = create_base_web3()
-a_binance = binance.start()
-
 @attrs.frozen
 class MintInfo:
     token_id: int
     block_number: int
 
-def get_all_position_mints(w3: Web3, user_addr: str) -> Iterator[MintInfo]:
+def get_all_position_mints(w3: Web3, indexer: LogIndexer, user_addr: str) -> Iterator[MintInfo]:
     """
     Returns list of position mint for the given user
     """
     aero_nft_manager = create_contract_cached(
-        w3, "aerodrome_nft_manager.json")
+        w3, "aerodrome_nft_manager.json",
+        address=get_config().aerodrome.nft_position_manager)
 
     # Transfer from zero is a mint
-    filter = aero_nft_manager.events.Transfer.create_filter(
-        fromBlock="earliest",
-        address=get_config().aerodrome.nft_position_manager,
+    logs = indexer.get_logs(
+        w3,
+        aero_nft_manager.events.Transfer,
         argument_filters={
             'from': Web3.to_checksum_address('0x0000000000000000000000000000000000000000'),
             'to': Web3.to_checksum_address(user_addr)
@@ -71,24 +70,25 @@ def get_all_position_mints(w3: Web3, user_addr: str) -> Iterator[MintInfo]:
     yield from map(
         lambda log: MintInfo(token_id=log['args']['tokenId'],
                              block_number=log['blockNumber']),
-        filter.get_all_entries())
+        logs)
 
 @attrs.frozen
 class BurnInfo:
     token_id: int
     block_number: int
 
-def get_all_position_burns(w3: Web3, user_addr: str) -> Iterator[BurnInfo]:
+def get_all_position_burns(w3: Web3, indexer: LogIndexer, user_addr: str) -> Iterator[BurnInfo]:
     """
     Returns list of position burns for the given user
     """
     aero_nft_manager = create_contract_cached(
-        w3, "aerodrome_nft_manager.json")
+        w3, "aerodrome_nft_manager.json",
+        address=get_config().aerodrome.nft_position_manager)
 
-    # Transfer from zero is a mint
-    filter = aero_nft_manager.events.Transfer.create_filter(
-        fromBlock="earliest",
-        address=get_config().aerodrome.nft_position_manager,
+    # Transfer to zero is a burn
+    logs = indexer.get_logs(
+        w3,
+        aero_nft_manager.events.Transfer,
         argument_filters={
             'from': Web3.to_checksum_address(user_addr),
             'to': Web3.to_checksum_address('0x0000000000000000000000000000000000000000')
@@ -98,7 +98,7 @@ def get_all_position_burns(w3: Web3, user_addr: str) -> Iterator[BurnInfo]:
     yield from map(
         lambda log: BurnInfo(token_id=log['args']['tokenId'],
                              block_number=log['blockNumber']),
-        filter.get_all_entries())
+        logs)
 
 @attrs.frozen
 class ClaimInfo:
@@ -125,50 +125,107 @@ def _get_token_id_from_harvest_transaction(w3: Web3, tr: TxData) -> int:
             assert False, f"unrecognized func name shouldn't happen {tr['hash'].hex()} {func.fn_name}"
     raise Exception(f"Unrecognized claim rewards transaction {tr['hash'].hex()}")
 
-def get_all_claim_rewards(w3: Web3, user_addr: str) -> Iterator[ClaimInfo]:
+def get_all_claim_rewards(
+        w3: Web3,
+        indexer: LogIndexer,
+        rpc: BatchReader,
+        a_binance: binance.Binance,
+        user_addr: str,
+        gauge_addrs: Iterable[str]) -> Iterator[ClaimInfo]:
     """
-    Returns all reward claims for the given user
+    Returns all reward claims for the given user from the given gauges
     Note: this only supports vfat for now
     """
-    cl_gauge = create_contract_cached(w3, "aerodrome_cl_gauge.json")
-
-    filter = cl_gauge.events.ClaimRewards.create_filter(
-        fromBlock="earliest",
-        argument_filters={
-            'from': Web3.to_checksum_address(user_addr),
-        }
-    )
+    logs = []
+    for gauge_addr in gauge_addrs:
+        cl_gauge = create_contract_cached(
+            w3, "aerodrome_cl_gauge.json", address=gauge_addr)
+        logs += indexer.get_logs(
+            w3,
+            cl_gauge.events.ClaimRewards,
+            argument_filters={
+                'from': Web3.to_checksum_address(user_addr),
+            }
+        )
 
     reward_token = erc20.fetch_erc20_details_cached(
         w3, get_config().aerodrome.aero_token)
 
+    transactions = rpc.get_transactions(
+        map(lambda log: log['transactionHash'], logs))
+    timestamps = rpc.get_block_timestamps(
+        map(lambda log: log['blockNumber'], logs))
+
     def from_log_recp(log: LogReceipt) -> ClaimInfo:
-        tr = w3.eth.get_transaction(log['transactionHash'])
-        block = w3.eth.get_block(log['blockNumber'])
+        tr = transactions[log['transactionHash']]
+        timestamp_sec = timestamps[log['blockNumber']]
 
         amount_usd = binance.token_value_in_usd_at_time(
-            a_binance, reward_token, log['args']['amount'], block['timestamp'])
+            a_binance, reward_token, log['args']['amount'], timestamp_sec)
 
         return ClaimInfo(
             token_id = _get_token_id_from_harvest_transaction(w3, tr),
             amount_usd = amount_usd,
-            timestamp_sec = int(block['timestamp'])
+            timestamp_sec = timestamp_sec
         )
 
-    yield from map(from_log_recp, filter.get_all_entries())
+    yield from map(from_log_recp, logs)
 
-def print_position_info(
+@attrs.frozen
+class HistoricalState:
+    """Chain state of all positions at their mint and burn blocks"""
+    timestamps: dict[int, int]
+    # (block number, pool address) -> slot0
+    slot0s: dict[tuple[int, str], aerodrome.CLPoolInfo.Slot0]
+
+    def slot0_at(self, block_number: int, pool: aerodrome.CLPoolInfo) -> aerodrome.CLPoolInfo.Slot0:
+        return self.slot0s[(block_number, pool.address)]
+
+    def tick_at(self, block_number: int, pool: aerodrome.CLPoolInfo) -> int:
+        return self.slot0_at(block_number, pool).tick
+
+def read_historical_state(
         w3: Web3,
+        rpc: BatchReader,
+        executor: Executor,
+        reads: Iterable[tuple[int, aerodrome.CLPoolInfo]]) -> HistoricalState:
+    """
+    Reads slot0 of the pools at the given blocks, one multicall per block
+    and all blocks concurrently, plus timestamps of the blocks.
+    """
+    pools_by_block: dict[int, dict[str, aerodrome.CLPoolInfo]] = defaultdict(dict)
+    for (block_number, pool) in reads:
+        pools_by_block[block_number][pool.address] = pool
+
+    futures = {
+        block_number: executor.submit(
+            aerodrome.get_slot0_batched, w3, pools.values(), block=block_number)
+        for block_number, pools in pools_by_block.items()
+    }
+    timestamps = rpc.get_block_timestamps(pools_by_block.keys())
+    return HistoricalState(
+        timestamps=timestamps,
+        slot0s={
+            (block_number, addr): slot0
+            for block_number, future in futures.items()
+            for addr, slot0 in future.result().items()
+        })
+
+def print_position_info(
+        a_binance: binance.Binance,
         pos: aerodrome.PositionInfo,
+        state: HistoricalState,
         claims: Iterable[ClaimInfo],
+        fees: aerodrome.UncollectedFees | None,
         mint: MintInfo,
-        burn: BurnInfo | None):
+        burn: BurnInfo | None,
+        finalized_block_number: int):
 
     minted_block_number = mint.block_number
-    burned_block_number = burn.block_number if burn else 'finalized'
+    burned_block_number = burn.block_number if burn else finalized_block_number
 
-    minted_timestamp_sec = w3.eth.get_block(minted_block_number)['timestamp']
-    burned_timestamp_sec = w3.eth.get_block(burned_block_number)['timestamp']
+    minted_timestamp_sec = state.timestamps[minted_block_number]
+    burned_timestamp_sec = state.timestamps[burned_block_number]
 
     age = \
         datetime.now() - datetime.fromtimestamp(minted_timestamp_sec)
@@ -178,30 +235,42 @@ def print_position_info(
 
     total_rewards_usd = sum(map(attrgetter('amount_usd'), claims))
 
-    def get_usd_value_at_tick(tick: int, timestamp_sec: int):
-        (amount0, amount1) = v3_math.get_amounts_at_tick(
-            pos.tick_lower, pos.tick_upper, pos.liquidity, tick)
+    (fees0_raw, fees1_raw) = (fees.amount0, fees.amount1) if fees else (0, 0)
+    fees_usd = \
+        binance.token_value_in_usd_at_time(a_binance, pos.pool.token0, fees0_raw, burned_timestamp_sec) + \
+        binance.token_value_in_usd_at_time(a_binance, pos.pool.token1, fees1_raw, burned_timestamp_sec)
+
+    def get_amounts_at_block(block_number: int) -> (int, int):
+        """Exactly as the position manager would return on burn"""
+        return v3_math.get_amounts_for_liquidity(
+            state.slot0_at(block_number, pos.pool).sqrtPriceX96,
+            v3_math.get_sqrt_ratio_at_tick(pos.tick_lower),
+            v3_math.get_sqrt_ratio_at_tick(pos.tick_upper),
+            pos.liquidity)
+
+    def get_usd_value(amounts: (int, int), timestamp_sec: int):
+        (amount0, amount1) = amounts
         amount0_usd = binance.token_value_in_usd_at_time(
             a_binance, pos.pool.token0, amount0, timestamp_sec)
         amount1_usd = binance.token_value_in_usd_at_time(
             a_binance, pos.pool.token1, amount1, timestamp_sec)
         return amount0_usd + amount1_usd
 
-    tick_at_mint = pos.pool.get_slot0(w3, block=minted_block_number).tick
-    deposit_usd = get_usd_value_at_tick(tick_at_mint, minted_timestamp_sec)
+    tick_at_mint = state.tick_at(minted_block_number, pos.pool)
+    (deposit0_raw, deposit1_raw) = get_amounts_at_block(minted_block_number)
+    deposit_usd = get_usd_value((deposit0_raw, deposit1_raw), minted_timestamp_sec)
     price_at_mint = v3_math.tick_to_price(tick_at_mint)
 
-    tick_at_burn = pos.pool.get_slot0(w3, block=burned_block_number).tick
-    burn_usd = get_usd_value_at_tick(tick_at_burn, burned_timestamp_sec)
+    tick_at_burn = state.tick_at(burned_block_number, pos.pool)
+    (burn0_raw, burn1_raw) = get_amounts_at_block(burned_block_number)
+    burn_usd = get_usd_value((burn0_raw, burn1_raw), burned_timestamp_sec)
     price_at_burn = v3_math.tick_to_price(tick_at_burn)
 
-    (deposit0_raw, deposit1_raw) = v3_math.get_amounts_at_tick(
-            pos.tick_lower, pos.tick_upper, pos.liquidity, tick_at_mint)
     deposit0 = pos.pool.token0.convert_to_decimals(deposit0_raw)
     deposit0_usd = binance.token_value_in_usd_at_time(
         a_binance, pos.pool.token0, deposit0_raw, minted_timestamp_sec)
 
-    deposit1 = pos.pool.token0.convert_to_decimals(deposit1_raw)
+    deposit1 = pos.pool.token1.convert_to_decimals(deposit1_raw)
     deposit1_usd = binance.token_value_in_usd_at_time(
         a_binance, pos.pool.token1, deposit1_raw, minted_timestamp_sec)
 
@@ -210,13 +279,11 @@ def print_position_info(
     deposit1_price_usd = binance.usd_price_at_time(
         a_binance, pos.pool.token1.symbol, minted_timestamp_sec)
 
-    (burn0_raw, burn1_raw) = v3_math.get_amounts_at_tick(
-            pos.tick_lower, pos.tick_upper, pos.liquidity, tick_at_burn)
     burn0 = pos.pool.token0.convert_to_decimals(burn0_raw)
     burn0_usd = binance.token_value_in_usd_at_time(
         a_binance, pos.pool.token0, burn0_raw, burned_timestamp_sec)
 
-    burn1 = pos.pool.token0.convert_to_decimals(burn1_raw)
+    burn1 = pos.pool.token1.convert_to_decimals(burn1_raw)
     burn1_usd = binance.token_value_in_usd_at_time(
         a_binance, pos.pool.token1, burn1_raw, burned_timestamp_sec)
 
@@ -225,7 +292,7 @@ def print_position_info(
     burn1_price_usd = binance.usd_price_at_time(
         a_binance, pos.pool.token1.symbol, burned_timestamp_sec)
 
-    avg_fees_per_day = (total_rewards_usd / Decimal(age_sec)) * (24 * 60 * 60)
+    avg_fees_per_day = ((total_rewards_usd + fees_usd) / Decimal(age_sec)) * (24 * 60 * 60)
 
     # Asset change in USD
 
@@ -241,6 +308,7 @@ def print_position_info(
     print(
         f"ID: {pos.nft_id}\tPool: {pos.pool.token0.symbol}/{pos.pool.token1.symbol}\tAge: {age_str}\tFees: {total_rewards_usd:.2f}$"
     )
+    print(f'Uncollected fees: {fees_usd:.2f}$ ({pos.pool.token0.convert_to_decimals(fees0_raw):.4f}, {pos.pool.token1.convert_to_decimals(fees1_raw):.4f})')
     print(f'Range: ({lower_price:.6f}) <-- ({burned_price:.6f}) --> ({upper_price:.6f}) {width:.2f}% ({range_status})')
     print(f'Avg fees per day: {avg_fees_per_day:.2f}$ {(avg_fees_per_day / deposit_usd) * 100:.2f}%')
     print(f'Price at mint: {price_at_mint:.5f}')
@@ -249,34 +317,81 @@ def print_position_info(
     print(f'Withdrawn: {burn_usd:.2f}$ ({burn0:.4f}, {burn1:.4f}) ({burn0_usd:.2f}$, {burn1_usd:.2f}$) ({burn0_price_usd:.2f}$ {burn1_price_usd:.2f}$)')
     print('Closed' if burn else 'Opened')
 
-def main():
-    user_addr = sys.argv[1]
-
-    mints = list(get_all_position_mints(w3, user_addr))
-    burns = list(get_all_position_burns(w3, user_addr))
-    all_claims = list(get_all_claim_rewards(w3, user_addr))
+def print_user_positions(
+        w3: Web3,
+        indexer: LogIndexer,
+        rpc: BatchReader,
+        a_binance: binance.Binance,
+        user_addr: str):
+    mints = list(get_all_position_mints(w3, indexer, user_addr))
+    burns = list(get_all_position_burns(w3, indexer, user_addr))
 
     print(burns)
     print(mints)
 
-    position_infos = list(map(
-        lambda m: aerodrome.get_position_info_cached(w3, m.token_id, block=m.block_number),
-        mints))
-
-    claims_by_token_id = defaultdict(list)
-    for claim in all_claims:
-        claims_by_token_id[claim.token_id].append(claim)
+    # Open positions are reported as of the finalized block
+    finalized_block_number = w3.eth.get_block('finalized')['number']
 
     burns_by_id = {}
     for burn in burns:
         assert burn.token_id not in burns_by_id
         burns_by_id[burn.token_id] = burn
 
+    def burned_block_number(token_id: int) -> int:
+        burn = burns_by_id.get(token_id)
+        return burn.block_number if burn else finalized_block_number
+
+    # All chain reads are done up front and concurrently, the rest is local
+    with ThreadPoolExecutor(max_workers=get_config().get('stats_rpc_concurrency', 16)) as executor:
+        position_infos = list(executor.map(
+            lambda m: aerodrome.get_position_info_cached(w3, m.token_id, block=m.block_number),
+            mints))
+
+        # Burned positions have nothing to collect, fees of the rest are read in one call
+        fees_future = executor.submit(
+            aerodrome.get_uncollected_fees_batched,
+            w3, [pos for pos in position_infos if pos.nft_id not in burns_by_id],
+            block=finalized_block_number)
+
+        state = read_historical_state(
+            w3, rpc, executor,
+            [(mint.block_number, pos.pool) for pos, mint in zip(position_infos, mints)] +
+            [(burned_block_number(pos.nft_id), pos.pool) for pos in position_infos])
+
+        # Log index and batch reader aren't thread safe, claims are read here
+        pools = list({pos.pool.address: pos.pool for pos in position_infos}.values())
+        gauge_addrs = {
+            gauge_addr for (gauge_addr,) in
+            multicall.aggregate3(w3, [pool.contract.functions.gauge() for pool in pools])
+        }
+        gauge_addrs.discard('0x0000000000000000000000000000000000000000') # no gauge
+        all_claims = list(get_all_claim_rewards(w3, indexer, rpc, a_binance, user_addr, gauge_addrs))
+
+        fees_by_token_id = fees_future.result()
+
+    claims_by_token_id = defaultdict(list)
+    for claim in all_claims:
+        claims_by_token_id[claim.token_id].append(claim)
+
     for pos, mint in zip(position_infos, mints):
         # if burns_by_id.get(pos.nft_id, None) is not None:
         #     continue # skip closed for now
-        print_position_info(w3, pos, claims_by_token_id[pos.nft_id], mint, burns_by_id.get(pos.nft_id, None))
+        print_position_info(
+            a_binance, pos, state, claims_by_token_id[pos.nft_id],
+            fees_by_token_id.get(pos.nft_id), mint, burns_by_id.get(pos.nft_id, None),
+            finalized_block_number)
         print()
 
+def main():
+    user_addr = sys.argv[1]
+
+    w3 = create_base_web3()
+    a_binance = binance.start()
+    indexer = log_indexer.start(w3)
+    rpc = rpc_batch.start(w3)
+    print_user_positions(w3, indexer, rpc, a_binance, user_addr)
+
 if __name__ == "__main__":
+    load_configuration('dev')
+    logging.config.dictConfig(logging_config())
     main()
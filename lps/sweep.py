@@ -0,0 +1,215 @@
+import functools
+import itertools
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+from pathlib import Path
+
+import attrs
+import numpy as np
+import pandas as pd
+from eth_defi.token import TokenDetails
+from web3 import Web3
+
+from lps import hedger, backtest
+from lps.aerodrome import PositionInfo, CLPoolInfo
+from lps.utils import v3_math
+from lps.utils.config import data_path
+
+logger = logging.getLogger('sweep')
+
+STRATEGIES = {
+    'compute_hedges': hedger.compute_hedges,
+    'compute_hedges_50_50': hedger.compute_hedges_50_50,
+    'compute_hedges_fixed_step': hedger.compute_hedges_fixed_step,
+    'compute_hedges_4_step': hedger.compute_hedges_4_step,
+}
+
+# Max paths simulated by one task, bounds memory used by the price matrix
+PATHS_PER_TASK = 200
+
+@attrs.frozen
+class SweepPoint:
+    strategy: str
+    threshold: int | None # only for compute_hedges_fixed_step
+    sigma_per_day: float
+    rehedge_time_sec: int
+    width_ticks: int
+
+@attrs.frozen
+class SweepParams:
+    """Parameters shared by all points of the sweep"""
+    num_sims: int = 1000
+    num_days: int = 30
+    step_len_sec: int = 24
+    seed: int = 123
+    deposit_usd: float = 1000
+    initial_usd: int = 2000
+    max_unhedged_value: Decimal = Decimal(50)
+    # WETH/USDC position centered at ~4000 usd
+    center_tick: int = -193400
+    tick_spacing: int = 100
+
+def make_grid(
+        strategies: dict[str, list[int | None]],
+        sigmas_per_day: list[float],
+        rehedge_times_sec: list[int],
+        widths_ticks: list[int]) -> list[SweepPoint]:
+    """
+    `strategies` maps strategy name to the list of thresholds to try,
+    [None] for strategies without threshold.
+    """
+    return [
+        SweepPoint(strategy, threshold, sigma, rehedge_time_sec, width)
+        for strategy, thresholds in strategies.items()
+        for threshold, sigma, rehedge_time_sec, width in itertools.product(
+            thresholds, sigmas_per_day, rehedge_times_sec, widths_ticks)
+    ]
+
+def make_position(width_ticks: int, params: SweepParams) -> PositionInfo:
+    """
+    WETH/USDC position around `center_tick` worth `deposit_usd`.
+    Doesn't need the node, so every worker can create its own.
+    """
+    def token(address: str, symbol: str, decimals: int) -> TokenDetails:
+        return TokenDetails(
+            contract=Web3().eth.contract(address=Web3.to_checksum_address(address)),
+            symbol=symbol,
+            decimals=decimals)
+
+    half_width = width_ticks // 2 // params.tick_spacing * params.tick_spacing
+    tick_lower = params.center_tick - half_width
+    tick_upper = params.center_tick + half_width
+
+    # Position value is linear in liquidity
+    (amount0, amount1) = v3_math.get_amounts_at_ticks(
+        tick_lower, tick_upper, 1.0, params.center_tick)
+    raw_price = float(v3_math.tick_to_price(params.center_tick))
+    usd_per_liquidity = (amount0 * raw_price + amount1) / 10**6
+
+    return PositionInfo(
+        tick_lower=tick_lower,
+        tick_upper=tick_upper,
+        liquidity=int(params.deposit_usd / usd_per_liquidity),
+        nft_id=0,
+        pool=CLPoolInfo(
+            token0=token('0x4200000000000000000000000000000000000006', 'WETH', 18),
+            token1=token('0x833589fCD6eDb6E08f4c7C32D4f71b54bdA02913', 'USDC', 6),
+            tick_spacing=params.tick_spacing,
+            fee_pips=400,
+            contract=None,
+        ),
+    )
+
+def _run_task(point: SweepPoint, params: SweepParams, num_sims: int, seed: int) -> np.ndarray:
+    """
+    Runs in the worker process. Returns (4, num_sims) array of
+    pnl, pnl without hedge, hedge pnl and trade count.
+    """
+    pos = make_position(point.width_ticks, params)
+
+    hedge_computer = STRATEGIES[point.strategy]
+    if point.threshold is not None:
+        hedge_computer = functools.partial(hedge_computer, threshold=point.threshold)
+
+    starting_price = float(v3_math.tick_to_price(params.center_tick)) * 10**12
+    prices = backtest.gbm_price_paths(
+        starting_price, point.sigma_per_day, num_sims,
+        params.num_days, params.step_len_sec, seed)
+
+    res = backtest.run(
+        pos, prices, hedge_computer,
+        rehedge_every_n=point.rehedge_time_sec // params.step_len_sec,
+        initial_usd=params.initial_usd,
+        max_unhedged_value=params.max_unhedged_value)
+    return np.stack([res.pnl, res.pnl_no_hedge, res.hedge_pnl, res.trade_count])
+
+def _summarize(point: SweepPoint, results: np.ndarray) -> dict:
+    (pnl, pnl_no_hedge, hedge_pnl, trade_count) = results
+    return attrs.asdict(point) | {
+        'num_sims': len(pnl),
+        'pnl_mean': pnl.mean(),
+        'pnl_std': pnl.std(),
+        'pnl_min': pnl.min(),
+        'pnl_p05': np.percentile(pnl, 5),
+        'pnl_p25': np.percentile(pnl, 25),
+        'pnl_median': np.median(pnl),
+        'pnl_p75': np.percentile(pnl, 75),
+        'pnl_p95': np.percentile(pnl, 95),
+        'pnl_max': pnl.max(),
+        'pnl_no_hedge_mean': pnl_no_hedge.mean(),
+        'hedge_pnl_mean': hedge_pnl.mean(),
+        'trades_mean': trade_count.mean(),
+    }
+
+def run_sweep(
+        points: list[SweepPoint],
+        params: SweepParams = SweepParams(),
+        max_workers: int | None = None) -> pd.DataFrame:
+    """
+    Backtests every point of the grid over `params.num_sims` price paths.
+    Every point is split into tasks of at most PATHS_PER_TASK paths which
+    run on the process pool. Task seeds don't depend on the strategy, so
+    all strategies are compared on the same price paths.
+    Returns one row of PnL distribution stats per point.
+    """
+    chunks = [
+        (chunk_idx, min(PATHS_PER_TASK, params.num_sims - start))
+        for chunk_idx, start in enumerate(range(0, params.num_sims, PATHS_PER_TASK))
+    ]
+
+    start_time = time.time()
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            point: [
+                pool.submit(_run_task, point, params, num_sims, params.seed + chunk_idx)
+                for (chunk_idx, num_sims) in chunks
+            ] for point in points
+        }
+
+        rows = []
+        for i, (point, point_futures) in enumerate(futures.items()):
+            results = np.concatenate([f.result() for f in point_futures], axis=1)
+            rows.append(_summarize(point, results))
+            logger.info(f'Finished {i + 1}/{len(points)} {point}')
+
+    logger.info(f'Swept {len(points)} points in {time.time() - start_time:.1f}s')
+    return pd.DataFrame(rows)
+
+def write_results(df: pd.DataFrame, path: Path | None = None) -> Path:
+    if path is None:
+        path = data_path() / 'sweeps' / f'sweep_{int(time.time())}.parquet'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    df.to_parquet(path, index=False)
+    return path
+
+def main():
+    import logging.config
+    from lps.utils.config import load_configuration, logging_config, get_config
+
+    load_configuration('dev')
+    logging.config.dictConfig(logging_config())
+
+    points = make_grid(
+        strategies={
+            'compute_hedges': [None],
+            'compute_hedges_50_50': [None],
+            'compute_hedges_fixed_step': [0, 20, 50],
+            'compute_hedges_4_step': [None],
+        },
+        sigmas_per_day=[0.02, 0.04, 0.06],
+        rehedge_times_sec=[24, 5 * 60, 60 * 60],
+        widths_ticks=[800, 1600, 3200],
+    )
+    params = SweepParams(
+        max_unhedged_value=Decimal(get_config().hl_hedger.max_unhedged_value))
+
+    df = run_sweep(points, params, max_workers=os.cpu_count())
+    path = write_results(df)
+    print(df.sort_values('pnl_mean', ascending=False).to_string(index=False))
+    print(f'Written to {path}')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import logging
+from typing import Iterable
+
+import attrs
+from hexbytes import HexBytes
+from web3 import Web3
+from web3.types import LogReceipt
+
+from lps import metrics
+from lps.aerodrome import CLPoolInfo, get_slot0_batched
+from lps.connectors.base import BlockHeader
+from lps.contracts import create_contract_cached
+
+logger = logging.getLogger('tick_tracker')
+
+SWAP_TOPIC = Web3.keccak(text='Swap(address,address,int256,int256,uint160,uint128,int24)')
+
+def bloom_contains(bloom: bytes, item: bytes) -> bool:
+    """
+    True if the item (address or topic) may be in the block logs bloom.
+    Blooms have no false negatives, so False means there are no such logs.
+    """
+    bloom = int.from_bytes(bloom, 'big')
+    h = Web3.keccak(item)
+    for i in (0, 2, 4):
+        bit = int.from_bytes(h[i:i + 2], 'big') & 2047
+        if not bloom & (1 << bit):
+            return False
+    return True
+
+@attrs.define
+class SwapTickTracker:
+    """
+    Tracks current ticks of the pools from their Swap logs, tick after the
+    last swap in the block is the pool tick at the end of the block.
+    Logs are only requested when the block header bloom says that there
+    may be a swap on one of the pools, so quiet blocks need no requests.
+    Slot0 is read only at the start and after a re-org.
+    """
+    w3: Web3
+    pools: dict[str, CLPoolInfo] # address -> pool
+
+    ticks: dict[str, int] = attrs.field(factory=dict)
+    last_block: BlockHeader | None = None
+
+    def _resync(self, header: BlockHeader):
+        logger.info(f'Reading ticks from slot0 at {header.number}')
+        slot0s = get_slot0_batched(self.w3, self.pools.values(), block=header.number)
+        self.ticks = {addr: slot0.tick for addr, slot0 in slot0s.items()}
+
+    def _may_have_swaps(self, header: BlockHeader) -> bool:
+        if not bloom_contains(header.logs_bloom, SWAP_TOPIC):
+            return False
+        return any(
+            bloom_contains(header.logs_bloom, HexBytes(addr))
+            for addr in self.pools.keys())
+
+    def _apply_swaps(self, logs: Iterable[LogReceipt]):
+        pool_contract = create_contract_cached(self.w3, "aerodrome_cl_pool.json")
+        for log in sorted(logs, key=lambda l: (l['blockNumber'], l['logIndex'])):
+            swap = pool_contract.events.Swap().process_log(log)
+            self.ticks[Web3.to_checksum_address(log['address'])] = swap['args']['tick']
+
+    def _fetch_swaps(self, filter_params: dict):
+        metrics.inc('swap_log_requests')
+        logs = self.w3.eth.get_logs({
+            'address': list(self.pools.keys()),
+            'topics': [SWAP_TOPIC],
+        } | filter_params)
+        self._apply_swaps(logs)
+
+    def update(self, header: BlockHeader) -> dict[str, int]:
+        """
+        Returns (pool address -> tick) at the end of the given block.
+        Blocks should be passed in order, skipped blocks are read at once.
+        """
+        last = self.last_block
+        is_next = last is not None and header.number == last.number + 1
+        if last is None or header.number <= last.number:
+            # Start or re-org to the same or lower height
+            self._resync(header)
+        elif is_next and None not in (header.parent_hash, last.hash) \
+                and header.parent_hash != last.hash:
+            # Re-org of the last block
+            self._resync(header)
+        elif is_next and header.hash is not None and header.logs_bloom is not None:
+            if self._may_have_swaps(header):
+                self._fetch_swaps({'blockHash': header.hash})
+            else:
+                metrics.inc('swap_blocks_skipped')
+        else:
+            self._fetch_swaps({'fromBlock': last.number + 1, 'toBlock': header.number})
+
+        self.last_block = header
+        return dict(self.ticks)
+
+def start(w3: Web3, pools: Iterable[CLPoolInfo]) -> SwapTickTracker:
+    return SwapTickTracker(w3=w3, pools={pool.address: pool for pool in pools})
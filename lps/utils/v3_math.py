@@ -7,10 +7,18 @@ for the description of the purpose of this code.
 
 """
 from decimal import Decimal
+from functools import lru_cache
+from typing import Callable
+
+import attrs
+import numpy as np
 
 TICK_BASE = Decimal('1.0001')
 Q96 = Decimal(0x1000000000000000000000000)
 
+MIN_TICK = -887272
+MAX_TICK = 887272
+
 def tick_to_price(tick: int) -> Decimal:
     return TICK_BASE ** tick
 
@@ -110,3 +118,249 @@ def get_amounts_at_tick(tick_lower: int, tick_upper: int, liquidity: int, tick_c
 
 def sqrtprice_to_human(sqrtPriceX96: int, token0_decimals: int, token1_decimals: int) -> Decimal:
     return ((Decimal(sqrtPriceX96) / Q96) ** 2) / Decimal(10**(token1_decimals - token0_decimals))
+
+
+#
+# Vectorized versions of the functions above. These work on numpy arrays of
+# ticks in float64, the Decimal functions above are the reference.
+#
+
+# exp(tick * ln(1.0001)) is more precise than float(1.0001) ** tick
+_LN_TICK_BASE = float(TICK_BASE.ln())
+
+def ticks_to_prices(ticks: np.ndarray) -> np.ndarray:
+    return np.exp(np.asarray(ticks, dtype=np.float64) * _LN_TICK_BASE)
+
+def ticks_to_sqrt_prices(ticks: np.ndarray) -> np.ndarray:
+    return np.exp(np.asarray(ticks, dtype=np.float64) * (_LN_TICK_BASE / 2))
+
+@attrs.frozen
+class SqrtPriceTable:
+    """ Precomputed sqrt prices for every tick in [tick_min, tick_max] """
+    tick_min: int
+    sqrt_prices: np.ndarray
+
+    @property
+    def tick_max(self) -> int:
+        return self.tick_min + len(self.sqrt_prices) - 1
+
+    def __call__(self, ticks: np.ndarray) -> np.ndarray:
+        """ Same as `ticks_to_sqrt_prices` but as a table lookup """
+        return self.sqrt_prices[np.asarray(ticks) - self.tick_min]
+
+def make_sqrt_price_table(tick_min: int = MIN_TICK, tick_max: int = MAX_TICK) -> SqrtPriceTable:
+    return SqrtPriceTable(
+        tick_min=tick_min,
+        sqrt_prices=ticks_to_sqrt_prices(np.arange(tick_min, tick_max + 1)))
+
+def get_amounts_at_ticks(
+        tick_lower: np.ndarray,
+        tick_upper: np.ndarray,
+        liquidity: np.ndarray,
+        tick_current: np.ndarray,
+        sqrt_price: Callable[[np.ndarray], np.ndarray] = ticks_to_sqrt_prices) -> (np.ndarray, np.ndarray):
+    """
+    Returns (amount0, amount1) arrays, same as `get_amounts_at_tick`.
+    All arguments are broadcast against each other, so this works for many
+    ticks of one position as well as for many positions at once.
+    `sqrt_price` can be a `SqrtPriceTable` covering all of the given ticks.
+    """
+    sa = sqrt_price(tick_lower)
+    sb = sqrt_price(tick_upper)
+    # if the price is outside the range, use the range endpoints instead
+    sp = np.clip(sqrt_price(tick_current), sa, sb)
+
+    liquidity = np.asarray(liquidity, dtype=np.float64)
+    return (
+        liquidity * (sb - sp) / (sp * sb),
+        liquidity * (sp - sa)
+    )
+
+#
+# Fee accounting, exact integer math of Tick.getFeeGrowthInside and
+# NonfungiblePositionManager. Fee growth is uint256 and wraps around.
+#
+
+Q128 = 1 << 128
+_UINT256_MASK = (1 << 256) - 1
+
+def get_fee_growth_inside(
+        tick_lower: int,
+        tick_upper: int,
+        tick_current: int,
+        fee_growth_global_x128: int,
+        fee_growth_outside_lower_x128: int,
+        fee_growth_outside_upper_x128: int) -> int:
+    if tick_current >= tick_lower:
+        fee_growth_below = fee_growth_outside_lower_x128
+    else:
+        fee_growth_below = fee_growth_global_x128 - fee_growth_outside_lower_x128
+
+    if tick_current < tick_upper:
+        fee_growth_above = fee_growth_outside_upper_x128
+    else:
+        fee_growth_above = fee_growth_global_x128 - fee_growth_outside_upper_x128
+
+    return (fee_growth_global_x128 - fee_growth_below - fee_growth_above) & _UINT256_MASK
+
+def get_fees_owed(
+        liquidity: int,
+        fee_growth_inside_x128: int,
+        fee_growth_inside_last_x128: int,
+        tokens_owed: int) -> int:
+    """Raw token amount which `collect` would return"""
+    growth_delta = (fee_growth_inside_x128 - fee_growth_inside_last_x128) & _UINT256_MASK
+    return tokens_owed + growth_delta * liquidity // Q128
+
+#
+# Exact integer math of TickMath.sol, SqrtPriceMath.sol and LiquidityAmounts.sol,
+# rounding is the same as on-chain. Sqrt prices are Q64.96.
+#
+
+Q96_INT = 1 << 96
+MIN_SQRT_RATIO = 4295128739
+MAX_SQRT_RATIO = 1461446703485210103287273052203988822378723970342
+_UINT128_MAX = (1 << 128) - 1
+
+# sqrt(1.0001) ** -(2 ** i) in Q128.128 for every bit i of the tick
+_SQRT_RATIO_FACTORS = (
+    0xfffcb933bd6fad37aa2d162d1a594001,
+    0xfff97272373d413259a46990580e213a,
+    0xfff2e50f5f656932ef12357cf3c7fdcc,
+    0xffe5caca7e10e4e61c3624eaa0941cd0,
+    0xffcb9843d60f6159c9db58835c926644,
+    0xff973b41fa98c081472e6896dfb254c0,
+    0xff2ea16466c96a3843ec78b326b52861,
+    0xfe5dee046a99a2a811c461f1969c3053,
+    0xfcbe86c7900a88aedcffc83b479aa3a4,
+    0xf987a7253ac413176f2b074cf7815e54,
+    0xf3392b0822b70005940c7a398e4b70f3,
+    0xe7159475a2c29b7443b29c7fa6e889d9,
+    0xd097f3bdfd2022b8845ad8f792aa5825,
+    0xa9f746462d870fdf8a65dc1f90e061e5,
+    0x70d869a156d2a1b890bb3df62baf32f7,
+    0x31be135f97d08fd981231505542fcfa6,
+    0x9aa508b5b7a84e1c677de54f3e99bc9,
+    0x5d6af8dedb81196699c329225ee604,
+    0x2216e584f5fa1ea926041bedfe98,
+    0x48a170391f7dc42444e8fa2,
+)
+
+def mul_div(a: int, b: int, denominator: int) -> int:
+    """FullMath.mulDiv, floor(a * b / denominator)"""
+    ret = a * b // denominator
+    if ret > _UINT256_MASK:
+        raise ValueError(f'mulDiv overflow {a} * {b} / {denominator}')
+    return ret
+
+def mul_div_rounding_up(a: int, b: int, denominator: int) -> int:
+    return mul_div(a, b, denominator) + (1 if a * b % denominator else 0)
+
+def _div_rounding_up(a: int, b: int) -> int:
+    return a // b + (1 if a % b else 0)
+
+@lru_cache(maxsize=1 << 16)
+def get_sqrt_ratio_at_tick(tick: int) -> int:
+    """TickMath.getSqrtRatioAtTick, sqrt(1.0001 ** tick) as Q64.96 rounded up"""
+    abs_tick = abs(tick)
+    if abs_tick > MAX_TICK:
+        raise ValueError(f'Tick out of range {tick}')
+
+    ratio = _SQRT_RATIO_FACTORS[0] if abs_tick & 1 else 1 << 128
+    for i in range(1, len(_SQRT_RATIO_FACTORS)):
+        if abs_tick & (1 << i):
+            ratio = (ratio * _SQRT_RATIO_FACTORS[i]) >> 128
+    if tick > 0:
+        ratio = _UINT256_MASK // ratio
+
+    # Q128.128 to Q64.96, rounding up
+    return (ratio >> 32) + (1 if ratio & 0xffffffff else 0)
+
+def get_tick_at_sqrt_ratio(sqrt_price_x96: int) -> int:
+    """TickMath.getTickAtSqrtRatio, the greatest tick with the ratio <= `sqrt_price_x96`"""
+    if not MIN_SQRT_RATIO <= sqrt_price_x96 < MAX_SQRT_RATIO:
+        raise ValueError(f'Sqrt price out of range {sqrt_price_x96}')
+
+    ratio = sqrt_price_x96 << 32
+    msb = ratio.bit_length() - 1
+    r = ratio >> (msb - 127) if msb >= 128 else ratio << (127 - msb)
+
+    # log2 of the ratio in Q64.64, 14 bits of the fraction are enough
+    log_2 = (msb - 128) << 64
+    for shift in range(63, 49, -1):
+        r = (r * r) >> 127
+        f = r >> 128
+        log_2 |= f << shift
+        r >>= f
+
+    log_sqrt10001 = log_2 * 255738958999603826347141 # 128.128 number
+    tick_low = (log_sqrt10001 - 3402992956809132418596140100660247210) >> 128
+    tick_high = (log_sqrt10001 + 291339464771989622907027621153398088495) >> 128
+    if tick_low == tick_high:
+        return tick_low
+    return tick_high if get_sqrt_ratio_at_tick(tick_high) <= sqrt_price_x96 else tick_low
+
+def get_amount0_delta(sqrt_ratio_a_x96: int, sqrt_ratio_b_x96: int, liquidity: int, round_up: bool) -> int:
+    """SqrtPriceMath.getAmount0Delta, round up when paying to the pool (mint)"""
+    (sqrt_ratio_a_x96, sqrt_ratio_b_x96) = sorted((sqrt_ratio_a_x96, sqrt_ratio_b_x96))
+    numerator1 = liquidity << 96
+    numerator2 = sqrt_ratio_b_x96 - sqrt_ratio_a_x96
+    if round_up:
+        return _div_rounding_up(
+            mul_div_rounding_up(numerator1, numerator2, sqrt_ratio_b_x96), sqrt_ratio_a_x96)
+    return mul_div(numerator1, numerator2, sqrt_ratio_b_x96) // sqrt_ratio_a_x96
+
+def get_amount1_delta(sqrt_ratio_a_x96: int, sqrt_ratio_b_x96: int, liquidity: int, round_up: bool) -> int:
+    """SqrtPriceMath.getAmount1Delta"""
+    (sqrt_ratio_a_x96, sqrt_ratio_b_x96) = sorted((sqrt_ratio_a_x96, sqrt_ratio_b_x96))
+    if round_up:
+        return mul_div_rounding_up(liquidity, sqrt_ratio_b_x96 - sqrt_ratio_a_x96, Q96_INT)
+    return mul_div(liquidity, sqrt_ratio_b_x96 - sqrt_ratio_a_x96, Q96_INT)
+
+def get_amounts_for_liquidity(
+        sqrt_ratio_x96: int, sqrt_ratio_a_x96: int, sqrt_ratio_b_x96: int, liquidity: int) -> (int, int):
+    """LiquidityAmounts.getAmountsForLiquidity, (amount0, amount1) rounded down"""
+    (sqrt_ratio_a_x96, sqrt_ratio_b_x96) = sorted((sqrt_ratio_a_x96, sqrt_ratio_b_x96))
+    if sqrt_ratio_x96 <= sqrt_ratio_a_x96:
+        return get_amount0_delta(sqrt_ratio_a_x96, sqrt_ratio_b_x96, liquidity, False), 0
+    elif sqrt_ratio_x96 < sqrt_ratio_b_x96:
+        return (
+            get_amount0_delta(sqrt_ratio_x96, sqrt_ratio_b_x96, liquidity, False),
+            get_amount1_delta(sqrt_ratio_a_x96, sqrt_ratio_x96, liquidity, False)
+        )
+    else:
+        return 0, get_amount1_delta(sqrt_ratio_a_x96, sqrt_ratio_b_x96, liquidity, False)
+
+def _to_uint128(value: int) -> int:
+    if value > _UINT128_MAX:
+        raise ValueError(f'Liquidity overflow {value}')
+    return value
+
+def get_liquidity_for_amounts(
+        sqrt_ratio_x96: int, sqrt_ratio_a_x96: int, sqrt_ratio_b_x96: int,
+        amount0: int, amount1: int) -> int:
+    """LiquidityAmounts.getLiquidityForAmounts, max liquidity for the amounts"""
+    (sqrt_ratio_a_x96, sqrt_ratio_b_x96) = sorted((sqrt_ratio_a_x96, sqrt_ratio_b_x96))
+
+    def for_amount0(sa: int, sb: int) -> int:
+        return _to_uint128(mul_div(amount0, mul_div(sa, sb, Q96_INT), sb - sa))
+
+    def for_amount1(sa: int, sb: int) -> int:
+        return _to_uint128(mul_div(amount1, Q96_INT, sb - sa))
+
+    if sqrt_ratio_x96 <= sqrt_ratio_a_x96:
+        return for_amount0(sqrt_ratio_a_x96, sqrt_ratio_b_x96)
+    elif sqrt_ratio_x96 < sqrt_ratio_b_x96:
+        return min(
+            for_amount0(sqrt_ratio_x96, sqrt_ratio_b_x96),
+            for_amount1(sqrt_ratio_a_x96, sqrt_ratio_x96))
+    else:
+        return for_amount1(sqrt_ratio_a_x96, sqrt_ratio_b_x96)
+
+def get_amounts_at_tick_exact(tick_lower: int, tick_upper: int, liquidity: int, tick_current: int) -> (int, int):
+    """Same as `get_amounts_at_tick`, but raw amounts exactly as the position manager computes"""
+    return get_amounts_for_liquidity(
+        get_sqrt_ratio_at_tick(tick_current),
+        get_sqrt_ratio_at_tick(tick_lower),
+        get_sqrt_ratio_at_tick(tick_upper),
+        liquidity)
@@ -4,15 +4,22 @@ import logging.config
 load_configuration('dev')
 logging.config.dictConfig(logging_config())
 
+import attrs
 import pytest
 import requests
 from eth_defi.chain import install_retry_middleware
 from eth_defi.event_reader.fast_json_rpc import patch_web3
 from web3 import Web3
 
+from lps import sweep
+from lps.aerodrome import PositionInfo
 from lps.connectors import hl
+from lps.contracts import create_contract_cached
 from lps.utils.config import load_configuration, get_config
 
+# WETH/USDC pool of the positions made by `make_position`
+POOL = Web3.to_checksum_address('0xb2cc224c1c9fee385f8ad6a55b4d94e92359dc59')
+
 
 @pytest.fixture(scope="session", autouse=True)
 def init():
@@ -32,3 +39,24 @@ def base_w3(init):
 @pytest.fixture(scope='session')
 def hl_connector(init):
     return hl.start()
+
+@pytest.fixture(scope='session')
+def local_w3(init):
+    """In-memory chain, for the tests that only need contract objects"""
+    return Web3(Web3.EthereumTesterProvider())
+
+@pytest.fixture
+def make_position(local_w3):
+    """
+    WETH/USDC position of the given width from `sweep.make_position`,
+    with the pool contract on the in-memory chain
+    """
+    def make(width: int = 1600, pool: str = POOL) -> PositionInfo:
+        pos = sweep.make_position(width, sweep.SweepParams())
+        contract = create_contract_cached(local_w3, 'aerodrome_cl_pool.json', address=pool)
+        return attrs.evolve(pos, pool=attrs.evolve(pos.pool, contract=contract))
+    return make
+
+@pytest.fixture
+def pos(make_position) -> PositionInfo:
+    return make_position()
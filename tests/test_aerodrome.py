@@ -0,0 +1,73 @@
+import attrs
+
+from lps import aerodrome
+from lps.utils import v3_math
+
+Q128 = v3_math.Q128
+
+def test_uncollected_fees_single_multicall(local_w3, pos, monkeypatch):
+    (lower, upper) = (pos.tick_lower, pos.tick_upper)
+    positions = [
+        attrs.evolve(pos, nft_id=1),
+        # Same ticks, fees were collected later
+        attrs.evolve(pos, nft_id=2),
+        attrs.evolve(pos, nft_id=3, tick_upper=upper + 200),
+    ]
+    nft_positions = {
+        1: (0, '', '', 100, lower, upper, 3, 1 * Q128, 2 * Q128, 5, 0),
+        2: (0, '', '', 100, lower, upper, 10**18, 4 * Q128, 7 * Q128, 0, 0),
+        3: (0, '', '', 100, lower, upper + 200, 2, 1 * Q128, 1 * Q128, 0, 1),
+    }
+    ticks = {lower: (10 * Q128, 20 * Q128), upper: (30 * Q128, 40 * Q128), upper + 200: (0, 0)}
+
+    calls = []
+    def aggregate3(_w3, funcs, block):
+        calls.append(block)
+        ret = []
+        for func in funcs:
+            if func.fn_name == 'positions':
+                ret.append((0,) + nft_positions[func.args[0]])
+            elif func.fn_name == 'slot0':
+                ret.append((0, lower + 100, 0, 0, 0, True))
+            elif func.fn_name == 'feeGrowthGlobal0X128':
+                ret.append((50 * Q128,))
+            elif func.fn_name == 'feeGrowthGlobal1X128':
+                ret.append((100 * Q128,))
+            elif func.fn_name == 'ticks':
+                ret.append((0, 0, 0, *ticks[func.args[0]], 0, 0, 0, 0, True))
+        return ret
+    monkeypatch.setattr(aerodrome.multicall, 'aggregate3', aggregate3)
+
+    fees = aerodrome.get_uncollected_fees_batched(local_w3, positions, block=123)
+    assert calls == [123]
+    # Inside growth is (50 - 10 - 30, 100 - 20 - 40) = (10, 40)
+    assert fees[1] == aerodrome.UncollectedFees(1, 5 + 3 * 9, 3 * 38)
+    assert fees[2] == aerodrome.UncollectedFees(2, 6 * 10**18, 33 * 10**18)
+    # Upper tick isn't initialized, inside growth is (40, 80)
+    assert fees[3] == aerodrome.UncollectedFees(3, 2 * 39, 1 + 2 * 79)
+
+def test_all_user_positions_read_liquidity_every_time(local_w3, pos, monkeypatch):
+    class Index:
+        def token_ids(self, _addr):
+            return {2, 1}
+
+    liquidity = {1: 100, 2: 200}
+    def aggregate3(_w3, funcs):
+        assert [func.fn_name for func in funcs] == ['positions', 'positions']
+        return [(0, '', pos.token0.address, pos.token1.address, 100,
+                 pos.tick_lower, pos.tick_upper, liquidity[func.args[0]], 0, 0, 0, 0)
+                for func in funcs]
+    monkeypatch.setattr(aerodrome.multicall, 'aggregate3', aggregate3)
+    monkeypatch.setattr(aerodrome, 'fetch_erc20_details_cached',
+                        lambda _w3, addr: {pos.token0.address: pos.token0, pos.token1.address: pos.token1}[addr])
+    monkeypatch.setattr(aerodrome, '_get_pool_info_cached', lambda *_: pos.pool)
+
+    positions = aerodrome.all_user_positions(local_w3, Index(), '0x0')
+    assert [(p.nft_id, p.liquidity) for p in positions] == [(1, 100), (2, 200)]
+
+    # Liquidity was increased
+    liquidity[1] = 150
+    positions = aerodrome.all_user_positions(local_w3, Index(), '0x0')
+    assert [(p.nft_id, p.liquidity) for p in positions] == [(1, 150), (2, 200)]
+    assert (positions[0].tick_lower, positions[0].tick_upper, positions[0].pool) == \
+           (pos.tick_lower, pos.tick_upper, pos.pool)
@@ -0,0 +1,68 @@
+import functools
+import math
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+from lps import hedger, backtest
+from lps.connectors import mock_cex
+from lps.utils import v3_math
+
+def _reference_loop(pos, prices, hedge_computer, rehedge_every_n):
+    """Step-by-step loop from simulate.scenario2 for a single path"""
+    conn = mock_cex.start(2000)
+
+    def price_to_tick(price):
+        return math.floor(math.log(price / 10**12, v3_math.TICK_BASE))
+
+    def pos_value(tick, price):
+        (amount0, amount1) = v3_math.get_amounts_at_tick(
+            pos.tick_lower, pos.tick_upper, pos.liquidity, tick)
+        return (pos.token0.convert_to_decimals(amount0) * price
+                + pos.token1.convert_to_decimals(amount1))
+
+    hedge_sizes = []
+    trade_count = 0
+    for i, price in enumerate(map(Decimal, prices)):
+        conn.set_mid_prices({'ETH': price})
+        tick = price_to_tick(price)
+        if rehedge_every_n == 0 or i % rehedge_every_n == 0:
+            hedges = hedge_computer([(pos, tick)])
+            updates = hedger.compute_hedge_adjustments(conn, hedges)
+            trade_count += hedger.execute_hedge_adjustements(conn, updates)
+        hedge_sizes.append(float(conn.position_sizes['ETH']))
+
+    starting_pos_value = pos_value(price_to_tick(Decimal(prices[0])), Decimal(prices[0]))
+    final_pos_value = pos_value(tick, price)
+    hedge_pnl = conn.get_total_balance() - 2000
+    return (float(starting_pos_value), float(final_pos_value),
+            float(hedge_pnl), trade_count, hedge_sizes)
+
+@pytest.mark.parametrize('hedge_computer,rehedge_every_n', [
+    (hedger.compute_hedges, 0),
+    (hedger.compute_hedges_50_50, 0),
+    (functools.partial(hedger.compute_hedges_fixed_step, threshold=100), 0),
+    (hedger.compute_hedges_4_step, 5),
+])
+def test_backtest_matches_step_loop(pos, hedge_computer, rehedge_every_n):
+    np.random.seed(42)
+    num_steps, num_sims = 300, 4
+    middle_tick = (pos.tick_lower + pos.tick_upper) // 2
+    start_price = float(v3_math.tick_to_price(middle_tick)) * 10**12
+    # Volatile enough to cross the range boundaries
+    prices = start_price * np.exp(
+        np.cumsum(np.random.normal(0, 0.005, size=(num_steps, num_sims)), axis=0))
+
+    res = backtest.run(pos, prices, hedge_computer,
+                       rehedge_every_n, keep_paths=True)
+
+    for sim_idx in range(num_sims):
+        (starting_pos_value, final_pos_value, hedge_pnl, trade_count, hedge_sizes) = \
+            _reference_loop(pos, prices[:, sim_idx], hedge_computer, rehedge_every_n)
+
+        assert res.starting_pos_value[sim_idx] == pytest.approx(starting_pos_value)
+        assert res.final_pos_value[sim_idx] == pytest.approx(final_pos_value)
+        assert res.hedge_pnl[sim_idx] == pytest.approx(hedge_pnl, abs=1e-6)
+        assert res.trade_count[sim_idx] == trade_count
+        assert res.hedge_size[:, sim_idx] == pytest.approx(hedge_sizes)
@@ -0,0 +1,96 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+from web3 import Web3
+
+from lps import bench, rpc_cassette, rpc_batch
+
+
+@pytest.fixture
+def upstream_node():
+    """Local JSON-RPC stand-in for single requests, counts them"""
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            req = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            requests.append(req)
+            number = int(req['params'][0], 16)
+            body = json.dumps({'jsonrpc': '2.0', 'id': req['id'], 'result': {
+                'number': hex(number), 'timestamp': hex(number * 2)}}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}', requests
+    server.shutdown()
+
+def test_cassette_record_and_replay(upstream_node, tmp_path):
+    (url, requests) = upstream_node
+    path = tmp_path / 'cassette.json'
+
+    recorder = rpc_cassette.start(path, upstream_url=url)
+    rpc = rpc_batch.start(Web3(Web3.HTTPProvider(recorder.url)), batch_size=3)
+    assert rpc.get_block_timestamps(range(10, 15)) == {b: b * 2 for b in range(10, 15)}
+    recorder.stop()
+    assert len(requests) == 5
+
+    # Replays without upstream, in different batches
+    player = rpc_cassette.start(path)
+    rpc = rpc_batch.start(Web3(Web3.HTTPProvider(player.url)), batch_size=10)
+    assert rpc.get_block_timestamps(range(10, 15)) == {b: b * 2 for b in range(10, 15)}
+    with pytest.raises(rpc_batch.RpcBatchException, match='not recorded'):
+        rpc.get_block_timestamps([20])
+    player.stop()
+    assert len(requests) == 5
+
+def test_time_benchmark(monkeypatch):
+    monkeypatch.setattr(bench, 'MIN_TIME_SEC', 0.01)
+    calls = []
+    res = bench.time_benchmark(lambda: calls.append(1), repeat=3)
+    assert res.number > 1
+    assert len(calls) >= res.number * 3
+    assert 0 < res.min_sec <= res.median_sec
+
+def test_compare_with_baseline():
+    def res(sec):
+        return bench.BenchResult(median_sec=sec, min_sec=sec, number=1, repeat=1)
+
+    baseline = bench.from_json(json.loads(json.dumps(bench.to_json(
+        {'a': res(1.0), 'b': res(1.0), 'c': res(1.0)}))))
+    current = {'a': res(1.1), 'b': res(1.5), 'new': res(10.0)}
+
+    assert bench.compare(current, baseline, threshold=0.2) == [
+        bench.Regression('b', 1.0, 1.5)]
+    assert [r.name for r in bench.compare(current, baseline, threshold=0.05)] == ['a', 'b']
+
+def test_benchmarks_run(monkeypatch):
+    monkeypatch.setattr(bench, 'MIN_TIME_SEC', 0.001)
+    names = ['v3_math.get_amounts_at_tick', 'hedger.compute_hedges_fixed_step[100]',
+             'hedger.compute_hedge_adjustments', 'simulate.step', 'metrics.span']
+    results = bench.run_benchmarks(names, repeat=1)
+    assert set(results) == set(names)
+
+def test_stats_candles_replay_offline():
+    class Exchange:
+        def fetch_ohlcv(self, symbol, timeframe, since, limit):
+            return [[since, 1.0, 2.0, 0.5, 1.5, 10.0]]
+
+    recorder = bench._CandleRecorder(Exchange())
+    candles = recorder.fetch_ohlcv('ETH/USDT', '1m', 60_000, 1000)
+
+    cassette = bench._CandleCassette(json.loads(json.dumps(recorder.responses)))
+    assert cassette.fetch_ohlcv('ETH/USDT', '1m', 60_000, 1000) == candles
+    with pytest.raises(RuntimeError, match='not recorded'):
+        cassette.fetch_ohlcv('ETH/USDT', '1m', 120_000, 1000)
+    with pytest.raises(RuntimeError, match='not recorded'):
+        cassette.fetch_bids_asks(['ETH/USDT'])
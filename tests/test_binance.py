@@ -0,0 +1,73 @@
+from decimal import Decimal
+
+import pytest
+
+from lps.connectors import binance
+
+class _Exchange:
+    def __init__(self):
+        self.calls = []
+        self.tickers = {
+            'ETH/USDT': {'bid': 2000.5, 'ask': 2001.0},
+            'BTC/USDT': {'bid': 60000.0, 'ask': None},
+            'AERO/USDT': {'bid': None, 'ask': None},
+        }
+        self.markets = {symbol: {} for symbol in self.tickers}
+
+    def fetch_bids_asks(self, symbols):
+        self.calls.append(symbols)
+        # Same as ccxt `market_symbols`
+        for symbol in symbols:
+            if symbol not in self.markets:
+                raise ValueError(f'binance does not have market symbol {symbol}')
+        return {symbol: ticker for symbol, ticker in self.tickers.items() if symbol in symbols}
+
+def test_ticker_snapshot_single_call_within_ttl():
+    exchange = _Exchange()
+    tickers = binance.TickerSnapshot(exchange=exchange, ttl_sec=60)
+
+    # Synonyms are priced as the canonical symbol
+    assert tickers.get_mid_prices('WETH', 'BTC') == {
+        'WETH': Decimal('2000.75'), 'BTC': Decimal('60000.0')}
+    assert tickers.get_mid_prices('ETH') == {'ETH': Decimal('2000.75')}
+    assert exchange.calls == [['BTC/USDT', 'ETH/USDT']]
+
+    # Snapshot expired
+    exchange.tickers['ETH/USDT'] = {'bid': 2100.0, 'ask': 2100.0}
+    tickers._fetched_at -= 61
+    assert tickers.get_mid_prices('ETH') == {'ETH': Decimal('2100.0')}
+    assert len(exchange.calls) == 2
+
+def test_ticker_snapshot_missing_price():
+    exchange = _Exchange()
+    tickers = binance.TickerSnapshot(exchange=exchange, ttl_sec=60)
+    tickers.get_mid_prices('ETH')
+
+    with pytest.raises(binance.BinanceException, match='AERO/USDT'):
+        tickers.get_mid_prices('ETH', 'AERO')
+    # New symbol is added to the snapshot
+    assert exchange.calls == [['ETH/USDT'], ['AERO/USDT', 'ETH/USDT']]
+
+def test_ticker_snapshot_unknown_market():
+    exchange = _Exchange()
+    tickers = binance.TickerSnapshot(exchange=exchange, ttl_sec=60)
+
+    with pytest.raises(binance.BinanceException, match='FOO/USDT'):
+        tickers.get_mid_prices('ETH', 'FOO')
+    assert exchange.calls == []
+
+    # Unknown symbol isn't kept in the snapshot
+    tickers.get_mid_prices('ETH')
+    tickers._fetched_at -= 61
+    assert tickers.get_mid_prices('ETH') == {'ETH': Decimal('2000.75')}
+    assert exchange.calls == [['ETH/USDT'], ['ETH/USDT']]
+
+def test_ticker_snapshot_stable_coins():
+    exchange = _Exchange()
+    tickers = binance.TickerSnapshot(exchange=exchange, ttl_sec=60)
+
+    assert tickers.get_mid_prices('USDC', 'USDT', 'ETH') == {
+        'USDC': Decimal(1), 'USDT': Decimal(1), 'ETH': Decimal('2000.75')}
+    tickers._fetched_at -= 61
+    assert tickers.get_mid_prices('USDC') == {'USDC': Decimal(1)}
+    assert exchange.calls == [['ETH/USDT']]
@@ -0,0 +1,78 @@
+import json
+import threading
+import time
+
+import pytest
+from websockets.sync.server import serve, ServerConnection
+
+from lps.connectors import base
+
+
+def _header_msg(number: int, timestamp: int) -> str:
+    return json.dumps({
+        'jsonrpc': '2.0',
+        'method': 'eth_subscription',
+        'params': {
+            'subscription': '0x1',
+            'result': {'number': hex(number), 'timestamp': hex(timestamp)}}})
+
+@pytest.fixture
+def new_heads_node():
+    """Local stand-in for the node, pushes headers put into `heads`"""
+    heads_ready = threading.Event()
+    stopped = threading.Event()
+    heads: list[str] = []
+
+    def handler(ws: ServerConnection):
+        request = json.loads(ws.recv())
+        assert request['method'] == 'eth_subscribe'
+        assert request['params'] == ['newHeads']
+        ws.send(json.dumps({'jsonrpc': '2.0', 'id': request['id'], 'result': '0x1'}))
+        while not stopped.is_set():
+            if not heads_ready.wait(timeout=0.05):
+                continue
+            heads_ready.clear()
+            while heads:
+                ws.send(heads.pop(0))
+
+    with serve(handler, '127.0.0.1', 0) as server:
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        def push(*msgs):
+            heads.extend(msgs)
+            heads_ready.set()
+
+        port = server.socket.getsockname()[1]
+        yield f'ws://127.0.0.1:{port}', push
+        stopped.set()
+        server.shutdown()
+
+def test_new_heads_feed(new_heads_node):
+    (url, push) = new_heads_node
+    feed = base.subscribe_new_heads(url)
+
+    # Nothing yet
+    assert feed.next_block(timeout_sec=0.1) is None
+
+    push(_header_msg(100, 1000))
+    assert feed.next_block(timeout_sec=1) == base.BlockHeader(number=100, timestamp=1000)
+
+    # Only the latest header when several have arrived
+    push(_header_msg(101, 1002), _header_msg(102, 1004))
+    time.sleep(0.1)
+    assert feed.next_block(timeout_sec=1) == base.BlockHeader(number=102, timestamp=1004)
+
+    feed.close()
+
+def test_new_heads_feed_wakes_up_on_push(new_heads_node):
+    (url, push) = new_heads_node
+    feed = base.subscribe_new_heads(url)
+
+    timer = threading.Timer(0.2, push, [_header_msg(200, 2000)])
+    timer.start()
+    started = time.time()
+    assert feed.next_block(timeout_sec=5).number == 200
+    assert time.time() - started < 1
+
+    feed.close()
@@ -0,0 +1,97 @@
+import time
+
+import attrs
+
+from lps.connectors import candle_store
+from lps.connectors.candle_store import CANDLE_MS, PAGE_MS
+
+
+@attrs.define
+class FakeExchange:
+    """Returns a candle for every minute, low price is the minute index"""
+    requests: list = attrs.field(factory=list)
+
+    def fetch_ohlcv(self, symbol, timeframe, since, limit):
+        assert timeframe == '1m'
+        self.requests.append((symbol, since, limit))
+        start = -(-since // CANDLE_MS) * CANDLE_MS
+        return [[ts, 1.0, 2.0, float(ts // CANDLE_MS), 1.5, 10.0]
+                for ts in range(start, start + limit * CANDLE_MS, CANDLE_MS)]
+
+def test_candles_are_fetched_by_pages(tmp_path):
+    exchange = FakeExchange()
+    store = candle_store.start(exchange, tmp_path)
+
+    base_ms = 28_333_334 * CANDLE_MS
+    # Not aligned timestamps round up to the next candle, same as fetch_ohlcv
+    assert store.get_candle('ETH/USDT', base_ms + 1).low == base_ms // CANDLE_MS + 1
+    assert store.get_candle('ETH/USDT', base_ms).low == base_ms // CANDLE_MS
+
+    # Whole page is served with a single request
+    page_start = base_ms // PAGE_MS * PAGE_MS
+    for ts in range(page_start, page_start + PAGE_MS, 7 * CANDLE_MS):
+        assert store.get_candle('ETH/USDT', ts).low == ts // CANDLE_MS
+    assert len(exchange.requests) == 1
+
+    # Next page and other symbols are separate
+    store.get_candle('ETH/USDT', page_start + PAGE_MS)
+    store.get_candle('BTC/USDT', base_ms)
+    assert len(exchange.requests) == 3
+
+def test_candles_persist_on_disk(tmp_path):
+    base_ms = 28_333_334 * CANDLE_MS
+
+    exchange = FakeExchange()
+    candle_store.start(exchange, tmp_path).get_candle('ETH/USDT', base_ms)
+    assert len(exchange.requests) == 1
+
+    exchange = FakeExchange()
+    store = candle_store.start(exchange, tmp_path)
+    assert store.get_candle('ETH/USDT', base_ms + 5 * CANDLE_MS).low == base_ms // CANDLE_MS + 5
+    assert len(exchange.requests) == 0
+
+def test_missing_candles(tmp_path):
+    class NoCandles(FakeExchange):
+        def fetch_ohlcv(self, symbol, timeframe, since, limit):
+            self.requests.append((symbol, since, limit))
+            return []
+
+    exchange = NoCandles()
+    store = candle_store.start(exchange, tmp_path)
+    assert store.get_candle('NEW/USDT', 1_700_000_000_000) is None
+    assert store.get_candle('NEW/USDT', 1_700_000_060_000) is None
+    assert len(exchange.requests) == 1
+
+def test_unfinished_page_is_kept_in_memory(tmp_path):
+    exchange = FakeExchange()
+    store = candle_store.start(exchange, tmp_path)
+
+    now_ms = int(time.time() * 1000) // CANDLE_MS * CANDLE_MS
+    for ts in (now_ms, now_ms // PAGE_MS * PAGE_MS, now_ms):
+        assert store.get_candle('ETH/USDT', ts).low == ts // CANDLE_MS
+    assert len(exchange.requests) == 1
+
+    # Fetched again once expired, never stored
+    key = ('ETH/USDT', now_ms // PAGE_MS)
+    (fetched_at, table) = store._unfinished[key]
+    store._unfinished[key] = (fetched_at - store.unfinished_ttl_sec - 1, table)
+    store.get_candle('ETH/USDT', now_ms)
+    assert len(exchange.requests) == 2
+    assert not any(tmp_path.rglob('*.parquet'))
+
+def test_gap_at_page_end(tmp_path):
+    class GapExchange(FakeExchange):
+        """No candles in the last 10 minutes of the first page and the first 5 of the next one"""
+        def fetch_ohlcv(self, symbol, timeframe, since, limit):
+            gap = range(gap_start, gap_start + 15 * CANDLE_MS)
+            return [c for c in super().fetch_ohlcv(symbol, timeframe, since, limit) if c[0] not in gap]
+
+    page_start = 28_333 * PAGE_MS
+    gap_start = page_start + PAGE_MS - 10 * CANDLE_MS
+    exchange = GapExchange()
+    store = candle_store.start(exchange, tmp_path)
+
+    # Next candle is in the next page, same as fetch_ohlcv
+    assert store.get_candle('ETH/USDT', gap_start).timestamp_ms == gap_start + 15 * CANDLE_MS
+    assert store.get_candle('ETH/USDT', gap_start - CANDLE_MS).timestamp_ms == gap_start - CANDLE_MS
+    assert len(exchange.requests) == 2
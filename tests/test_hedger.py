@@ -1,3 +1,7 @@
+import random
+import threading
+import time
+
 import rich
 from web3 import Web3
 from decimal import Decimal
@@ -5,6 +9,7 @@ from decimal import Decimal
 from connectors import mock_cex
 from lps import erc20, hedger
 from lps.aerodrome import PositionInfo, CLPoolInfo
+from lps.connectors.abs import ConnectorException
 from lps.connectors import hl
 from lps.connectors.hl import HL
 from lps.contracts import create_contract_cached
@@ -216,3 +221,67 @@ def test_hedge_single_pos_two_volatiles(base_w3: Web3, hl_connector: HL):
 
 def test_hedge_multi_pos_many_volatiles(base_w3: Web3, hl_connector: HL):
     pass # TODO
+
+def test_execute_adjustments_concurrently():
+    """Connector without bulk orders gets all orders at the same time"""
+    barrier = threading.Barrier(3, timeout=5)
+    orders = {}
+
+    class SlowConnector:
+        def market_order(self, name: str, size: Decimal):
+            barrier.wait() # all three orders are in flight
+            if name == 'SOL':
+                raise ConnectorException('rejected')
+            orders[name] = size
+
+    updated_cnt = hedger.execute_hedge_adjustements(SlowConnector(), {
+        'ETH': (Decimal('-0.1'), Decimal('-0.2')),
+        'BTC': (Decimal(0), Decimal('-0.01')),
+        'SOL': (Decimal('-1'), Decimal(0)),
+        'ARB': (Decimal('-5'), Decimal('-5')),
+    })
+    assert updated_cnt == 3
+    assert orders == {'ETH': Decimal('-0.1'), 'BTC': Decimal('-0.01')}
+
+def test_execute_adjustments_with_bulk_orders():
+    conn = mock_cex.start(100)
+    conn.set_mid_prices({'ETH': Decimal(3500), 'BTC': Decimal(90000)})
+    conn.position_sizes['ETH'] = Decimal('-0.1')
+
+    # Closing ETH short needs more usd than there is
+    updated_cnt = hedger.execute_hedge_adjustements(conn, {
+        'ETH': (Decimal('-0.1'), Decimal(0)),
+        'BTC': (Decimal(0), Decimal('-0.01')),
+    })
+    assert updated_cnt == 1
+    assert conn.position_sizes == {'ETH': Decimal('-0.1'), 'BTC': Decimal('-0.01')}
+
+def test_no_trade_band_fixed_step(pos):
+    rnd = random.Random(1)
+    for threshold in (0, 50, 300):
+        for tick in rnd.sample(range(pos.tick_lower - 500, pos.tick_upper + 500), 30):
+            (lo, hi) = hedger.no_trade_band_fixed_step(pos, tick, threshold)
+            assert lo <= tick <= hi
+
+            expected = hedger.compute_hedges_fixed_step([(pos, tick)], threshold)
+            for t in {lo, hi, rnd.randint(lo, hi)}:
+                if -1_000_000 < t < 1_000_000:
+                    assert hedger.compute_hedges_fixed_step([(pos, t)], threshold) == expected
+
+    # Bands end exactly where the hedge changes
+    assert hedger.no_trade_band_fixed_step(pos, pos.tick_lower + 500, 100) == \
+           (pos.tick_lower + 100, pos.tick_upper - 100)
+    assert hedger.no_trade_band_fixed_step(pos, pos.tick_lower, 0) == \
+           (-887272, pos.tick_lower)
+
+def test_no_trade_bands_expire(monkeypatch):
+    bands = hedger.NoTradeBands(max_age_sec=60)
+    assert not bands.contains([10])
+
+    bands.set([(0, 100)])
+    assert bands.contains([10])
+    assert not bands.contains([101])
+
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 61)
+    assert not bands.contains([10])
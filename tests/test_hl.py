@@ -0,0 +1,165 @@
+import time
+from decimal import Decimal
+
+import attrs
+
+from lps.connectors import hl
+from lps.utils.config import get_config
+
+
+@attrs.define
+class FakeInfo:
+    """Counts REST calls instead of doing them"""
+    mids: dict[str, str]
+    szi: str
+    rest_calls: int = 0
+
+    def all_mids(self):
+        self.rest_calls += 1
+        return self.mids
+
+    def user_state(self, _addr: str):
+        self.rest_calls += 1
+        return {'assetPositions': [
+            {'position': {'coin': 'ETH', 'positionValue': '350', 'szi': self.szi}}]}
+
+def _make_hl(info: FakeInfo) -> hl.HL:
+    return hl.HL(info=info, exchange=None, public_addr='0x0',
+                 sz_decimals={'ETH': 4}, state=hl.HLState())
+
+def test_ws_state_serves_reads_without_rest():
+    info = FakeInfo(mids={'ETH': '3500'}, szi='-0.1')
+    conn = _make_hl(info)
+
+    # No websocket updates yet, uses REST
+    assert conn.get_mid_prices('ETH') == {'ETH': Decimal('3500')}
+    assert info.rest_calls == 1
+
+    conn.state.on_all_mids({'channel': 'allMids', 'data': {'mids': {'ETH': '3600.5'}}})
+    assert conn.get_mid_prices('ETH') == {'ETH': Decimal('3600.5')}
+    assert info.rest_calls == 1
+
+    # Positions are read once and then cached
+    assert conn.get_user_positions()['ETH'].szi == Decimal('-0.1')
+    assert conn.get_user_positions()['ETH'].szi == Decimal('-0.1')
+    assert info.rest_calls == 2
+
+    # Snapshot fills are historical and don't change anything
+    conn.state.on_user_fills({'channel': 'userFills', 'data': {'isSnapshot': True, 'fills': []}})
+    assert conn.get_user_positions()['ETH'].szi == Decimal('-0.1')
+    assert info.rest_calls == 2
+
+    # New fill invalidates positions
+    info.szi = '-0.2'
+    conn.state.on_user_fills({'channel': 'userFills', 'data': {'fills': [{'coin': 'ETH'}]}})
+    assert conn.get_user_positions()['ETH'].szi == Decimal('-0.2')
+    assert info.rest_calls == 3
+
+def test_ws_state_falls_back_to_rest_when_stale():
+    info = FakeInfo(mids={'ETH': '3500'}, szi='-0.1')
+    conn = _make_hl(info)
+
+    conn.state.on_all_mids({'channel': 'allMids', 'data': {'mids': {'ETH': '3600'}}})
+    conn.get_user_positions()
+    assert info.rest_calls == 1
+
+    conn.state.mids_updated_at = time.time() - 60
+    assert conn.get_mid_prices('ETH') == {'ETH': Decimal('3500')}
+    conn.get_user_positions()
+    assert info.rest_calls == 3
+
+@attrs.define
+class FakeExchange:
+    """Fills at most `max_fill` of every order, records bulk requests"""
+    max_fill: dict[str, Decimal]
+    requests: list = attrs.field(factory=list)
+
+    def _slippage_price(self, name, is_buy, slippage, px):
+        return px * (1 + slippage) if is_buy else px * (1 - slippage)
+
+    def bulk_orders(self, order_requests):
+        self.requests.append(order_requests)
+        statuses = []
+        for req in order_requests:
+            filled = min(Decimal(str(req['sz'])), self.max_fill.get(req['coin'], Decimal(0)))
+            if filled == 0:
+                statuses.append({'error': 'Could not immediately match'})
+            else:
+                statuses.append({'filled': {'totalSz': str(filled), 'avgPx': '1', 'oid': 1}})
+        return {'status': 'ok', 'response': {'type': 'order', 'data': {'statuses': statuses}}}
+
+def test_bulk_market_orders_retry_partial_fills():
+    info = FakeInfo(mids={'ETH': '3500', 'BTC': '90000', 'SOL': '200'}, szi='-0.1')
+    exchange = FakeExchange(max_fill={'ETH': Decimal('0.2'), 'BTC': Decimal('1')})
+    conn = hl.HL(info=info, exchange=exchange, public_addr='0x0',
+                 sz_decimals={'ETH': 4, 'BTC': 5, 'SOL': 2})
+
+    not_executed = conn.market_orders({
+        'ETH': Decimal('-0.5'), 'BTC': Decimal('0.01'), 'SOL': Decimal('-1')})
+
+    # ETH is filled over three attempts, SOL never fills
+    assert not_executed == {'ETH': Decimal(0), 'BTC': Decimal(0), 'SOL': Decimal('-1')}
+    assert [{r['coin']: r['sz'] for r in reqs} for reqs in exchange.requests] == [
+        {'ETH': 0.5, 'BTC': 0.01, 'SOL': 1.0},
+        {'ETH': 0.3, 'SOL': 1.0},
+        {'ETH': 0.1, 'SOL': 1.0},
+    ]
+    assert [r['is_buy'] for r in exchange.requests[0]] == [False, True, False]
+
+@attrs.define
+class FakeLeverageExchange:
+    updates: list = attrs.field(factory=list)
+
+    def update_leverage(self, leverage, name):
+        self.updates.append((name, leverage))
+        return {'status': 'ok'}
+
+def _user_state(**leverages):
+    return {'assetPositions': [
+        {'position': {'coin': coin, 'positionValue': '1', 'szi': '1',
+                      'leverage': {'type': 'cross', 'value': value}}}
+        for coin, value in leverages.items()]}
+
+def test_leverage_updated_only_when_different(monkeypatch):
+    monkeypatch.setitem(get_config().hyperliquid, 'leverages', {'ETH': 5, 'BTC': 3})
+    exchange = FakeLeverageExchange()
+
+    # ETH position already has the leverage, BTC is unknown
+    hl._update_leverages(exchange, _user_state(ETH=5))
+    assert exchange.updates == [('BTC', 3)]
+
+    # Without positions leverage isn't reported, it might have been changed elsewhere
+    exchange.updates.clear()
+    hl._update_leverages(exchange, _user_state())
+    assert exchange.updates == [('ETH', 5), ('BTC', 3)]
+
+    # Open position with a different leverage
+    exchange.updates.clear()
+    hl._update_leverages(exchange, _user_state(ETH=5, BTC=10))
+    assert exchange.updates == [('BTC', 3)]
+
+def test_meta_cached_on_disk(tmp_path, monkeypatch):
+    monkeypatch.setattr(hl, 'data_path', lambda: tmp_path)
+    requests = []
+
+    class FakeAPI:
+        def __init__(self, _url):
+            pass
+
+        def post(self, _path, payload):
+            requests.append(payload['type'])
+            if payload['type'] == 'meta':
+                return {'universe': [{'name': 'ETH', 'szDecimals': 4}]}
+            return {'universe': [], 'tokens': []}
+    monkeypatch.setattr(hl, 'API', FakeAPI)
+
+    (meta, _) = hl._load_meta('url', ['ETH'])
+    assert meta['universe'][0]['szDecimals'] == 4
+    assert requests == ['meta', 'spotMeta']
+
+    hl._load_meta('url', ['ETH'])
+    assert len(requests) == 2
+
+    # Coin listed after the meta was cached
+    hl._load_meta('url', ['ETH', 'HYPE'])
+    assert len(requests) == 4
@@ -0,0 +1,80 @@
+import attrs
+from hexbytes import HexBytes
+from web3.datastructures import AttributeDict
+
+from lps import log_indexer
+
+
+@attrs.define
+class FakeEvent:
+    """One log every 1000 blocks, rejects ranges wider than max_range"""
+    max_range: int
+    address: str = '0x0000000000000000000000000000000000000001'
+    event_name: str = 'Transfer'
+    requests: list = attrs.field(factory=list)
+
+    def get_logs(self, argument_filters, fromBlock, toBlock):
+        self.requests.append((fromBlock, toBlock))
+        if toBlock - fromBlock + 1 > self.max_range:
+            raise ValueError('block range is too wide')
+        return [
+            AttributeDict({
+                'blockNumber': block,
+                'logIndex': 0,
+                'transactionHash': HexBytes(block.to_bytes(32, 'big')),
+                'address': self.address,
+                'event': self.event_name,
+                'args': AttributeDict({'tokenId': block, 'to': argument_filters['to']}),
+            })
+            for block in range(fromBlock, toBlock + 1) if block % 1000 == 0]
+
+@attrs.define
+class FakeW3:
+    finalized: int
+    latest: int
+
+    @property
+    def eth(self):
+        return self
+
+    def get_block(self, block_id):
+        assert block_id == 'finalized'
+        return {'number': self.finalized}
+
+    def get_block_number(self):
+        return self.latest
+
+def test_indexer_resumes_from_checkpoint(tmp_path):
+    indexer = log_indexer.start(None, tmp_path / 'logs.sqlite')
+    event = FakeEvent(max_range=3000)
+    w3 = FakeW3(finalized=50_000, latest=50_100)
+    filters = {'to': '0x0000000000000000000000000000000000000002'}
+
+    logs = indexer.get_logs(w3, event, filters)
+    assert [log['blockNumber'] for log in logs] == list(range(0, 50_001, 1000))
+    assert logs[1]['args']['tokenId'] == 1000
+    assert logs[1]['transactionHash'] == HexBytes((1000).to_bytes(32, 'big'))
+    # Chunk size adapts to the node limit
+    rejected = [r for r in event.requests if r[1] - r[0] + 1 > 3000]
+    assert len(rejected) == 2
+    assert len(event.requests) < 30
+
+    # Only new blocks are scanned, also after restart
+    indexer = log_indexer.start(None, tmp_path / 'logs.sqlite')
+    event.requests.clear()
+    w3.finalized, w3.latest = 52_000, 52_100
+    logs = indexer.get_logs(w3, event, filters)
+    assert [log['blockNumber'] for log in logs] == list(range(0, 52_001, 1000))
+    assert min(frm for (frm, _) in event.requests) == 50_001
+
+def test_indexer_does_not_store_unfinalized_blocks(tmp_path):
+    indexer = log_indexer.start(None, tmp_path / 'logs.sqlite')
+    event = FakeEvent(max_range=10**9)
+    filters = {'to': '0x0000000000000000000000000000000000000002'}
+
+    logs = indexer.get_logs(FakeW3(finalized=1500, latest=2500), event, filters)
+    assert [log['blockNumber'] for log in logs] == [0, 1000, 2000]
+
+    # Block 2000 was re-orged away
+    logs = indexer.get_logs(FakeW3(finalized=1500, latest=1999), event, filters)
+    assert [log['blockNumber'] for log in logs] == [0, 1000]
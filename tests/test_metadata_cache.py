@@ -0,0 +1,43 @@
+import pytest
+
+from lps import erc20, metadata_cache
+from lps.metadata_cache import TokenMeta, PoolMeta
+
+WETH = '0x4200000000000000000000000000000000000006'
+USDC = '0x833589fCD6eDb6E08f4c7C32D4f71b54bdA02913'
+POOL = '0xb2cc224c1c9feE385f8ad6a55b4d94E92359DC59'
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = metadata_cache.start(tmp_path / 'metadata.sqlite')
+    monkeypatch.setattr(metadata_cache, '_default', cache)
+    erc20.fetch_erc20_details_cached.cache_clear()
+    yield cache
+    erc20.fetch_erc20_details_cached.cache_clear()
+
+def test_cache_persists_and_invalidates(tmp_path, cache):
+    cache.put_token(8453, TokenMeta(address=WETH, name='Wrapped Ether', symbol='WETH', decimals=18))
+    cache.put_pool(8453, PoolMeta(address=POOL, token0=WETH, token1=USDC, tick_spacing=100, fee_pips=400))
+
+    # Keyed by chain id and checksummed address
+    reopened = metadata_cache.start(tmp_path / 'metadata.sqlite')
+    assert reopened.get_token(8453, WETH.lower()).symbol == 'WETH'
+    assert reopened.get_token(1, WETH) is None
+    assert reopened.get_pool(8453, WETH, USDC.lower(), 100).fee_pips == 400
+    assert reopened.get_pool(8453, WETH, USDC, 200) is None
+
+    reopened.invalidate_pool(8453, POOL.lower())
+    assert reopened.get_pool(8453, WETH, USDC, 100) is None
+    assert reopened.get_token(8453, WETH) is not None
+    reopened.clear()
+    assert reopened.get_token(8453, WETH) is None
+
+def test_token_details_without_rpc(local_w3, cache):
+    # Nothing is deployed on the local chain, details can only come from the cache
+    chain_id = local_w3.eth.chain_id
+    cache.put_token(chain_id, TokenMeta(address=WETH, name='Wrapped Ether', symbol='WETH', decimals=18))
+
+    token = erc20.fetch_erc20_details_cached(local_w3, WETH)
+    assert (token.symbol, token.decimals, token.address) == ('WETH', 18, WETH)
+    assert token.chain_id == chain_id
+    assert hash(token) == hash((chain_id, WETH))
@@ -0,0 +1,80 @@
+import threading
+import time
+import urllib.request
+
+import pytest
+from web3 import Web3
+
+from lps import metrics
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+def test_rolling_quantiles():
+    for i in range(1, 101):
+        metrics.observe('stage', i / 1000)
+
+    hist = metrics.get_histogram('stage')
+    assert hist.count == 100
+    assert hist.sum == pytest.approx(5.05)
+    assert hist.quantiles() == {0.5: 0.051, 0.95: 0.096, 0.99: 0.1}
+
+    # Old samples leave the window, totals are kept
+    for _ in range(metrics.WINDOW_SIZE):
+        metrics.observe('stage', 1.0)
+    assert hist.quantiles() == {0.5: 1.0, 0.95: 1.0, 0.99: 1.0}
+    assert hist.count == 100 + metrics.WINDOW_SIZE
+
+def test_span():
+    with metrics.span('sleep'):
+        time.sleep(0.01)
+    with pytest.raises(ValueError):
+        with metrics.span('sleep'):
+            raise ValueError()
+
+    hist = metrics.get_histogram('sleep')
+    assert hist.count == 2
+    assert hist.samples[0] >= 0.01
+
+def test_updates_from_threads():
+    def update():
+        for _ in range(10_000):
+            metrics.inc('orders')
+            with metrics.span('empty'):
+                pass
+
+    threads = [threading.Thread(target=update) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert metrics.get_counter('orders') == 80_000
+    assert metrics.get_histogram('empty').count == 80_000
+
+def test_rpc_calls_counter():
+    w3 = Web3(Web3.EthereumTesterProvider())
+    w3.middleware_onion.add(metrics.rpc_counter_middleware, 'rpc_counter')
+    w3.eth.get_block_number()
+    w3.eth.get_block('latest')
+    assert metrics.get_counter('rpc_calls') == 2
+
+def test_metrics_endpoint():
+    metrics.observe('slot0', 0.02)
+    metrics.inc('orders', 3)
+    metrics.inc('order_retries')
+
+    server = metrics.start_server(0, host='127.0.0.1')
+    try:
+        url = f'http://127.0.0.1:{server.server_address[1]}/metrics'
+        body = urllib.request.urlopen(url, timeout=5).read().decode()
+    finally:
+        server.shutdown()
+
+    assert 'lps_stage_seconds{stage="slot0",quantile="0.99"} 0.020000' in body
+    assert 'lps_stage_seconds_count{stage="slot0"} 1' in body
+    assert 'lps_orders_total 3' in body
+    assert 'lps_order_retries_total 1' in body
@@ -0,0 +1,95 @@
+import attrs
+import pytest
+from web3 import Web3
+from web3.providers.base import BaseProvider
+
+from lps import aerodrome, multicall, sweep
+from lps.contracts import create_contract_cached
+
+POOLS = [Web3.to_checksum_address(f'0x{i:040x}') for i in (1, 2, 3)]
+# Reverts on every call
+BROKEN_POOL = POOLS[2]
+
+class _Multicall3Node(BaseProvider):
+    """Node which executes Multicall3 aggregate3 over pools with a known slot0"""
+
+    def __init__(self):
+        super().__init__()
+        self.w3 = Web3()
+        self.multicall = create_contract_cached(
+            self.w3, 'multicall3.json', address=multicall.MULTICALL3_ADDRESS)
+        self.pool = create_contract_cached(self.w3, 'aerodrome_cl_pool.json')
+        self.requests = []
+
+    def _slot0(self, pool: str) -> tuple:
+        return (2**96 * (POOLS.index(pool) + 1), -200_000 + POOLS.index(pool), 1, 2, 3, True)
+
+    def make_request(self, method, params):
+        if method == 'eth_chainId':
+            return {'jsonrpc': '2.0', 'id': 0, 'result': hex(8453)}
+        assert method == 'eth_call'
+        (tx, block) = params
+        assert Web3.to_checksum_address(tx['to']) == multicall.MULTICALL3_ADDRESS
+        (func, args) = self.multicall.decode_function_input(tx['data'])
+        assert func.fn_name == 'aggregate3'
+        calls = [(c['target'], c['allowFailure'], c['callData']) for c in args['calls']]
+        self.requests.append((block, calls))
+
+        results = []
+        for (target, allow_failure, call_data) in calls:
+            (pool_func, _) = self.pool.decode_function_input(call_data)
+            assert pool_func.fn_name == 'slot0'
+            if target == BROKEN_POOL:
+                if not allow_failure:
+                    return {'jsonrpc': '2.0', 'id': 0,
+                            'error': {'code': 3, 'message': 'execution reverted: Multicall3: call failed'}}
+                results.append((False, b''))
+                continue
+            output_types = ['uint160', 'int24', 'uint16', 'uint16', 'uint16', 'bool']
+            results.append((True, self.w3.codec.encode(output_types, self._slot0(target))))
+        data = self.w3.codec.encode(['(bool,bytes)[]'], [results])
+        return {'jsonrpc': '2.0', 'id': 0, 'result': Web3.to_hex(data)}
+
+@pytest.fixture
+def node() -> _Multicall3Node:
+    return _Multicall3Node()
+
+def _slot0_call(w3: Web3, pool: str):
+    return create_contract_cached(w3, 'aerodrome_cl_pool.json', address=pool).functions.slot0()
+
+def test_aggregate3_encodes_and_decodes(node):
+    w3 = Web3(node)
+    results = multicall.aggregate3(w3, [_slot0_call(w3, pool) for pool in POOLS[:2]], block=123)
+
+    assert results == [node._slot0(POOLS[0]), node._slot0(POOLS[1])]
+    [(block, calls)] = node.requests
+    assert block == hex(123)
+    assert [(target, allow_failure) for target, allow_failure, _ in calls] == \
+        [(POOLS[0], False), (POOLS[1], False)]
+
+def test_aggregate3_failed_calls(node):
+    w3 = Web3(node)
+    calls = [_slot0_call(w3, pool) for pool in POOLS]
+    assert multicall.aggregate3(w3, calls, allow_failure=True) == \
+        [node._slot0(POOLS[0]), node._slot0(POOLS[1]), None]
+    with pytest.raises(Exception, match='Multicall3: call failed'):
+        multicall.aggregate3(w3, calls)
+
+def test_aggregate3_no_calls(node):
+    assert multicall.aggregate3(Web3(node), []) == []
+    assert node.requests == []
+
+def test_slot0_batched(node):
+    w3 = Web3(node)
+    template = sweep.make_position(1600, sweep.SweepParams()).pool
+    pools = [
+        attrs.evolve(template, contract=create_contract_cached(w3, 'aerodrome_cl_pool.json', address=pool))
+        for pool in (POOLS[1], POOLS[0], POOLS[1])]
+
+    assert aerodrome.get_slot0_batched(w3, pools, block=5) == {
+        POOLS[1]: aerodrome.CLPoolInfo.Slot0(*node._slot0(POOLS[1])),
+        POOLS[0]: aerodrome.CLPoolInfo.Slot0(*node._slot0(POOLS[0])),
+    }
+    # Every pool is queried once
+    [(_, calls)] = node.requests
+    assert [target for target, _, _ in calls] == [POOLS[1], POOLS[0]]
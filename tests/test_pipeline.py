@@ -0,0 +1,143 @@
+import asyncio
+import functools
+import time
+from decimal import Decimal
+
+import attrs
+import numpy as np
+import pytest
+
+from lps import hedger, pipeline, portfolio
+from lps.connectors import mock_cex
+from lps.connectors.base import BlockHeader
+from lps.utils import v3_math
+
+THRESHOLD = 50
+
+def _ticks(pos, num_blocks: int) -> list[int]:
+    rng = np.random.default_rng(1)
+    return (pos.tick_lower - 200 + np.cumsum(rng.integers(-20, 21, num_blocks))
+            + np.linspace(0, pos.tick_upper - pos.tick_lower + 400, num_blocks).astype(int)).tolist()
+
+def _set_mid(cex: mock_cex.MockCEX, tick: int):
+    cex.set_mid_prices({'ETH': v3_math.tick_to_price(tick) * 10**12})
+
+def _sequential_loop(pos, ticks: list[int]) -> (mock_cex.MockCEX, int):
+    """Same as the hedger loop before the pipeline"""
+    cex = mock_cex.start(2000)
+    bands = hedger.NoTradeBands(max_age_sec=60)
+    trade_count = 0
+    for tick in ticks:
+        _set_mid(cex, tick)
+        if bands.contains([tick]):
+            continue
+        hedges = hedger.compute_hedges_fixed_step([(pos, tick)], threshold=THRESHOLD)
+        adjustments = hedger.compute_hedge_adjustments(cex, hedges)
+        updated_cnt = hedger.execute_hedge_adjustements(cex, adjustments)
+        trade_count += updated_cnt
+        if updated_cnt == len(adjustments):
+            bands.set([hedger.no_trade_band_fixed_step(pos, tick, THRESHOLD)])
+        else:
+            bands.clear()
+    return cex, trade_count
+
+@attrs.define
+class _SlowCEX(mock_cex.MockCEX):
+    """Order acks take `order_delay_sec`"""
+    order_delay_sec: float = 0
+    is_down: bool = False
+    orders_done_at: list[float] = attrs.field(factory=list)
+
+    def market_orders(self, orders: dict[str, Decimal]) -> dict[str, Decimal]:
+        time.sleep(self.order_delay_sec)
+        if self.is_down:
+            raise mock_cex.MockConnectorError('exchange is down')
+        ret = super().market_orders(orders)
+        self.orders_done_at.append(time.monotonic())
+        return ret
+
+def _pipeline(pos, cex, ticks: list[int], reads_at: list[float] | None = None) -> pipeline.HedgePipeline:
+    async def read_ticks(block: BlockHeader) -> dict[str, int]:
+        if reads_at is not None:
+            reads_at.append(time.monotonic())
+        _set_mid(cex, ticks[block.number])
+        return {pos.pool.address: ticks[block.number]}
+
+    return pipeline.HedgePipeline(
+        exchange=pipeline.AsyncExchange(cex),
+        portfolio=portfolio.start(
+            functools.partial(hedger.amounts_to_hedge_fixed_step, threshold=THRESHOLD), [pos]),
+        bands=hedger.NoTradeBands(max_age_sec=60),
+        read_ticks=read_ticks,
+        threshold=THRESHOLD)
+
+def test_same_trades_as_sequential_loop(pos):
+    ticks = _ticks(pos, 300)
+    (expected_cex, expected_trades) = _sequential_loop(pos, ticks)
+
+    cex = _SlowCEX(usd_balance=Decimal(2000))
+    hedge_pipeline = _pipeline(pos, cex, ticks)
+    async def run():
+        for number in range(len(ticks)):
+            await hedge_pipeline.process_block(BlockHeader(number=number, timestamp=number))
+            # Orders are filled at the mids of the block, as in the sequential loop
+            await hedge_pipeline.drain()
+    asyncio.run(run())
+
+    assert len(cex.orders_done_at) == expected_trades > 2
+    assert cex.position_sizes == expected_cex.position_sizes
+    assert cex.usd_balance == expected_cex.usd_balance
+
+def test_next_block_is_read_while_orders_wait_for_acks(pos):
+    # Below the range, everything is hedged at once
+    ticks = [pos.tick_lower - 500] * 3
+    cex = _SlowCEX(usd_balance=Decimal(2000), order_delay_sec=0.5)
+    reads_at = []
+    hedge_pipeline = _pipeline(pos, cex, ticks, reads_at)
+
+    async def run():
+        started = time.monotonic()
+        await hedge_pipeline.process_block(BlockHeader(number=0, timestamp=0))
+        assert time.monotonic() - started < 0.3
+        # Exchange state of the next block is read after the fills
+        await hedge_pipeline.process_block(BlockHeader(number=1, timestamp=2))
+        await hedge_pipeline.process_block(BlockHeader(number=2, timestamp=4))
+        await hedge_pipeline.drain()
+    asyncio.run(run())
+
+    assert len(cex.orders_done_at) == 1
+    assert reads_at[1] < cex.orders_done_at[0]
+    assert cex.position_sizes['ETH'] < 0
+    assert hedge_pipeline.bands.is_active()
+
+def test_failed_orders_raise_on_next_block(pos):
+    ticks = [pos.tick_lower - 500] * 2
+    cex = _SlowCEX(usd_balance=Decimal(2000), is_down=True)
+    hedge_pipeline = _pipeline(pos, cex, ticks)
+
+    async def run():
+        await hedge_pipeline.process_block(BlockHeader(number=0, timestamp=0))
+        with pytest.raises(mock_cex.MockConnectorError):
+            await hedge_pipeline.process_block(BlockHeader(number=1, timestamp=2))
+        await hedge_pipeline.reset()
+    asyncio.run(run())
+    assert not hedge_pipeline.bands.is_active()
+
+def test_position_added_while_orders_in_flight(pos):
+    ticks = [pos.tick_lower - 500] * 2
+    cex = _SlowCEX(usd_balance=Decimal(2000), order_delay_sec=0.5)
+    hedge_pipeline = _pipeline(pos, cex, ticks)
+
+    async def run():
+        await hedge_pipeline.process_block(BlockHeader(number=0, timestamp=0))
+        # Blocks aren't skipped against the bands of the previous block meanwhile
+        assert not hedge_pipeline.bands.is_active()
+        hedge_pipeline.portfolio.add_position(attrs.evolve(pos, nft_id=pos.nft_id + 1))
+        hedge_pipeline.bands.clear()
+        # Bands computed for a single position are dropped
+        await hedge_pipeline.process_block(BlockHeader(number=1, timestamp=2))
+        await hedge_pipeline.drain()
+    asyncio.run(run())
+
+    assert len(cex.orders_done_at) == 2
+    assert len(hedge_pipeline.bands.bands) == 2
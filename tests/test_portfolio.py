@@ -0,0 +1,86 @@
+import functools
+import random
+from decimal import Decimal
+
+import attrs
+import pytest
+from web3 import Web3
+
+from lps import hedger, portfolio
+
+
+def _make_positions(make_position, num_pools: int, per_pool: int):
+    positions = []
+    for p in range(num_pools):
+        template = make_position(pool=Web3.to_checksum_address(f'0x{p + 1:040x}'))
+        for i in range(per_pool):
+            positions.append(attrs.evolve(
+                template, nft_id=p * per_pool + i,
+                tick_lower=template.tick_lower - 100 * (i % 5),
+                tick_upper=template.tick_upper + 100 * (i % 3)))
+    return positions
+
+@pytest.mark.parametrize('amounts_fn, compute_hedges', [
+    (hedger.amounts_to_hedge, hedger.compute_hedges),
+    (functools.partial(hedger.amounts_to_hedge_fixed_step, threshold=100),
+     functools.partial(hedger.compute_hedges_fixed_step, threshold=100)),
+])
+def test_matches_compute_hedges(make_position, amounts_fn, compute_hedges):
+    positions = _make_positions(make_position, num_pools=4, per_pool=10)
+    pools = sorted({pos.pool.address for pos in positions})
+    pf = portfolio.start(amounts_fn, positions)
+    assert pf.hedges() == {}
+
+    rnd = random.Random(1)
+    ticks = {pool: -193400 for pool in pools}
+    for _ in range(50):
+        ticks[rnd.choice(pools)] = rnd.randint(-195000, -191500)
+        pf.update_ticks(ticks)
+
+        expected = compute_hedges([(pos, ticks[pos.pool.address]) for pos in positions])
+        actual = pf.hedges()
+        assert actual.keys() == expected.keys()
+        for symbol in expected:
+            assert actual[symbol] == pytest.approx(expected[symbol], rel=Decimal('1e-20'), abs=Decimal('1e-20'))
+
+def test_only_changed_pools_are_recomputed(make_position):
+    positions = _make_positions(make_position, num_pools=10, per_pool=100)
+    calls = []
+    def amounts_fn(pos, tick):
+        calls.append(pos.nft_id)
+        return hedger.amounts_to_hedge(pos, tick)
+
+    pf = portfolio.start(amounts_fn, positions)
+    pools = sorted({pos.pool.address for pos in positions})
+    assert pf.update_ticks({pool: -193400 for pool in pools}) == {'ETH'}
+    assert len(calls) == 1000
+
+    calls.clear()
+    ticks = {pool: -193400 for pool in pools} | {pools[3]: -193500}
+    assert pf.update_ticks(ticks) == {'ETH'}
+    assert sorted(calls) == list(range(300, 400))
+    assert len(pf.positions_of_symbol('ETH')) == 1000
+
+    calls.clear()
+    assert pf.update_ticks(ticks) == set()
+    assert calls == []
+
+def test_add_and_remove_positions(make_position):
+    positions = _make_positions(make_position, num_pools=2, per_pool=2)
+    pool = positions[0].pool.address
+    pf = portfolio.start(hedger.amounts_to_hedge, positions[:1])
+    pf.update_ticks({pool: -193400})
+    single = pf.hedges()['ETH']
+
+    # Added position uses the known pool tick
+    pf.add_position(positions[1])
+    assert pf.hedges()['ETH'] == hedger.compute_hedges(
+        [(positions[0], -193400), (positions[1], -193400)])['ETH']
+
+    pf.remove_position(positions[1].nft_id)
+    assert pf.hedges()['ETH'] == single
+    assert pf.positions_of_pool(pool) == [positions[0]]
+
+    # Removing the last position removes the symbol
+    pf.remove_position(positions[0].nft_id)
+    assert pf.hedges() == {}
@@ -0,0 +1,152 @@
+import json
+
+import attrs
+from web3 import Web3
+from web3.providers import BaseProvider
+
+from lps import position_index
+from lps.utils.config import get_config
+
+USER = '0x00000000000000000000000000000000000000aa'
+OTHER = '0x00000000000000000000000000000000000000bb'
+GAUGE = '0x00000000000000000000000000000000000000cc'
+FOREIGN = '0x00000000000000000000000000000000000000dd'
+ZERO = '0x0000000000000000000000000000000000000000'
+
+TRANSFER = Web3.keccak(text='Transfer(address,address,uint256)').hex()
+DEPOSIT = Web3.keccak(text='Deposit(address,uint256,uint128)').hex()
+WITHDRAW = Web3.keccak(text='Withdraw(address,uint256,uint128)').hex()
+
+def _topic(value: str | int) -> str:
+    if isinstance(value, str):
+        value = int(value, 16)
+    return '0x' + value.to_bytes(32, 'big').hex()
+
+@attrs.define
+class Chain:
+    """Serves eth_getLogs from the given logs, filtering them like a node"""
+    logs: list[dict] = attrs.field(factory=list)
+    finalized: int = 0
+    latest: int = 0
+    get_logs_ranges: list = attrs.field(factory=list)
+
+    def add(self, block: int, address: str, topics: list[str]):
+        self.logs.append({
+            'address': address, 'topics': topics, 'data': '0x',
+            'blockNumber': hex(block), 'logIndex': hex(len(self.logs)),
+            'transactionHash': _topic(block), 'transactionIndex': '0x0',
+            'blockHash': _topic(block), 'removed': False,
+        })
+
+    def transfer(self, block: int, frm: str, to: str, token_id: int):
+        nft_manager = get_config().aerodrome.nft_position_manager
+        self.add(block, nft_manager, [TRANSFER, _topic(frm), _topic(to), _topic(token_id)])
+
+    def stake(self, block: int, user: str, token_id: int, deposit: bool = True):
+        self.transfer(block, *((user, GAUGE) if deposit else (GAUGE, user)), token_id)
+        self.add(block, GAUGE, [DEPOSIT if deposit else WITHDRAW, _topic(user), _topic(token_id), _topic(1)])
+
+    def get_logs(self, flt: dict) -> list[dict]:
+        self.get_logs_ranges.append((int(flt['fromBlock'], 16), int(flt['toBlock'], 16)))
+
+        def matches(log):
+            addresses = flt.get('address') or []
+            addresses = [addresses] if isinstance(addresses, str) else addresses
+            if addresses and log['address'].lower() not in map(str.lower, addresses):
+                return False
+            if not int(flt['fromBlock'], 16) <= int(log['blockNumber'], 16) <= int(flt['toBlock'], 16):
+                return False
+            return all(
+                want is None or log['topics'][i] in (want if isinstance(want, list) else [want])
+                for i, want in enumerate(flt['topics']))
+        return [log for log in self.logs if matches(log)]
+
+class ChainProvider(BaseProvider):
+    def __init__(self, chain: Chain):
+        self.chain = chain
+
+    def make_request(self, method, params):
+        params = json.loads(Web3.to_json(params)) # same as sent over http
+        if method == 'eth_getLogs':
+            result = self.chain.get_logs(params[0])
+        elif method == 'eth_blockNumber':
+            result = hex(self.chain.latest)
+        elif method == 'eth_getBlockByNumber':
+            assert params[0] == 'finalized'
+            result = {'number': hex(self.chain.finalized)}
+        else:
+            assert False, method
+        return {'jsonrpc': '2.0', 'id': 1, 'result': result}
+
+def test_index_tracks_held_and_staked_positions(tmp_path):
+    chain = Chain()
+    w3 = Web3(ChainProvider(chain))
+    index = position_index.start(w3, [USER], path=tmp_path / 'positions.sqlite')
+
+    chain.transfer(10, ZERO, USER, 1) # mint
+    chain.transfer(11, ZERO, USER, 2)
+    chain.transfer(12, ZERO, OTHER, 3) # someone else's
+    chain.stake(13, USER, 2)
+    chain.transfer(14, ZERO, USER, 4)
+    chain.transfer(15, USER, ZERO, 4) # burn
+    chain.finalized, chain.latest = 20, 20
+
+    index.update()
+    assert index.token_ids(USER) == {1, 2}
+    assert index.token_ids(USER.upper().replace('X', 'x')) == {1, 2}
+
+    # Unstaked and sent away, not finalized yet
+    chain.stake(21, USER, 2, deposit=False)
+    chain.transfer(22, USER, OTHER, 2)
+    chain.transfer(23, OTHER, USER, 3)
+    chain.latest = 25
+    index.update()
+    assert index.token_ids(USER) == {1, 3}
+
+    # Transfer of 3 was re-orged away
+    chain.logs.pop()
+    index.update()
+    assert index.token_ids(USER) == {1}
+
+    # Reads don't touch the node
+    chain.get_logs_ranges.clear()
+    assert index.token_ids(USER) == {1}
+    assert chain.get_logs_ranges == []
+
+def test_index_resumes_from_checkpoint(tmp_path):
+    chain = Chain()
+    w3 = Web3(ChainProvider(chain))
+    chain.transfer(10, ZERO, USER, 1)
+    chain.stake(11, USER, 1)
+    chain.finalized, chain.latest = 100, 110
+    position_index.start(w3, [USER], path=tmp_path / 'positions.sqlite').update()
+
+    chain.transfer(120, ZERO, USER, 2)
+    chain.finalized, chain.latest = 200, 210
+    chain.get_logs_ranges.clear()
+    index = position_index.start(w3, [USER], path=tmp_path / 'positions.sqlite')
+    assert index.token_ids(USER) == {1}
+
+    index.update()
+    assert index.token_ids(USER) == {1, 2}
+    # Only the blocks after the stored checkpoint are scanned
+    assert min(frm for (frm, _) in chain.get_logs_ranges) == 101
+
+def test_foreign_deposit_logs_are_ignored(tmp_path):
+    chain = Chain()
+    w3 = Web3(ChainProvider(chain))
+    index = position_index.start(w3, [USER], path=tmp_path / 'positions.sqlite')
+
+    chain.transfer(10, ZERO, USER, 1)
+    chain.stake(11, USER, 1)
+    # Other contract with the same event signature, no NFT moved
+    chain.add(12, FOREIGN, [DEPOSIT, _topic(USER), _topic(7), _topic(1)])
+    chain.add(13, FOREIGN, [WITHDRAW, _topic(USER), _topic(1), _topic(1)])
+    # NFT moved to the gauge, but the log is from another contract
+    chain.transfer(14, ZERO, USER, 2)
+    chain.transfer(15, USER, GAUGE, 2)
+    chain.add(15, FOREIGN, [DEPOSIT, _topic(USER), _topic(2), _topic(1)])
+    chain.finalized, chain.latest = 20, 20
+
+    index.update()
+    assert index.token_ids(USER) == {1}
@@ -0,0 +1,74 @@
+import functools
+from decimal import Decimal
+
+import attrs
+import numpy as np
+import pytest
+
+from lps import hedger, replay
+from lps.connectors import mock_cex
+from lps.replay import BlockRecord
+
+
+def _history(pos, num_blocks: int, seed: int = 1) -> list[BlockRecord]:
+    """Random walk of the tick, mid changes every 30 blocks like 1m candles"""
+    rng = np.random.default_rng(seed)
+    ticks = pos.tick_lower - 200 + np.cumsum(rng.integers(-3, 4, num_blocks)) \
+        + np.linspace(0, pos.tick_upper - pos.tick_lower + 400, num_blocks).astype(int)
+    mid_ticks = ticks[np.arange(num_blocks) // 30 * 30]
+    mids = 1.0001 ** mid_ticks * 10**12
+    return [
+        BlockRecord(number=100 + i, timestamp=1_700_000_000 + 2 * i,
+                    ticks={pos.pool.address: int(ticks[i])}, mids={'ETH': round(float(mids[i]), 2)})
+        for i in range(num_blocks)]
+
+def _reference_replay(pos, history, hedge_computer) -> (Decimal, int):
+    """Straightforward loop over every block, same as the hedger main loop"""
+    cex = mock_cex.start(2000)
+    trade_count = 0
+    for block in history:
+        cex.set_mid_prices({s: Decimal(repr(m)) for s, m in block.mids.items()})
+        hedges = hedge_computer([(pos, block.ticks[pos.pool.address])])
+        adjustments = hedger.compute_hedge_adjustments(cex, hedges)
+        trade_count += hedger.execute_hedge_adjustements(cex, adjustments)
+    return cex.get_total_balance() - 2000, trade_count
+
+@pytest.mark.parametrize('hedge_computer', [
+    hedger.compute_hedges,
+    functools.partial(hedger.compute_hedges_fixed_step, threshold=50),
+])
+def test_replay_same_as_every_block_loop(pos, hedge_computer):
+    history = _history(pos, 3000)
+    result = replay.replay([pos], history, hedge_computer)
+
+    (hedge_pnl, trade_count) = _reference_replay(pos, history, hedge_computer)
+    assert result.trade_count == trade_count > 0
+    assert result.hedge_pnl == hedge_pnl
+    assert (result.first_block, result.last_block, result.blocks) == (100, 3099, 3000)
+    # Deposit is 1000$ at the center, path starts below the range and ends above it
+    assert 800 < result.starting_pos_value < 1000 < result.final_pos_value < 1100
+
+def test_history_is_streamed_from_disk(tmp_path, pos):
+    history = _history(pos, 1000)
+    pool = pos.pool.address
+    writer = replay.open_writer(tmp_path / 'history.parquet', [pool], ['ETH'])
+    for chunk in (history[:600], history[600:]):
+        writer.write(
+            np.array([b.number for b in chunk]),
+            np.array([b.timestamp for b in chunk]),
+            {pool: np.array([b.ticks[pool] for b in chunk], dtype=np.int32)},
+            {'ETH': np.array([b.mids['ETH'] for b in chunk])})
+    writer.close()
+
+    assert list(replay.read_history(tmp_path / 'history.parquet', batch_blocks=128)) == history
+
+    result = replay.replay(
+        [pos], replay.read_history(tmp_path / 'history.parquet'), hedger.compute_hedges)
+    assert result.hedge_pnl == replay.replay([pos], history, hedger.compute_hedges).hedge_pnl
+
+def test_forward_fill_ticks():
+    # Swaps at blocks 1, 1 and 4 of 6 blocks, last swap of the block wins
+    ticks = replay._forward_fill_ticks(
+        -100, 6, np.array([1, 1, 4]), np.array([-101, -102, -99]))
+    assert ticks.tolist() == [-100, -102, -102, -102, -99, -99]
+    assert replay._forward_fill_ticks(5, 3, np.array([], dtype=np.int64), np.array([])).tolist() == [5, 5, 5]
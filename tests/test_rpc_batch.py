@@ -0,0 +1,68 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+from hexbytes import HexBytes
+from web3 import Web3
+
+from lps import rpc_batch
+
+
+@pytest.fixture
+def batch_node():
+    """Local JSON-RPC stand-in, records sizes of the received batches"""
+    batches = []
+
+    def handle(req):
+        if req['method'] == 'eth_getBlockByNumber':
+            number = 1_000_000 if req['params'][0] == 'finalized' else int(req['params'][0], 16)
+            return {'number': hex(number), 'timestamp': hex(number * 2)}
+        if req['method'] == 'eth_getTransactionByHash':
+            return {'hash': req['params'][0], 'blockNumber': '0x10',
+                    'from': '0x' + '11' * 20, 'to': None, 'input': '0xabcd'}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            batches.append(len(payload))
+            body = json.dumps([
+                {'jsonrpc': '2.0', 'id': req['id'], 'result': handle(req)}
+                for req in reversed(payload)
+            ]).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}', batches
+    server.shutdown()
+
+def test_block_timestamps_are_batched_and_cached(batch_node):
+    (url, batches) = batch_node
+    rpc = rpc_batch.start(Web3(Web3.HTTPProvider(url)), batch_size=10)
+
+    timestamps = rpc.get_block_timestamps(range(100, 125))
+    assert timestamps == {b: b * 2 for b in range(100, 125)}
+    assert batches == [10, 10, 5]
+
+    # Cached blocks are not requested again, tags always are
+    timestamps = rpc.get_block_timestamps([100, 101, 200, 'finalized'])
+    assert timestamps == {100: 200, 101: 202, 200: 400, 'finalized': 2_000_000}
+    assert batches == [10, 10, 5, 2]
+
+def test_transactions_are_batched(batch_node):
+    (url, batches) = batch_node
+    rpc = rpc_batch.start(Web3(Web3.HTTPProvider(url)), batch_size=10)
+
+    hashes = [HexBytes(i.to_bytes(32, 'big')) for i in range(15)]
+    txs = rpc.get_transactions(hashes + hashes[:3])
+    assert batches == [10, 5]
+    assert txs[hashes[3]]['hash'] == hashes[3]
+    assert txs[hashes[3]]['input'] == HexBytes('0xabcd')
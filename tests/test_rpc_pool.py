@@ -0,0 +1,180 @@
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+from web3 import Web3
+
+from lps import metrics
+from lps.connectors import rpc_pool
+
+class _Handler(BaseHTTPRequestHandler):
+    server: '_Node'
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        time.sleep(self.server.delay_sec)
+        self.server.requests.append(request['method'])
+        if request['method'] == 'eth_call' and int(request['params'][1], 16) > self.server.head:
+            # Same as geth for a block it hasn't seen yet
+            response = {'error': {'code': -32000, 'message': 'header not found'}}
+        else:
+            response = {'result': {
+                'eth_blockNumber': hex(self.server.head),
+                'eth_chainId': hex(8453),
+                'eth_call': '0x',
+            }[request['method']]}
+        data = json.dumps({'jsonrpc': '2.0', 'id': request['id'], **response}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class _Node(ThreadingHTTPServer):
+    """Stand-in node with the given head block and response delay"""
+    daemon_threads = True
+
+    def __init__(self, head: int, delay_sec: float):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.head = head
+        self.delay_sec = delay_sec
+        self.requests = []
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+@pytest.fixture
+def nodes():
+    nodes = []
+    def start(head: int, delay_sec: float) -> _Node:
+        nodes.append(_Node(head, delay_sec))
+        return nodes[-1]
+    yield start
+    for node in nodes:
+        node.stop()
+
+def test_routes_to_fresh_and_fast_node(nodes):
+    slow = nodes(head=100, delay_sec=0.05)
+    fast = nodes(head=100, delay_sec=0)
+    lagging = nodes(head=90, delay_sec=0)
+    provider = rpc_pool.RpcPoolProvider([slow.url, fast.url, lagging.url])
+    w3 = Web3(provider)
+
+    provider.poll_heads()
+    assert {e.url: e.head for e in provider.endpoints} == {slow.url: 100, fast.url: 100, lagging.url: 90}
+    assert [e.url for e in provider.ranked()] == [fast.url, slow.url]
+
+    for _ in range(5):
+        assert w3.eth.chain_id == 8453
+    assert fast.requests.count('eth_chainId') == 5
+    assert provider.endpoint_uri == fast.url
+
+    # Lagging node caught up
+    lagging.head = 101
+    provider.poll_heads()
+    assert [e.url for e in provider.ranked()][-1] == slow.url
+    provider.stop()
+
+def test_fails_over_and_drops_dead_node(nodes):
+    dead = nodes(head=100, delay_sec=0)
+    alive = nodes(head=100, delay_sec=0.01)
+    provider = rpc_pool.RpcPoolProvider([dead.url, alive.url], max_failures=2)
+    provider.poll_heads()
+    dead.stop()
+
+    w3 = Web3(provider)
+    for _ in range(3):
+        assert w3.eth.block_number == 100
+    assert [e.url for e in provider.ranked()] == [alive.url]
+    assert alive.requests.count('eth_blockNumber') == 4
+    provider.stop()
+
+CALL = {'to': '0x' + '11' * 20, 'data': '0x'}
+
+def test_reads_at_block_go_to_nodes_which_have_it(nodes):
+    fast = nodes(head=100, delay_sec=0)
+    ahead = nodes(head=102, delay_sec=0.01)
+    provider = rpc_pool.RpcPoolProvider([fast.url, ahead.url])
+    w3 = Web3(provider)
+    for _ in range(3):
+        provider.poll_heads()
+    assert [e.url for e in provider.ranked()] == [fast.url, ahead.url]
+
+    assert w3.eth.call(CALL, block_identifier=102) == b''
+    assert w3.eth.call(CALL, block_identifier=100) == b''
+    assert ahead.requests.count('eth_call') == 1
+    assert fast.requests.count('eth_call') == 1
+    provider.stop()
+
+def test_fails_over_when_node_doesnt_have_block(nodes):
+    fast = nodes(head=100, delay_sec=0)
+    other = nodes(head=100, delay_sec=0.01)
+    provider = rpc_pool.RpcPoolProvider([fast.url, other.url])
+    w3 = Web3(provider)
+    for _ in range(3):
+        provider.poll_heads()
+
+    # Block feed is ahead of the polled heads
+    other.head = 101
+    failovers_before = metrics.get_counter('rpc_failovers')
+    assert w3.eth.call(CALL, block_identifier=101) == b''
+    assert fast.requests.count('eth_call') == other.requests.count('eth_call') == 1
+    assert metrics.get_counter('rpc_failovers') == failovers_before + 1
+    provider.stop()
+
+def test_hedged_request_after_latency_percentile(nodes):
+    primary = nodes(head=100, delay_sec=0)
+    secondary = nodes(head=100, delay_sec=0.02)
+    provider = rpc_pool.RpcPoolProvider([primary.url, secondary.url], hedge_percentile=90)
+    w3 = Web3(provider)
+    for _ in range(rpc_pool.MIN_HEDGE_SAMPLES):
+        provider.poll_heads()
+    assert provider.ranked()[0].url == primary.url
+
+    # Primary stalls, secondary answers
+    primary.delay_sec = 1
+    hedged_before = metrics.get_counter('rpc_hedged_requests')
+    started = time.monotonic()
+    assert w3.eth.chain_id == 8453
+    assert time.monotonic() - started < 0.5
+    assert metrics.get_counter('rpc_hedged_requests') == hedged_before + 1
+    assert secondary.requests[-1] == 'eth_chainId'
+    provider.stop()
+
+def test_reads_over_hedge_capacity_are_not_queued(nodes):
+    primary = nodes(head=100, delay_sec=0)
+    secondary = nodes(head=100, delay_sec=0)
+    provider = rpc_pool.RpcPoolProvider(
+        [primary.url, secondary.url], hedge_percentile=90, max_hedged_reads=1)
+    w3 = Web3(provider)
+    for _ in range(rpc_pool.MIN_HEDGE_SAMPLES):
+        provider.poll_heads()
+
+    # Hedged read holds the only slot
+    primary.delay_sec = 0.3
+    secondary.delay_sec = 0.3
+    hedged = threading.Thread(target=lambda: w3.eth.chain_id)
+    hedged.start()
+    time.sleep(0.05)
+
+    # Next read is sent directly, slow node isn't hedged
+    by_url = {primary.url: primary, secondary.url: secondary}
+    ranked = provider.ranked()
+    by_url[ranked[0].url].delay_sec = 0.1
+    by_url[ranked[1].url].delay_sec = 0
+    hedged_before = metrics.get_counter('rpc_hedged_requests')
+    assert w3.eth.chain_id == 8453
+    assert metrics.get_counter('rpc_hedged_requests') == hedged_before
+    hedged.join()
+    provider.stop()
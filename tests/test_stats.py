@@ -0,0 +1,39 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import attrs
+
+from lps import stats
+
+@attrs.frozen
+class _Pool:
+    address: str
+
+class _Rpc:
+    def get_block_timestamps(self, blocks):
+        return {block: 1_700_000_000 + 2 * block for block in blocks}
+
+def test_historical_state_read_concurrently(monkeypatch):
+    pools = [_Pool('0xA'), _Pool('0xB')]
+    calls = []
+    lock = threading.Lock()
+    def get_slot0_batched(_w3, block_pools, block):
+        with lock:
+            calls.append((block, sorted(pool.address for pool in block_pools)))
+        time.sleep(0.2)
+        return {pool.address: stats.aerodrome.CLPoolInfo.Slot0(0, block + len(pool.address), 0, 0, 0, True)
+                for pool in block_pools}
+    monkeypatch.setattr(stats.aerodrome, 'get_slot0_batched', get_slot0_batched)
+
+    reads = [(block, pool) for block in range(100, 110) for pool in pools] + [(100, pools[0])]
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        state = stats.read_historical_state(None, _Rpc(), executor, reads)
+    # Sequential reads would take 2s
+    assert time.monotonic() - started < 1
+
+    # One multicall per block with all of its pools
+    assert sorted(calls) == [(block, ['0xA', '0xB']) for block in range(100, 110)]
+    assert state.timestamps == {block: 1_700_000_000 + 2 * block for block in range(100, 110)}
+    assert state.tick_at(105, pools[1]) == 108
@@ -0,0 +1,48 @@
+import pandas as pd
+import pytest
+
+from lps import sweep, backtest
+
+
+def test_make_grid():
+    points = sweep.make_grid(
+        strategies={'compute_hedges': [None], 'compute_hedges_fixed_step': [0, 20]},
+        sigmas_per_day=[0.02, 0.04],
+        rehedge_times_sec=[24],
+        widths_ticks=[800, 1600])
+    assert len(points) == 3 * 2 * 2
+    assert {p.threshold for p in points if p.strategy == 'compute_hedges'} == {None}
+
+def test_position_value():
+    params = sweep.SweepParams(deposit_usd=1000)
+    pos = sweep.make_position(1600, params)
+    assert (pos.tick_lower, pos.tick_upper) == (-194200, -192600)
+
+    prices = backtest.gbm_price_paths(4000, 0.0, 1, 1, 3600, seed=1)
+    res = backtest.run(pos, prices, sweep.STRATEGIES['compute_hedges'],
+                       max_unhedged_value=params.max_unhedged_value)
+    assert res.starting_pos_value[0] == pytest.approx(1000, rel=0.01)
+
+def test_run_sweep(tmp_path, monkeypatch):
+    monkeypatch.setattr(sweep, 'PATHS_PER_TASK', 5)
+    params = sweep.SweepParams(num_sims=12, num_days=1, step_len_sec=60)
+    points = sweep.make_grid(
+        strategies={'compute_hedges': [None], 'compute_hedges_fixed_step': [20]},
+        sigmas_per_day=[0.04],
+        rehedge_times_sec=[600],
+        widths_ticks=[1600])
+
+    df = sweep.run_sweep(points, params, max_workers=2)
+    assert len(df) == 2
+    assert (df['num_sims'] == 12).all()
+    # Same price paths for every strategy
+    assert df['pnl_no_hedge_mean'].nunique() == 1
+
+    # Matches a single process run over the same chunks
+    results = [sweep._run_task(points[0], params, n, params.seed + i)
+               for i, n in enumerate([5, 5, 2])]
+    pnl = pd.Series([x for r in results for x in r[0]])
+    assert df.loc[0, 'pnl_mean'] == pytest.approx(pnl.mean())
+
+    path = sweep.write_results(df, tmp_path / 'sweep.parquet')
+    pd.testing.assert_frame_equal(pd.read_parquet(path), df)
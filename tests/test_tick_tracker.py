@@ -0,0 +1,115 @@
+import json
+from pathlib import Path
+
+import attrs
+import pytest
+from hexbytes import HexBytes
+from web3 import Web3
+from web3.providers import BaseProvider
+
+from lps import tick_tracker, metrics
+from lps.aerodrome import CLPoolInfo
+from lps.connectors.base import BlockHeader
+
+FIXTURE = json.loads((Path(__file__).parent / 'fixtures' / 'swap_logs.json').read_text())
+
+
+class ReplayProvider(BaseProvider):
+    """Serves eth_getLogs from the recorded logs"""
+    def __init__(self, logs: list[dict]):
+        self.logs = logs
+        self.requests = []
+
+    def make_request(self, method, params):
+        assert method == 'eth_getLogs'
+        flt = json.loads(Web3.to_json(params[0])) # same as sent over http
+        self.requests.append(flt)
+        addresses = {a.lower() for a in flt['address']}
+
+        def matches(log):
+            if log['address'] not in addresses or log['topics'][0] != flt['topics'][0]:
+                return False
+            if 'blockHash' in flt:
+                return log['blockHash'] == flt['blockHash']
+            return int(flt['fromBlock'], 16) <= int(log['blockNumber'], 16) <= int(flt['toBlock'], 16)
+
+        return {'jsonrpc': '2.0', 'id': 1, 'result': [l for l in self.logs if matches(l)]}
+
+def _header(number: int, **overrides) -> BlockHeader:
+    h = next(h for h in FIXTURE['headers'] if int(h['number'], 16) == number)
+    return attrs.evolve(BlockHeader(
+        number=number,
+        timestamp=int(h['timestamp'], 16),
+        hash=HexBytes(h['hash']),
+        parent_hash=HexBytes(h['parentHash']),
+        logs_bloom=HexBytes(h['logsBloom'])), **overrides)
+
+@pytest.fixture
+def tracker(monkeypatch):
+    metrics.reset()
+    provider = ReplayProvider(FIXTURE['logs'])
+    w3 = Web3(provider)
+
+    slot0_reads = []
+    def get_slot0_batched(_w3, pools, block):
+        slot0_reads.append(block)
+        return {p.address: CLPoolInfo.Slot0(0, FIXTURE['slot0_ticks'][p.address], 0, 0, 0, True)
+                for p in pools}
+    monkeypatch.setattr(tick_tracker, 'get_slot0_batched', get_slot0_batched)
+
+    pools = [CLPoolInfo(token0=None, token1=None, tick_spacing=100, fee_pips=400,
+                        contract=w3.eth.contract(address=addr))
+             for addr in FIXTURE['pools']]
+    yield tick_tracker.start(w3, pools), provider, slot0_reads
+    metrics.reset()
+
+def test_ticks_from_swap_logs(tracker):
+    (tracker, provider, slot0_reads) = tracker
+    (a, b) = FIXTURE['pools']
+
+    assert tracker.update(_header(100)) == {a: -193400, b: -60000}
+    assert slot0_reads == [100]
+
+    # No swaps, nothing is requested
+    assert tracker.update(_header(101)) == {a: -193400, b: -60000}
+    assert provider.requests == []
+
+    # Tick after the last swap in the block
+    assert tracker.update(_header(102)) == {a: -193420, b: -60000}
+    assert provider.requests[-1]['blockHash'] == FIXTURE['headers'][2]['hash']
+
+    # Swap only on the untracked pool
+    assert tracker.update(_header(103)) == {a: -193420, b: -60000}
+    assert tracker.update(_header(104)) == {a: -193420, b: -60010}
+    assert len(provider.requests) == 2
+    assert metrics.get_counter('swap_blocks_skipped') == 2
+
+    # Skipped headers are read with a block range
+    assert tracker.update(_header(107)) == {a: -193450, b: -60010}
+    assert (provider.requests[-1]['fromBlock'], provider.requests[-1]['toBlock']) == ('0x69', '0x6b')
+    assert slot0_reads == [100]
+
+def test_resync_on_reorg(tracker):
+    (tracker, provider, slot0_reads) = tracker
+    (a, b) = FIXTURE['pools']
+
+    tracker.update(_header(101))
+    tracker.update(_header(102))
+    assert tracker.ticks[a] == -193420
+
+    # Block 103 doesn't build on top of our 102
+    tracker.update(_header(103, parent_hash=HexBytes('0x' + 'ff' * 32)))
+    assert slot0_reads == [101, 103]
+    assert tracker.ticks == {a: -193400, b: -60000}
+
+    # Same height again
+    tracker.update(_header(103))
+    assert slot0_reads == [101, 103, 103]
+
+def test_bloom_contains():
+    header = FIXTURE['headers'][2] # swaps on the first pool
+    bloom = HexBytes(header['logsBloom'])
+    assert tick_tracker.bloom_contains(bloom, tick_tracker.SWAP_TOPIC)
+    assert tick_tracker.bloom_contains(bloom, HexBytes(FIXTURE['pools'][0]))
+    assert not tick_tracker.bloom_contains(bloom, HexBytes(FIXTURE['pools'][1]))
+    assert not tick_tracker.bloom_contains(HexBytes(FIXTURE['headers'][1]['logsBloom']), tick_tracker.SWAP_TOPIC)
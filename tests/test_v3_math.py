@@ -0,0 +1,122 @@
+import math
+
+import numpy as np
+import pytest
+
+from lps.utils import v3_math
+
+
+def test_sqrt_prices_match_decimal():
+    ticks = np.array([v3_math.MIN_TICK, -194200, -1, 0, 1, 73400, v3_math.MAX_TICK])
+    expected = [float(v3_math.tick_to_sqrt_price(int(t))) for t in ticks]
+    assert v3_math.ticks_to_sqrt_prices(ticks) == pytest.approx(expected, rel=1e-12)
+    assert v3_math.ticks_to_prices(ticks[1:-1]) == pytest.approx(
+        [float(v3_math.tick_to_price(int(t))) for t in ticks[1:-1]], rel=1e-12)
+
+def test_sqrt_price_table():
+    table = v3_math.make_sqrt_price_table(-200000, -190000)
+    ticks = np.array([-200000, -194200, -193401, -190000])
+    assert table.tick_max == -190000
+    assert table(ticks) == pytest.approx(v3_math.ticks_to_sqrt_prices(ticks), rel=1e-15)
+
+def test_amounts_single_position_match_decimal():
+    tick_lower, tick_upper, liquidity = -194200, -192600, 180540158377974
+    ticks = np.arange(tick_lower - 300, tick_upper + 300, 7)
+    table = v3_math.make_sqrt_price_table(ticks[0], ticks[-1])
+
+    for sqrt_price in (v3_math.ticks_to_sqrt_prices, table):
+        (amount0, amount1) = v3_math.get_amounts_at_ticks(
+            tick_lower, tick_upper, liquidity, ticks, sqrt_price=sqrt_price)
+
+        for i, tick in enumerate(ticks):
+            (expected0, expected1) = v3_math.get_amounts_at_tick(
+                tick_lower, tick_upper, liquidity, int(tick))
+            assert amount0[i] == pytest.approx(float(expected0), rel=1e-12, abs=1e-3)
+            assert amount1[i] == pytest.approx(float(expected1), rel=1e-12, abs=1e-3)
+
+def test_amounts_many_positions_match_decimal():
+    tick_lower = np.array([-194200, -73400, -200, 100])
+    tick_upper = np.array([-192600, -72800, 200, 5000])
+    liquidity = np.array([180540158377974, 596712693584385284352, 10**18, 12345])
+    tick_current = np.array([-193400, -73500, 200, 4999])
+
+    (amount0, amount1) = v3_math.get_amounts_at_ticks(
+        tick_lower, tick_upper, liquidity, tick_current)
+
+    for i in range(len(tick_lower)):
+        (expected0, expected1) = v3_math.get_amounts_at_tick(
+            int(tick_lower[i]), int(tick_upper[i]), int(liquidity[i]), int(tick_current[i]))
+        assert amount0[i] == pytest.approx(float(expected0), rel=1e-12, abs=1e-3)
+        assert amount1[i] == pytest.approx(float(expected1), rel=1e-12, abs=1e-3)
+
+def test_fee_growth_inside():
+    Q128 = v3_math.Q128
+    # Outside of a tick is the growth on the other side of it from the current tick
+    assert v3_math.get_fee_growth_inside(-100, 100, -200, 50 * Q128, 30 * Q128, 10 * Q128) == 20 * Q128
+    assert v3_math.get_fee_growth_inside(-100, 100, 0, 50 * Q128, 30 * Q128, 10 * Q128) == 10 * Q128
+    assert v3_math.get_fee_growth_inside(-100, 100, 100, 50 * Q128, 5 * Q128, 40 * Q128) == 35 * Q128
+    # Outside is initialized to global for ticks below the current one, so inside wraps around
+    assert v3_math.get_fee_growth_inside(-100, 100, 0, 5, 3, 4) == 2 ** 256 - 2
+
+def test_fees_owed():
+    Q128 = v3_math.Q128
+    assert v3_math.get_fees_owed(3, 7 * Q128, 5 * Q128, 10) == 16
+    # Rounded down like FullMath.mulDiv
+    assert v3_math.get_fees_owed(2, Q128 // 3, 0, 0) == 0
+    # Fee growth wrapped around since the last update
+    assert v3_math.get_fees_owed(2, Q128, 2 ** 256 - Q128, 0) == 4
+
+def _encode_price_sqrt(reserve1: int, reserve0: int) -> int:
+    return math.isqrt((reserve1 << 192) // reserve0)
+
+def test_sqrt_ratio_at_tick_known_values():
+    # TickMath.MIN_SQRT_RATIO, MAX_SQRT_RATIO and values from TickMath tests
+    assert v3_math.get_sqrt_ratio_at_tick(v3_math.MIN_TICK) == 4295128739
+    assert v3_math.get_sqrt_ratio_at_tick(v3_math.MIN_TICK + 1) == 4295343490
+    assert v3_math.get_sqrt_ratio_at_tick(0) == 1 << 96
+    assert v3_math.get_sqrt_ratio_at_tick(50) == 79426470787362580746886972461
+    assert v3_math.get_sqrt_ratio_at_tick(v3_math.MAX_TICK - 1) == \
+        1461373636630004318706518188784493106690254656249
+    assert v3_math.get_sqrt_ratio_at_tick(v3_math.MAX_TICK) == \
+        1461446703485210103287273052203988822378723970342
+    with pytest.raises(ValueError):
+        v3_math.get_sqrt_ratio_at_tick(v3_math.MAX_TICK + 1)
+
+def test_tick_at_sqrt_ratio():
+    assert v3_math.get_tick_at_sqrt_ratio(v3_math.MIN_SQRT_RATIO) == v3_math.MIN_TICK
+    assert v3_math.get_tick_at_sqrt_ratio(4295343490) == v3_math.MIN_TICK + 1
+    assert v3_math.get_tick_at_sqrt_ratio(v3_math.MAX_SQRT_RATIO - 1) == v3_math.MAX_TICK - 1
+    with pytest.raises(ValueError):
+        v3_math.get_tick_at_sqrt_ratio(v3_math.MAX_SQRT_RATIO)
+
+    rng = np.random.default_rng(1)
+    for tick in (-194200, -1, 0, 1, *rng.integers(v3_math.MIN_TICK + 1, v3_math.MAX_TICK, 1000).tolist()):
+        sqrt_ratio = v3_math.get_sqrt_ratio_at_tick(tick)
+        assert v3_math.get_tick_at_sqrt_ratio(sqrt_ratio) == tick
+        assert v3_math.get_tick_at_sqrt_ratio(sqrt_ratio - 1) == tick - 1
+
+def test_amount_deltas_known_values():
+    # SqrtPriceMath tests, price 1 to 1.21 with 1e18 liquidity
+    (sa, sb) = (_encode_price_sqrt(1, 1), _encode_price_sqrt(121, 100))
+    assert v3_math.get_amount0_delta(sa, sb, 10**18, True) == 90909090909090910
+    assert v3_math.get_amount0_delta(sb, sa, 10**18, False) == 90909090909090909
+    assert v3_math.get_amount1_delta(sa, sb, 10**18, True) == 100000000000000000
+    assert v3_math.get_amount1_delta(sa, sb, 10**18, False) == 99999999999999999
+
+def test_liquidity_amounts_known_values():
+    # LiquidityAmounts tests
+    (sa, sb) = (_encode_price_sqrt(100, 110), _encode_price_sqrt(110, 100))
+    for (sqrt_price, liquidity, amounts) in (
+            (_encode_price_sqrt(1, 1), 2148, (99, 99)),
+            (_encode_price_sqrt(99, 110), 1048, (99, 0)),
+            (_encode_price_sqrt(111, 100), 2097, (0, 199))):
+        assert v3_math.get_liquidity_for_amounts(sqrt_price, sa, sb, 100, 200) == liquidity
+        assert v3_math.get_amounts_for_liquidity(sqrt_price, sa, sb, liquidity) == amounts
+
+def test_exact_amounts_match_decimal():
+    tick_lower, tick_upper, liquidity = -194200, -192600, 180540158377974
+    for tick in range(tick_lower - 300, tick_upper + 300, 7):
+        (amount0, amount1) = v3_math.get_amounts_at_tick_exact(tick_lower, tick_upper, liquidity, tick)
+        (expected0, expected1) = v3_math.get_amounts_at_tick(tick_lower, tick_upper, liquidity, tick)
+        assert amount0 == pytest.approx(float(expected0), rel=1e-12, abs=1)
+        assert amount1 == pytest.approx(float(expected1), rel=1e-12, abs=1)